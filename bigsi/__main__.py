@@ -17,17 +17,24 @@ from bigsi.version import __version__
 from bigsi.graph import BIGSI
 
 from bigsi.cmds.insert import insert
+from bigsi.cmds.insert import insert_many
 from bigsi.cmds.bloom import bloom
+from bigsi.cmds.bloom import bloom_batch
+from bigsi.cmds.bloom import read_bloom_batch_file
+from bigsi.cmds.bloom import read_sketch
+from bigsi.cmds.params import recommend_params
+from bigsi.cmds.params import DEFAULT_MAX_FALSE_DISCOVERY_RATE
+from bigsi.cmds.bloom import extract_kmer_codes
 from bigsi.cmds.build import build
 from bigsi.cmds.large_build import large_build
 from bigsi.cmds.merge import merge
+from bigsi.cmds.compact import compact
 from bigsi.cmds.merge_blooms import merge_blooms
 from bigsi.cmds.variant_search import BIGSIVariantSearch
 from bigsi.cmds.variant_search import BIGSIAminoAcidMutationSearch
 
 from bigsi.storage import get_storage
 
-from bigsi.utils.cortex import extract_kmers_from_ctx
 from bigsi.constants import DEFAULT_CONFIG
 
 logging.basicConfig(level=logging.DEBUG)
@@ -111,19 +118,156 @@ class bigsi(object):
         index = BIGSI(config)
         return insert(index=index, bloomfilter=bloomfilter, sample=sample)
 
+    @hug.object.cli
+    @hug.object.post("/insert_batch", output_format=hug.output_format.pretty_json)
+    def insert_batch(self, config: hug.types.text = None, from_file: hug.types.text = None):
+        """
+        Inserts many bloom filters into the graph in a single pass over its rows.
+
+        e.g. bigsi insert_batch --config config.yaml --from_file new_samples.tsv
+
+        :param  config: config file path
+        :type   config: basestring
+        :param  from_file: TSV file with a bloom filter path and a sample name on each line
+        :type   from_file: basestring
+        """
+        if from_file is None:
+            raise ValueError("You need to specify a file which contains a list of bloom filters and samples")
+        config = get_config_from_file(config)
+        bloomfilters = []
+        samples = []
+        with open(from_file, "r") as tsvfile:
+            for row in csv.reader(tsvfile, delimiter="\t"):
+                bloomfilters.append(row[0])
+                samples.append(row[1])
+        return insert_many(
+            index=BIGSI(config), bloomfilter_filepaths=bloomfilters, samples=samples
+        )
+
     @hug.object.cli
     @hug.object.post("/bloom")
-    def bloom(self, ctx, outfile, config=None):
-        """Creates a bloom filter from a sequence file or cortex graph. (fastq,fasta,bam,ctx)
+    def bloom(
+        self,
+        ctx,
+        outfile,
+        config=None,
+        min_count: hug.types.number = 1,
+        encoding: hug.types.one_of(["raw", "containers"]) = "raw",
+    ):
+        """Creates a bloom filter from a sequence file or cortex graph. (fastq,fasta,ctx)
 
-        e.g. index insert ERR1010211.ctx
+        Sequence files may be gzipped. Kmers seen fewer than min_count times (or with
+        a cortex coverage below min_count) are left out of the bloom filter.
+        Sparse bloom filters are much smaller on disk with --encoding containers.
+
+        e.g. bigsi bloom ERR1010211.fastq.gz ERR1010211.bloom --min_count 3
 
         """
         config = get_config_from_file(config)
         bf = bloom(
             config=config,
             outfile=outfile,
-            kmers=extract_kmers_from_ctx(ctx, config["k"]),
+            kmers=extract_kmer_codes(ctx, config["k"], min_count),
+            encoding=encoding,
+        )
+
+    @hug.object.cli
+    def bloom_batch(
+        self,
+        from_file: hug.types.text = None,
+        config: hug.types.text = None,
+        min_count: hug.types.number = 1,
+        nproc: hug.types.number = None,
+        summary: hug.types.text = None,
+        encoding: hug.types.one_of(["raw", "containers"]) = "raw",
+    ):
+        """
+        Creates many bloom filters in parallel, one per line of a TSV of (input, output) paths.
+
+        Inputs are anything `bigsi bloom` accepts. Each of the nproc worker processes reuses one
+        preallocated bloom filter. The kmers inserted, estimated distinct kmers, bits set and
+        seconds taken for every sample are returned, and written as a TSV to the summary path if
+        given.
+
+        e.g. bigsi bloom_batch --from_file samples.tsv --nproc 8 --summary bloom_summary.tsv
+
+        :param  from_file: TSV file with an input sequence file or cortex graph and an output bloom
+                            filter path on each line
+        :type   from_file: basestring
+        :param  config: config file path
+        :type   config: basestring
+        :param  min_count: kmers seen fewer than min_count times are left out
+        :type   min_count: number
+        :param  nproc: the number of worker processes, defaults to nproc from the config or 1
+        :type   nproc: number
+        :param  summary: path to write the per sample summary TSV to
+        :type   summary: basestring
+        :param  encoding: bloom filter file encoding, raw or containers (smaller for sparse blooms)
+        :type   encoding: basestring
+        """
+        if from_file is None:
+            raise ValueError("You need to specify a file which contains a list of inputs and outputs")
+        config = get_config_from_file(config)
+        if nproc is None:
+            nproc = config.get("nproc", 1)
+        return bloom_batch(
+            config=config,
+            input_output_pairs=read_bloom_batch_file(from_file),
+            min_count=min_count,
+            nproc=nproc,
+            summary=summary,
+            encoding=encoding,
+        )
+
+    @hug.object.cli
+    def params(
+        self,
+        from_file: hug.types.text = None,
+        config: hug.types.text = None,
+        max_false_discovery_rate: hug.types.float_number = DEFAULT_MAX_FALSE_DISCOVERY_RATE,
+        min_query_length: hug.types.number = None,
+        max_memory: hug.types.text = None,
+    ):
+        """
+        Recommend m and h from the kmer counts of the samples to be indexed.
+
+        Kmer counts come from the HyperLogLog sketches `bigsi bloom` writes alongside each
+        bloom filter, or from the sample metadata of the index in config.
+
+        e.g. bigsi params --from_file blooms.tsv --max_memory 100GB
+
+        :param  from_file: TSV file with a bloom filter path at the start of each line
+        :type   from_file: basestring
+        :param  config: config file path, giving k and the index to read kmer counts from
+        :type   config: basestring
+        :param  max_false_discovery_rate: target false discovery rate of a query over all samples
+        :type   max_false_discovery_rate: float
+        :param  min_query_length: length of the shortest query to meet the target, defaults to 2k-1
+        :type   min_query_length: number
+        :param  max_memory: the largest index size, e.g. 100GB
+        :type   max_memory: basestring
+        """
+        config = get_config_from_file(config)
+        if from_file:
+            kmer_counts = []
+            with open(from_file, "r") as tsvfile:
+                for row in csv.reader(tsvfile, delimiter="\t"):
+                    if not row:
+                        continue
+                    hll = read_sketch(row[0])
+                    if hll is None:
+                        raise ValueError("No kmer count sketch for %s" % row[0])
+                    kmer_counts.append(hll.estimate())
+        else:
+            kmer_counts = list(BIGSI(config).kmer_counts().values())
+        if max_memory is not None:
+            max_memory = humanfriendly.parse_size(max_memory)
+        return recommend_params(
+            kmer_counts,
+            k=config["k"],
+            max_false_discovery_rate=max_false_discovery_rate,
+            min_query_length=min_query_length,
+            max_memory=max_memory,
         )
 
     @hug.object.cli
@@ -131,7 +275,9 @@ class bigsi(object):
         self,
         from_file: hug.types.text = None,
         out_file: hug.types.text = None,
-        num_rows: hug.types.number = None
+        num_rows: hug.types.number = None,
+        alignment: hug.types.number = 0,
+        nproc: hug.types.number = 1,
     ):
         """
         Merge multiple bloom filters/matrices into one bloom matrix.
@@ -148,6 +294,11 @@ class bigsi(object):
         :type   out_file: basestring
         :param  num_rows: the number of rows
         :type   num_rows: number
+        :param  alignment: if not 0, write an aligned matrix file with every row padded to a multiple of
+                            alignment bytes, so row ranges can be read directly (and merged in parallel)
+        :type   alignment: number
+        :param  nproc: the number of processes merging ranges of rows of an aligned matrix
+        :type   nproc: number
         """
         if from_file is None:
             raise ValueError("You need to specify a file which contains a list of bloom filters")
@@ -165,7 +316,7 @@ class bigsi(object):
                 input_path_list.append(row[0])
                 num_cols_list.append(len(row[1].split(",")))
 
-        merge_blooms(zip(input_path_list, num_cols_list), num_rows, out_file)
+        merge_blooms(zip(input_path_list, num_cols_list), num_rows, out_file, alignment, nproc)
 
     @hug.object.cli
     def large_build(
@@ -250,13 +401,35 @@ class bigsi(object):
 
     @hug.object.cli
     @hug.object.post("/merge", output_format=hug.output_format.pretty_json)
-    def merge(self, config: hug.types.text, merge_config: hug.types.text):
+    def merge(self, config: hug.types.text, merge_config: hug.types.multiple):
+        """
+        Merges one or more indexes into the index of config, in a single pass over its rows.
+
+        e.g. bigsi merge production.yaml week1.yaml week2.yaml week3.yaml
+
+        :param  config: config file path of the index merged into
+        :type   config: basestring
+        :param  merge_config: config file paths of the indexes to merge, in sample order
+        :type   merge_config: list
+        """
+        index1 = BIGSI(get_config_from_file(config))
+        indexes = [BIGSI(get_config_from_file(c)) for c in merge_config]
+        merge(index1, *indexes)
+        return {"result": "merged %s into %s." % (", ".join(merge_config), config)}
+
+    @hug.object.cli
+    @hug.object.post("/compact", output_format=hug.output_format.pretty_json)
+    def compact(self, config: hug.types.text = None):
+        """
+        Removes the columns of deleted samples from the index, and renumbers the remaining samples.
+
+        e.g. bigsi compact --config config.yaml
+
+        :param  config: config file path
+        :type   config: basestring
+        """
         config = get_config_from_file(config)
-        merge_config = get_config_from_file(merge_config)
-        index1 = BIGSI(config)
-        index2 = BIGSI(merge_config)
-        merge(index1, index2)
-        return {"result": "merged %s into %s." % (merge_config, config)}
+        return compact(BIGSI(config))
 
     @hug.object.cli
     @hug.object.post(
@@ -1,5 +1,7 @@
 from bigsi.bloom.bloomfilter import generate_hashes
+from bigsi.bloom.bloomfilter import generate_hashes_batch
 from bigsi.bloom.bloomfilter import BloomFilter
 from bigsi.bloom.bit_matrix_reader import BitMatrixReader
 from bigsi.bloom.bit_matrix_group_reader import BitMatrixGroupReader
 from bigsi.bloom.bit_matrix_writer import BitMatrixWriter
+from bigsi.bloom.bloom_file import BloomFilterFile
@@ -0,0 +1,172 @@
+"""
+Byte-aligned bit matrix files.
+
+An aligned matrix file starts with a fixed size little endian header
+
+    magic (8s) | version (H) | alignment (H) | num_rows (Q) | num_cols (Q) | row_bytes (Q)
+
+padded to HEADER_SIZE bytes, followed by num_rows rows of row_bytes bytes each. A row is a big
+endian bitarray of num_cols bits with zeroed padding up to a multiple of alignment bytes, so row r
+starts at byte HEADER_SIZE + r * row_bytes. Any range of rows can be read or written on its own,
+and several processes can fill disjoint row ranges of the same file.
+"""
+import math
+import struct
+from collections import namedtuple
+from typing import BinaryIO, Optional
+import numpy as np
+from bitarray import bitarray
+
+ALIGNED_MATRIX_MAGIC = b"BIGSIAM\x00"
+ALIGNED_MATRIX_VERSION = 1
+HEADER_STRUCT = struct.Struct("<8sHHQQQ")
+HEADER_SIZE = 64
+DEFAULT_ALIGNMENT = 8
+
+AlignedMatrixHeader = namedtuple(
+    "AlignedMatrixHeader", ["version", "alignment", "num_rows", "num_cols", "row_bytes"]
+)
+
+
+def aligned_row_bytes(num_cols: int, alignment: int = DEFAULT_ALIGNMENT) -> int:
+    return int(math.ceil(num_cols / (8 * alignment))) * alignment
+
+
+def read_aligned_matrix_header(infile: BinaryIO) -> Optional[AlignedMatrixHeader]:
+    """
+    Read the header of an aligned matrix file, leaving the file positioned at the start of the rows
+
+    :param infile: file opened for binary reading, positioned at its start
+    :type infile: BinaryIO
+    :return: the header, or None if the file is not an aligned matrix (in which case the file position is unchanged)
+    """
+    start = infile.tell()
+    data = infile.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE or not data.startswith(ALIGNED_MATRIX_MAGIC):
+        infile.seek(start)
+        return None
+    magic, version, alignment, num_rows, num_cols, row_bytes = HEADER_STRUCT.unpack(
+        data[: HEADER_STRUCT.size]
+    )
+    if version > ALIGNED_MATRIX_VERSION:
+        raise ValueError("Unsupported aligned matrix file version %i" % version)
+    return AlignedMatrixHeader(version, alignment, num_rows, num_cols, row_bytes)
+
+
+def create_aligned_matrix(
+    path: str, num_rows: int, num_cols: int, alignment: int = DEFAULT_ALIGNMENT
+) -> AlignedMatrixHeader:
+    """
+    Create an aligned matrix file of zeroed rows, to be filled with AlignedBitMatrixFile.write_rows
+
+    :param path: path of the file to create
+    :type path: str
+    :param num_rows: the number of rows
+    :type num_rows: int
+    :param num_cols: the number of columns
+    :type num_cols: int
+    :param alignment: rows are padded to a multiple of this many bytes
+    :type alignment: int
+    :return: the header written
+    """
+    header = AlignedMatrixHeader(
+        ALIGNED_MATRIX_VERSION,
+        alignment,
+        num_rows,
+        num_cols,
+        aligned_row_bytes(num_cols, alignment),
+    )
+    with open(path, "wb") as outfile:
+        outfile.write(
+            HEADER_STRUCT.pack(ALIGNED_MATRIX_MAGIC, *header).ljust(HEADER_SIZE, b"\x00")
+        )
+        outfile.truncate(HEADER_SIZE + num_rows * header.row_bytes)
+    return header
+
+
+def pack_rows(rows: bitarray, num_rows: int, num_cols: int, row_bytes: int) -> np.ndarray:
+    """
+    Pad rows stored back to back, as read by BitMatrixGroupReader.iter_blocks, to row_bytes bytes each
+
+    :return: uint8 array of shape (num_rows, row_bytes)
+    """
+    packed = np.frombuffer(rows.tobytes(), dtype=np.uint8)
+    if num_cols % 8 == 0:
+        packed = packed[: num_rows * num_cols // 8].reshape(num_rows, num_cols // 8)
+    else:
+        bits = np.unpackbits(packed)[: num_rows * num_cols].reshape(num_rows, num_cols)
+        packed = np.packbits(bits, axis=1)
+    if packed.shape[1] == row_bytes:
+        return packed
+    padded = np.zeros((num_rows, row_bytes), dtype=np.uint8)
+    padded[:, : packed.shape[1]] = packed
+    return padded
+
+
+class AlignedBitMatrixFile(object):
+    """
+    An aligned matrix file with its rows memory mapped, so any range of rows can be read or written
+    without touching the others.
+
+    :Example:
+    >>> create_aligned_matrix("merged.matrix", num_rows, num_cols)
+    >>> with AlignedBitMatrixFile("merged.matrix", mode="r+") as matrix:
+    >>>     matrix.write_rows(start, packed_rows)
+    >>>     first_row = matrix.get_row(0)
+    """
+
+    def __init__(self, path: str, mode: str = "r") -> None:
+        """
+        Constructor
+
+        :param path: path of the aligned matrix file
+        :type path: str
+        :param mode: "r" to read, "r+" to read and write rows
+        :type mode: str
+        """
+        self.path = path
+        with open(path, "rb") as infile:
+            self.header = read_aligned_matrix_header(infile)
+        if self.header is None:
+            raise ValueError("%s is not an aligned matrix file" % path)
+        self.num_rows = self.header.num_rows
+        self.num_cols = self.header.num_cols
+        self.row_bytes = self.header.row_bytes
+        self._rows = np.memmap(
+            path,
+            dtype=np.uint8,
+            mode=mode,
+            offset=HEADER_SIZE,
+            shape=(self.num_rows, self.row_bytes),
+        )
+
+    def read_rows(self, start: int, stop: int) -> np.ndarray:
+        """
+        Return rows [start, stop) as a read only view of shape (stop - start, row_bytes)
+        """
+        return self._rows[start:stop]
+
+    def write_rows(self, start: int, packed_rows: np.ndarray) -> None:
+        """
+        Write rows of row_bytes bytes each, as returned by pack_rows, starting at row start
+        """
+        self._rows[start : start + len(packed_rows)] = packed_rows
+
+    def get_row(self, row_index: int) -> bitarray:
+        row = bitarray(endian="big")
+        row.frombytes(self._rows[row_index].tobytes())
+        return row[: self.num_cols]
+
+    def flush(self) -> None:
+        if self._rows is not None and self._rows.mode != "r":
+            self._rows.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
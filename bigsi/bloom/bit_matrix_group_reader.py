@@ -1,7 +1,17 @@
-from typing import List, Tuple
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+import numpy as np
 from bitarray import bitarray
 
 from bigsi.bloom import BitMatrixReader
+from bigsi.bloom.bit_matrix_reader import ROWS_PER_SLICE
+
+## Blocks are sized to about this many bits of the group matrix, in whole slices
+BLOCK_BITS = 2 ** 25
+DEFAULT_IO_THREADS = 4
+DEFAULT_PREFETCH_BLOCKS = 2
 
 
 class BitMatrixGroupReader(object):
@@ -9,6 +19,10 @@ class BitMatrixGroupReader(object):
     Reader for a group of bit matrices stored in a of binary files. The matrices can be grouped together and read
     row by row, sequentially.
 
+    Rows are read in blocks of whole slices from all the matrices at once, on io_threads background threads, while
+    the rows of earlier blocks are being used. Up to prefetch_blocks blocks are read ahead. With io_threads=0 blocks
+    are read on the calling thread when they are needed.
+
     :Example:
     >>> input_paths = ["input.a", "input.b"]
     >>> num_cols = [1, 2]
@@ -16,7 +30,8 @@ class BitMatrixGroupReader(object):
     >>>     for row in bmgr:
     >>>         print(row)
     """
-    def __init__(self, input_data: List[Tuple[str, int]], num_rows: int) -> None:
+    def __init__(self, input_data: List[Tuple[str, int]], num_rows: int, io_threads: int = DEFAULT_IO_THREADS,
+                 prefetch_blocks: int = DEFAULT_PREFETCH_BLOCKS) -> None:
         """
         Constructor
 
@@ -24,31 +39,166 @@ class BitMatrixGroupReader(object):
         :type input_data: list
         :param num_rows: the number of rows for the bit matrices provided in the input_data
         :type num_rows: number
+        :param io_threads: the number of threads reading the input files, 0 to read on the calling thread
+        :type io_threads: int
+        :param prefetch_blocks: the number of blocks read ahead of the rows being used
+        :type prefetch_blocks: int
         """
         self._num_rows = num_rows
         self._input_data = input_data
+        self._io_threads = io_threads
+        self._prefetch_blocks = max(1, prefetch_blocks)
 
     def __enter__(self):
         self._bit_matrix_files = []
         self._bit_matrix_readers = []
+        self._num_cols_list = []
         for input_path, num_cols in self._input_data:
             infile = open(input_path, "rb")
             self._bit_matrix_files.append(infile)
             self._bit_matrix_readers.append(BitMatrixReader(infile, self._num_rows, num_cols))
+            self._num_cols_list.append(int(num_cols))
+        self.num_cols = sum(self._num_cols_list)
+        self._block_rows = max(1, BLOCK_BITS // max(self.num_cols, 1) // ROWS_PER_SLICE) * ROWS_PER_SLICE
+        self._unpacked = None
+        ## Index of the next row to read from the files, and of the next row returned
+        self._next_block_row = 0
+        self._curr_row_index = 0
+        self._stop_row = self._num_rows
+        self._curr_block = bitarray()
+        self._curr_block_start = 0
+        self._curr_block_rows = 0
+        self._blocks = None
+        self._stop = threading.Event()
+        self._executor = None
+        self._prefetcher = None
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._prefetcher is not None:
+            self._stop.set()
+            ## Unblocks the prefetcher if it is waiting for room in the queue
+            while self._prefetcher.is_alive():
+                try:
+                    self._blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._prefetcher.join()
+        if self._executor is not None:
+            self._executor.shutdown()
         for bit_matrix_file in self._bit_matrix_files:
             bit_matrix_file.close()
 
     def __iter__(self):
         return self
 
+    def skip_rows(self, num_rows: int) -> None:
+        """
+        Skip the next num_rows rows of every bit matrix. Must be called before any rows are read.
+
+        :param num_rows: the number of rows to skip
+        :type num_rows: int
+        """
+        if self._blocks is not None or self._curr_block_rows:
+            raise Exception("Rows can only be skipped before reading")
+        for bit_matrix_reader in self._bit_matrix_readers:
+            bit_matrix_reader.skip_rows(num_rows)
+        self._curr_row_index = min(self._curr_row_index + num_rows, self._stop_row)
+        self._next_block_row = self._curr_block_start = self._curr_row_index
+
+    def set_row_range(self, start: int, stop: int) -> None:
+        """
+        Read only rows [start, stop) of the bit matrices. Must be called before any rows are read.
+
+        :param start: the first row to read
+        :type start: int
+        :param stop: the row to stop before
+        :type stop: int
+        """
+        self._stop_row = min(stop, self._num_rows)
+        self.skip_rows(start - self._curr_row_index)
+
+    def _read_block(self, num_rows: int) -> bitarray:
+        ## The next num_rows rows of all the matrices, joined row by row and stored back to back
+        read = lambda bit_matrix_reader: bit_matrix_reader.read_rows(num_rows)
+        if self._executor is None:
+            packed_list = [read(bit_matrix_reader) for bit_matrix_reader in self._bit_matrix_readers]
+        else:
+            packed_list = list(self._executor.map(read, self._bit_matrix_readers))
+        if all(num_cols % 8 == 0 for num_cols in self._num_cols_list):
+            joined = np.concatenate(
+                [packed[:num_rows * num_cols // 8].reshape(num_rows, num_cols // 8)
+                 for packed, num_cols in zip(packed_list, self._num_cols_list)], axis=1)
+        else:
+            if self._unpacked is None:
+                self._unpacked = np.empty((self._block_rows, self.num_cols), dtype=np.uint8)
+            unpacked = self._unpacked[:num_rows]
+            start = 0
+            for packed, num_cols in zip(packed_list, self._num_cols_list):
+                unpacked[:, start:start + num_cols] = np.unpackbits(packed)[:num_rows * num_cols].reshape(
+                    num_rows, num_cols)
+                start += num_cols
+            joined = np.packbits(unpacked)
+        block = bitarray(endian="big")
+        block.frombytes(joined.tobytes())
+        del block[num_rows * self.num_cols:]
+        return block
+
+    def _next_block_size(self) -> int:
+        ## Blocks end on multiples of the block size, so every read after a skip is of whole slices
+        return min(self._block_rows - self._next_block_row % self._block_rows, self._stop_row - self._next_block_row)
+
+    def _prefetch(self) -> None:
+        try:
+            while self._next_block_row < self._stop_row and not self._stop.is_set():
+                num_rows = self._next_block_size()
+                block = self._read_block(num_rows)
+                self._next_block_row += num_rows
+                self._blocks.put((num_rows, block))
+        except Exception as e:
+            self._blocks.put(e)
+
+    def _load_next_block(self) -> None:
+        if self._io_threads <= 0:
+            num_rows = self._next_block_size()
+            block = self._read_block(num_rows)
+            self._next_block_row += num_rows
+        else:
+            if self._blocks is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._io_threads)
+                self._blocks = queue.Queue(maxsize=self._prefetch_blocks)
+                self._prefetcher = threading.Thread(target=self._prefetch, daemon=True)
+                self._prefetcher.start()
+            item = self._blocks.get()
+            if isinstance(item, Exception):
+                raise item
+            num_rows, block = item
+        self._curr_block_start = self._curr_row_index
+        self._curr_block_rows = num_rows
+        self._curr_block = block
+
+    def iter_blocks(self) -> Iterator[Tuple[int, bitarray]]:
+        """
+        Iterate over the remaining rows a block at a time, starting with what is left of the current block
+
+        :return: iterator of (number of rows, bitarray of the rows back to back)
+        """
+        while self._curr_row_index < self._stop_row:
+            if self._curr_row_index == self._curr_block_start + self._curr_block_rows:
+                self._load_next_block()
+            offset = (self._curr_row_index - self._curr_block_start) * self.num_cols
+            num_rows = self._curr_block_start + self._curr_block_rows - self._curr_row_index
+            self._curr_row_index += num_rows
+            yield num_rows, self._curr_block[offset:]
+
     def __next__(self) -> bitarray:
         """
         Return next available row in bitarray
         """
-        result = bitarray()
-        for bit_matrix_reader in self._bit_matrix_readers:
-            result.extend(next(bit_matrix_reader))
-        return result
+        if self._curr_row_index >= self._stop_row:
+            raise StopIteration
+        if self._curr_row_index == self._curr_block_start + self._curr_block_rows:
+            self._load_next_block()
+        offset = (self._curr_row_index - self._curr_block_start) * self.num_cols
+        self._curr_row_index += 1
+        return self._curr_block[offset:offset + self.num_cols]
@@ -1,14 +1,22 @@
 import os
 import math
 from typing import BinaryIO
+import numpy as np
 from bitarray import bitarray
 
+from bigsi.bloom.aligned_matrix import read_aligned_matrix_header
+from bigsi.bloom.bloom_file import ENCODING_RAW
+from bigsi.bloom.bloom_file import read_bloom_file_header
+from bigsi.bloom.roaring import ContainerBits
+
 ROWS_PER_SLICE = 80  # must be divisible by 8. somewhere around 80 seems optimal
 
 
 class BitMatrixReader(object):
     """
     Reader for a bit matrix stored in a binary file. The matrix can be read row by row, sequentially.
+    A single column matrix can also be a bloom filter file with a header, in any of its encodings, and
+    any matrix can be an aligned matrix file, whose rows are read straight from their offsets.
 
     :Example:
     >>> with open("input", "rb") as infile:
@@ -32,7 +40,24 @@ class BitMatrixReader(object):
         self._curr_row_index_in_matrix = 0
         self._curr_row_index_in_slice = 0
         self._curr_slice = None
-        file_size = os.fstat(self._input.fileno()).st_size
+        self._bits = None
+        self._bits_offset = 0
+        self._buffer = np.empty(0, dtype=np.uint8)
+        self._aligned_rows = None
+        aligned_header = read_aligned_matrix_header(self._input)
+        if aligned_header is not None:
+            if (aligned_header.num_rows, aligned_header.num_cols) != (self._num_rows, self._num_cols):
+                raise Exception("Matrix dimensions do not match: " + self._input.name)
+            self._aligned_rows = np.memmap(self._input, dtype=np.uint8, mode="r", offset=self._input.tell(),
+                                           shape=(self._num_rows, aligned_header.row_bytes))
+            return
+        header = read_bloom_file_header(self._input)
+        file_size = os.fstat(self._input.fileno()).st_size - self._input.tell()
+        if header is not None and header.encoding != ENCODING_RAW:
+            payload = np.memmap(self._input, dtype=np.uint8, mode="r", offset=self._input.tell(),
+                                shape=(file_size,))
+            self._bits = ContainerBits(payload, header.m)
+            file_size = len(self._bits)
         total_bits = self._num_rows * self._num_cols
         if total_bits <= (file_size - 1) * 8 or total_bits > file_size * 8:
             raise Exception("File size does not seem correct: " + self._input.name)
@@ -40,6 +65,77 @@ class BitMatrixReader(object):
     def __iter__(self):
         return self
 
+    def skip_rows(self, num_rows: int) -> None:
+        """
+        Skip the next num_rows rows. Whole slices are skipped without being read.
+
+        :param num_rows: the number of rows to skip
+        :type num_rows: int
+        """
+        num_rows = min(num_rows, self._num_rows - self._curr_row_index_in_matrix)
+        if self._aligned_rows is not None:
+            self._curr_row_index_in_matrix += num_rows
+            return
+        if self._curr_row_index_in_slice in (0, ROWS_PER_SLICE):
+            num_slices = num_rows // ROWS_PER_SLICE
+            num_bytes = num_slices * ROWS_PER_SLICE * self._num_cols // 8
+            if self._bits is None:
+                self._input.seek(num_bytes, os.SEEK_CUR)
+            else:
+                self._bits_offset += num_bytes
+            self._curr_row_index_in_matrix += num_slices * ROWS_PER_SLICE
+            self._curr_row_index_in_slice = 0
+            num_rows -= num_slices * ROWS_PER_SLICE
+        for _ in range(num_rows):
+            next(self)
+
+    def read_rows(self, num_rows: int) -> np.ndarray:
+        """
+        Read the next num_rows rows as one packed array of bytes, holding the rows back to back with
+        no padding between them. Whole slices are read straight into a buffer that is reused by the
+        next call, so the result must be used before reading again.
+
+        :param num_rows: the number of rows to read
+        :type num_rows: int
+        :return: uint8 array of at least num_rows x num_cols bits
+        """
+        num_rows = min(num_rows, self._num_rows - self._curr_row_index_in_matrix)
+        if self._aligned_rows is not None:
+            start = self._curr_row_index_in_matrix
+            self._curr_row_index_in_matrix += num_rows
+            rows = self._aligned_rows[start:start + num_rows]
+            if self._num_cols % 8 == 0:
+                return rows[:, :self._num_cols // 8].ravel()
+            return np.packbits(np.unpackbits(rows, axis=1)[:, :self._num_cols])
+        head = bitarray()
+        while num_rows and self._curr_row_index_in_slice not in (0, ROWS_PER_SLICE):
+            head.extend(next(self))
+            num_rows -= 1
+        num_rows_left = self._num_rows - self._curr_row_index_in_matrix
+        whole_rows = num_rows if num_rows == num_rows_left else num_rows - num_rows % ROWS_PER_SLICE
+        num_bytes = math.ceil(whole_rows * self._num_cols / 8)
+        if self._bits is None:
+            if len(self._buffer) < num_bytes:
+                self._buffer = np.empty(num_bytes, dtype=np.uint8)
+            packed = self._buffer[:num_bytes]
+            if self._input.readinto(memoryview(packed)) != num_bytes:
+                raise Exception("Unexpected end of file: " + self._input.name)
+        else:
+            packed = self._bits[self._bits_offset:self._bits_offset + num_bytes]
+            self._bits_offset += num_bytes
+        self._curr_row_index_in_matrix += whole_rows
+        self._curr_row_index_in_slice = 0
+        num_rows -= whole_rows
+        if not head and not num_rows:
+            return packed
+        ## Rows either side of the whole slices are read one at a time
+        rows = head
+        rows.frombytes(packed.tobytes())
+        del rows[len(head) + whole_rows * self._num_cols:]
+        for _ in range(num_rows):
+            rows.extend(next(self))
+        return np.frombuffer(rows.tobytes(), dtype=np.uint8)
+
     def __next__(self) -> bitarray:
         """
         Return next available row in bitarray
@@ -47,6 +143,12 @@ class BitMatrixReader(object):
         if self._curr_row_index_in_matrix >= self._num_rows:
             raise StopIteration
 
+        if self._aligned_rows is not None:
+            curr_row = bitarray()
+            curr_row.frombytes(self._aligned_rows[self._curr_row_index_in_matrix].tobytes())
+            self._curr_row_index_in_matrix = self._curr_row_index_in_matrix + 1
+            return curr_row[:self._num_cols]
+
         if self._curr_row_index_in_slice == ROWS_PER_SLICE:
             self._curr_row_index_in_slice = 0
 
@@ -56,7 +158,12 @@ class BitMatrixReader(object):
             if num_rows_left < ROWS_PER_SLICE:
                 num_bytes_to_read = math.ceil((num_rows_left * self._num_cols) / 8)
             self._curr_slice = bitarray()
-            self._curr_slice.fromfile(self._input, num_bytes_to_read)
+            if self._bits is None:
+                self._curr_slice.fromfile(self._input, num_bytes_to_read)
+            else:
+                self._curr_slice.frombytes(
+                    self._bits[self._bits_offset:self._bits_offset + num_bytes_to_read].tobytes())
+                self._bits_offset += num_bytes_to_read
 
         curr_row = self._curr_slice[self._curr_row_index_in_slice*self._num_cols:(self._curr_row_index_in_slice+1)*self._num_cols]
 
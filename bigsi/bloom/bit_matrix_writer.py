@@ -65,3 +65,24 @@ class BitMatrixWriter(object):
             self._curr_slice.tofile(self._output)
             self._curr_slice = None
             self._curr_row_index_in_curr_slice = 0
+
+    def write_block(self, bit_array: bitarray, num_rows: int) -> None:
+        """
+        Append rows stored back to back to the end of output file. A block that starts and ends on slices is
+        written as it is.
+
+        :param bit_array: the rows to be written to the output, num_rows x num_cols bits
+        :type bit_array: bitarray
+        :param num_rows: the number of rows in bit_array
+        :type num_rows: int
+        """
+        if self._curr_row_index_in_matrix + num_rows > self._num_rows:
+            raise Exception("Bit matrix is already full at " + self._output.name)
+
+        ends_matrix = self._curr_row_index_in_matrix + num_rows == self._num_rows
+        if self._curr_row_index_in_curr_slice == 0 and (num_rows % ROWS_PER_SLICE == 0 or ends_matrix):
+            bit_array.tofile(self._output)
+            self._curr_row_index_in_matrix = self._curr_row_index_in_matrix + num_rows
+        else:
+            for row_index in range(num_rows):
+                self.write(bit_array[row_index * self._num_cols:(row_index + 1) * self._num_cols])
@@ -0,0 +1,269 @@
+"""
+Self-describing bloom filter files.
+
+A bloom filter file starts with a fixed size little endian header
+
+    magic (8s) | version (H) | encoding (B) | flags (B) | m (Q) | h (I) | k (I) | popcount (Q) |
+    crc32 (I) | block_size (I)
+
+padded to HEADER_SIZE bytes, followed by the payload. With ENCODING_RAW the payload is the bloom
+filter as a big endian bitarray, ceil(m / 8) bytes with zeroed padding bits. With
+ENCODING_CONTAINERS it is the roaring-style encoding of bigsi.bloom.roaring, which is much smaller
+for sparse bloom filters. The crc32 is taken over the payload. Files without the magic are legacy
+raw bitarray dumps and are read as a payload of unknown h and k.
+"""
+import math
+import struct
+import zlib
+from collections import namedtuple
+from typing import BinaryIO, Optional
+import numpy as np
+from bitarray import bitarray
+
+from bigsi.bloom.roaring import ContainerBits
+from bigsi.bloom.roaring import encode_containers
+
+BLOOM_FILE_MAGIC = b"BIGSIBF\x00"
+BLOOM_FILE_VERSION = 1
+HEADER_STRUCT = struct.Struct("<8sHBBQIIQII")
+HEADER_SIZE = 64
+ENCODING_RAW = 0
+ENCODING_CONTAINERS = 1
+ENCODINGS = {"raw": ENCODING_RAW, "containers": ENCODING_CONTAINERS}
+FLAG_DOUBLE_HASHING = 1
+
+BloomFileHeader = namedtuple(
+    "BloomFileHeader",
+    [
+        "version",
+        "encoding",
+        "double_hashing",
+        "m",
+        "h",
+        "k",
+        "popcount",
+        "crc32",
+        "block_size",
+    ],
+)
+
+
+def _payload_size(m):
+    return int(math.ceil(m / 8))
+
+
+def read_bloom_file_header(infile: BinaryIO) -> Optional[BloomFileHeader]:
+    """
+    Read the header of a bloom filter file, leaving the file positioned at the start of the payload
+
+    :param infile: file opened for binary reading, positioned at its start
+    :type infile: BinaryIO
+    :return: the header, or None for a legacy raw file (in which case the file position is unchanged)
+    """
+    start = infile.tell()
+    data = infile.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE or not data.startswith(BLOOM_FILE_MAGIC):
+        infile.seek(start)
+        return None
+    (
+        magic,
+        version,
+        encoding,
+        flags,
+        m,
+        h,
+        k,
+        popcount,
+        crc32,
+        block_size,
+    ) = HEADER_STRUCT.unpack(data[: HEADER_STRUCT.size])
+    if version > BLOOM_FILE_VERSION:
+        raise ValueError("Unsupported bloom filter file version %i" % version)
+    return BloomFileHeader(
+        version,
+        encoding,
+        bool(flags & FLAG_DOUBLE_HASHING),
+        m,
+        h,
+        k,
+        popcount,
+        crc32,
+        block_size,
+    )
+
+
+def write_bloom_file(
+    outfile: BinaryIO,
+    bloomfilter: bitarray,
+    h: int,
+    k: int,
+    double_hashing: bool = False,
+    block_size: int = 0,
+    encoding: int = ENCODING_RAW,
+) -> BloomFileHeader:
+    """
+    Write a bloom filter with a header describing it
+
+    :param outfile: file opened for binary writing
+    :type outfile: BinaryIO
+    :param bloomfilter: big endian bitarray of the bloom filter, its length is m
+    :type bloomfilter: bitarray
+    :param h: the number of hash functions
+    :type h: int
+    :param k: the kmer size
+    :type k: int
+    :param double_hashing: whether positions were generated by double hashing
+    :type double_hashing: bool
+    :param block_size: the blocked bloom block size, 0 if positions are not blocked
+    :type block_size: int
+    :param encoding: ENCODING_RAW or ENCODING_CONTAINERS
+    :type encoding: int
+    :return: the header written
+    """
+    if bloomfilter.endian() != "big":
+        bloomfilter = bitarray(bloomfilter, endian="big")
+    payload = bloomfilter.tobytes()
+    if encoding == ENCODING_CONTAINERS:
+        payload = encode_containers(
+            np.frombuffer(payload, dtype=np.uint8), len(bloomfilter)
+        )
+    elif encoding != ENCODING_RAW:
+        raise ValueError("Unknown bloom filter encoding %i" % encoding)
+    header = BloomFileHeader(
+        BLOOM_FILE_VERSION,
+        encoding,
+        bool(double_hashing),
+        len(bloomfilter),
+        h,
+        k,
+        bloomfilter.count(),
+        zlib.crc32(payload),
+        block_size,
+    )
+    outfile.write(
+        HEADER_STRUCT.pack(
+            BLOOM_FILE_MAGIC,
+            header.version,
+            header.encoding,
+            FLAG_DOUBLE_HASHING if header.double_hashing else 0,
+            header.m,
+            header.h,
+            header.k,
+            header.popcount,
+            header.crc32,
+            header.block_size,
+        ).ljust(HEADER_SIZE, b"\x00")
+    )
+    outfile.write(payload)
+    return header
+
+
+class BloomFilterFile(object):
+    """
+    A bloom filter file with its payload memory mapped read only, so slices of it can be read
+    without loading the whole bloom filter into memory. The packed bytes of the bloom filter are
+    `bits`, which decodes container encoded files slice by slice. Legacy raw files are accepted,
+    with h and k set to None.
+
+    :Example:
+    >>> with BloomFilterFile("ERR1010211.bloom") as bf:
+    >>>     bf.validate(m=config["m"], h=config["h"], k=config["k"])
+    >>>     first_bytes = bf.bits[:1000]
+    """
+
+    def __init__(self, path: str, m: Optional[int] = None) -> None:
+        """
+        Constructor
+
+        :param path: path of the bloom filter file
+        :type path: str
+        :param m: the bloom filter size of a legacy raw file, which defaults to 8 x its size in bytes
+        :type m: int
+        """
+        self.path = path
+        with open(path, "rb") as infile:
+            self.header = read_bloom_file_header(infile)
+            offset = infile.tell()
+            infile.seek(0, 2)
+            file_size = infile.tell()
+        if self.header is None:
+            self.m = file_size * 8 if m is None else m
+            self.h = self.k = self.popcount = None
+            self.double_hashing = self.block_size = None
+            self.encoding = ENCODING_RAW
+        else:
+            self.m = self.header.m
+            self.h = self.header.h
+            self.k = self.header.k
+            self.popcount = self.header.popcount
+            self.double_hashing = self.header.double_hashing
+            self.block_size = self.header.block_size
+            self.encoding = self.header.encoding
+        if self.encoding == ENCODING_RAW:
+            num_bytes = _payload_size(self.m)
+            if file_size - offset != num_bytes:
+                raise ValueError(
+                    "%s holds %i bytes of bloom filter, expected %i for m=%i"
+                    % (path, file_size - offset, num_bytes, self.m)
+                )
+        elif self.encoding == ENCODING_CONTAINERS:
+            num_bytes = file_size - offset
+        else:
+            raise ValueError(
+                "Unsupported bloom filter encoding %i in %s" % (self.encoding, path)
+            )
+        self._payload = np.memmap(
+            path, dtype=np.uint8, mode="r", offset=offset, shape=(num_bytes,)
+        )
+        if self.encoding == ENCODING_CONTAINERS:
+            self.bits = ContainerBits(self._payload, self.m)
+        else:
+            self.bits = self._payload
+
+    @property
+    def is_legacy(self) -> bool:
+        return self.header is None
+
+    def validate(
+        self, m=None, h=None, k=None, double_hashing=None, block_size=None
+    ) -> None:
+        """
+        Raise a ValueError if the file was built with different parameters. Parameters that are
+        None, or that a legacy file does not record, are not checked.
+        """
+        expected = {
+            "m": m,
+            "h": h,
+            "k": k,
+            "double_hashing": double_hashing,
+            "block_size": block_size,
+        }
+        for name, value in expected.items():
+            actual = getattr(self, name)
+            if value is not None and actual is not None and actual != value:
+                raise ValueError(
+                    "%s was built with %s=%s, expected %s" % (self.path, name, actual, value)
+                )
+
+    def verify(self) -> None:
+        """
+        Raise a ValueError if the payload does not match the checksum in the header
+        """
+        if self.header is None:
+            return
+        if zlib.crc32(self._payload) != self.header.crc32:
+            raise ValueError("Checksum mismatch in %s" % self.path)
+
+    def to_bitarray(self) -> bitarray:
+        ba = bitarray(endian="big")
+        ba.frombytes(self.bits.tobytes())
+        return ba[: self.m]
+
+    def close(self) -> None:
+        self.bits = self._payload = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
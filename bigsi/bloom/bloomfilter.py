@@ -1,33 +1,172 @@
 import mmh3
+import numpy as np
+from itertools import islice
+from functools import partial
 from bitarray import bitarray
 
+from bigsi.bloom.hashing import murmur3_32
+from bigsi.bloom.hashing import murmur3_x64_128
+from bigsi.bloom.hashing import elements_to_matrix
+from bigsi.utils.kmers import kmer_codes_to_bytes
+
+HASH_BATCH_SIZE = 100000
+
 
 def _hash(element, seed, m):
     return mmh3.hash(element, seed) % m
 
 
-def generate_hashes(element, number_hash_functions, bloomfilter_size):
+def generate_hashes(
+    element, number_hash_functions, bloomfilter_size, double_hashing=False, block_size=0
+):
+    if double_hashing or block_size:
+        return set(
+            generate_hashes_batch(
+                [element],
+                number_hash_functions,
+                bloomfilter_size,
+                double_hashing,
+                block_size,
+            )[0].tolist()
+        )
     hashes = {
         _hash(element, seed, bloomfilter_size) for seed in range(number_hash_functions)
     }
     return hashes
 
 
+def _seeded_hashes(data, number_hash_functions, bloomfilter_size):
+    hashes = np.empty((data.shape[0], number_hash_functions), dtype=np.int64)
+    for seed in range(number_hash_functions):
+        ## mmh3.hash is signed, so reduce the signed value to match _hash
+        signed = murmur3_32(data, seed).view(np.int32).astype(np.int64)
+        hashes[:, seed] = np.mod(signed, bloomfilter_size)
+    return hashes
+
+
+def _double_hashes(data, number_hash_functions, bloomfilter_size):
+    ## Kirsch-Mitzenmacher: position i is h1 + i * h2 over one 128-bit hash
+    h1, h2 = murmur3_x64_128(data)
+    steps = np.arange(number_hash_functions, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        combined = h1[:, None] + steps[None, :] * h2[:, None]
+    return (combined % np.uint64(bloomfilter_size)).astype(np.int64)
+
+
+def _blocked_hashes(data, number_hash_functions, bloomfilter_size, block_size):
+    ## Blocked bloom: h1 picks a block of block_size consecutive positions and
+    ## all the element's positions are double hashed within it
+    if block_size > bloomfilter_size:
+        raise ValueError("block_size can't be larger than the bloom filter size")
+    h1, h2 = murmur3_x64_128(data)
+    num_blocks = np.uint64(bloomfilter_size // block_size)
+    block_starts = (h1 % num_blocks) * np.uint64(block_size)
+    step = (h1 >> np.uint64(32)) | np.uint64(1)
+    steps = np.arange(number_hash_functions, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        offsets = (h2[:, None] + steps[None, :] * step[:, None]) % np.uint64(block_size)
+    return (block_starts[:, None] + offsets).astype(np.int64)
+
+
+def generate_hashes_batch(
+    elements,
+    number_hash_functions,
+    bloomfilter_size,
+    double_hashing=False,
+    block_size=0,
+):
+    """
+    Hash a batch of elements in one go.
+
+    Returns an (n_elements x number_hash_functions) int64 array of bloom filter positions. Row i holds
+    the positions `generate_hashes` gives for element i (possibly with repeats, as it is not a set).
+
+    Elements are either a sequence of strings/bytes or an (n_elements x element_length) uint8 matrix.
+    With double_hashing all positions are derived from a single 128-bit hash per element. With a
+    block_size all positions of an element fall in one block of block_size consecutive positions,
+    so a lookup reads one block rather than number_hash_functions scattered rows.
+    """
+    if block_size:
+        hash_func = partial(_blocked_hashes, block_size=block_size)
+    elif double_hashing:
+        hash_func = _double_hashes
+    else:
+        hash_func = _seeded_hashes
+    if isinstance(elements, np.ndarray):
+        return hash_func(elements, number_hash_functions, bloomfilter_size)
+    elements = list(elements)
+    lengths = np.array([len(e) for e in elements], dtype=np.int64)
+    hashes = np.empty((len(elements), number_hash_functions), dtype=np.int64)
+    for length in np.unique(lengths):
+        indexes = np.flatnonzero(lengths == length)
+        data = elements_to_matrix([elements[i] for i in indexes])
+        hashes[indexes] = hash_func(data, number_hash_functions, bloomfilter_size)
+    return hashes
+
+
+def set_bits(ba, positions):
+    """
+    Set the bits of a big endian bitarray at all the given positions, in place
+    """
+    positions = np.unique(np.asarray(positions, dtype=np.int64))
+    if positions.size == 0:
+        return ba
+    buf = np.frombuffer(ba, dtype=np.uint8)
+    byte_indexes = positions >> 3
+    masks = (0x80 >> (positions & 7)).astype(np.uint8)
+    starts = np.flatnonzero(np.r_[True, byte_indexes[1:] != byte_indexes[:-1]])
+    buf[byte_indexes[starts]] |= np.bitwise_or.reduceat(masks, starts)
+    return ba
+
+
+def _iter_batches(elements, size):
+    if isinstance(elements, np.ndarray):
+        for i in range(0, elements.shape[0], size):
+            yield elements[i : i + size]
+    else:
+        elements = iter(elements)
+        while True:
+            chunk = list(islice(elements, size))
+            if not chunk:
+                return
+            yield chunk
+
+
 class BloomFilter(object):
-    def __init__(self, m, h):
+    def __init__(self, m, h, double_hashing=False, block_size=0):
         self.m = m
         self.h = h
-        self.bitarray = bitarray(self.m)
+        self.double_hashing = double_hashing
+        self.block_size = block_size
+        self.bitarray = bitarray(self.m, endian="big")
         self.bitarray.setall(0)
 
+    def clear(self):
+        ## Reuse the allocated bitarray for another bloom filter of the same size
+        self.bitarray.setall(0)
+        return self
+
     def __hashes(self, element):
-        return generate_hashes(element, self.h, self.m)
+        return generate_hashes(
+            element, self.h, self.m, self.double_hashing, self.block_size
+        )
 
     def add(self, e):
         for i in self.__hashes(e):
             self.bitarray[i] = True
 
     def update(self, elements):
-        for e in list(elements):
-            self.add(e)
+        for chunk in _iter_batches(elements, HASH_BATCH_SIZE):
+            set_bits(
+                self.bitarray,
+                generate_hashes_batch(
+                    chunk, self.h, self.m, self.double_hashing, self.block_size
+                ),
+            )
+        return self
+
+    def update_kmer_codes(self, codes, kmer_size):
+        ## Codes are hashed as their kmer strings, so blooms match those from `update`
+        for chunk in _iter_batches(codes, HASH_BATCH_SIZE):
+            self.update(kmer_codes_to_bytes(chunk, kmer_size))
         return self
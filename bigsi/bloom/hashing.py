@@ -0,0 +1,158 @@
+"""
+Vectorised MurmurHash3 kernels.
+
+Each kernel hashes a whole (n_elements x element_length) uint8 matrix at once and gives exactly the
+same values as the corresponding ``mmh3`` function applied element by element.
+"""
+from typing import Iterable, Tuple, Union
+import numpy as np
+
+C1_32 = np.uint32(0xCC9E2D51)
+C2_32 = np.uint32(0x1B873593)
+C1_64 = np.uint64(0x87C37B91114253D5)
+C2_64 = np.uint64(0x4CF5AD432745937F)
+
+
+def _rotl32(x: np.ndarray, r: int) -> np.ndarray:
+    return (x << np.uint32(r)) | (x >> np.uint32(32 - r))
+
+
+def _rotl64(x: np.ndarray, r: int) -> np.ndarray:
+    return (x << np.uint64(r)) | (x >> np.uint64(64 - r))
+
+
+def _fmix32(h: np.ndarray) -> np.ndarray:
+    h ^= h >> np.uint32(16)
+    h *= np.uint32(0x85EBCA6B)
+    h ^= h >> np.uint32(13)
+    h *= np.uint32(0xC2B2AE35)
+    h ^= h >> np.uint32(16)
+    return h
+
+
+def _fmix64(k: np.ndarray) -> np.ndarray:
+    k ^= k >> np.uint64(33)
+    k *= np.uint64(0xFF51AFD7ED558CCD)
+    k ^= k >> np.uint64(33)
+    k *= np.uint64(0xC4CEB9FE1A85EC53)
+    k ^= k >> np.uint64(33)
+    return k
+
+
+def _little_endian_words(data: np.ndarray, start: int, width: int, dtype) -> np.ndarray:
+    word = np.zeros(data.shape[0], dtype=dtype)
+    for i in range(width):
+        word |= data[:, start + i].astype(dtype) << dtype(8 * i)
+    return word
+
+
+def murmur3_32(data: np.ndarray, seed: int = 0) -> np.ndarray:
+    """
+    MurmurHash3 x86 32-bit hash of every row of a uint8 matrix. Equivalent to ``mmh3.hash(row, seed, signed=False)``.
+
+    :param data: (n_elements x element_length) uint8 matrix
+    :type data: numpy.ndarray
+    :param seed: hash seed
+    :type seed: int
+    :return: uint32 array with one hash per row
+    """
+    n, length = data.shape
+    h = np.full(n, seed & 0xFFFFFFFF, dtype=np.uint32)
+    with np.errstate(over="ignore"):
+        num_blocks = length // 4
+        if num_blocks:
+            blocks = np.ascontiguousarray(data[:, : num_blocks * 4]).view("<u4")
+            for i in range(num_blocks):
+                k = blocks[:, i].astype(np.uint32)
+                k *= C1_32
+                k = _rotl32(k, 15)
+                k *= C2_32
+                h ^= k
+                h = _rotl32(h, 13)
+                h = h * np.uint32(5) + np.uint32(0xE6546B64)
+        tail = length & 3
+        if tail:
+            k = _little_endian_words(data, num_blocks * 4, tail, np.uint32)
+            k *= C1_32
+            k = _rotl32(k, 15)
+            k *= C2_32
+            h ^= k
+        h ^= np.uint32(length)
+        return _fmix32(h)
+
+
+def murmur3_x64_128(data: np.ndarray, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    MurmurHash3 x64 128-bit hash of every row of a uint8 matrix. Equivalent to
+    ``mmh3.hash64(row, seed, signed=False)``, i.e. the low and high 64-bit halves of the 128-bit hash.
+
+    :param data: (n_elements x element_length) uint8 matrix
+    :type data: numpy.ndarray
+    :param seed: hash seed
+    :type seed: int
+    :return: tuple of two uint64 arrays with the halves of the hash of each row
+    """
+    n, length = data.shape
+    h1 = np.full(n, seed & 0xFFFFFFFF, dtype=np.uint64)
+    h2 = np.full(n, seed & 0xFFFFFFFF, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        num_blocks = length // 16
+        if num_blocks:
+            blocks = np.ascontiguousarray(data[:, : num_blocks * 16]).view("<u8")
+            for i in range(num_blocks):
+                k1 = blocks[:, 2 * i].astype(np.uint64)
+                k2 = blocks[:, 2 * i + 1].astype(np.uint64)
+                k1 *= C1_64
+                k1 = _rotl64(k1, 31)
+                k1 *= C2_64
+                h1 ^= k1
+                h1 = _rotl64(h1, 27)
+                h1 += h2
+                h1 = h1 * np.uint64(5) + np.uint64(0x52DCE729)
+                k2 *= C2_64
+                k2 = _rotl64(k2, 33)
+                k2 *= C1_64
+                h2 ^= k2
+                h2 = _rotl64(h2, 31)
+                h2 += h1
+                h2 = h2 * np.uint64(5) + np.uint64(0x38495AB5)
+        tail_start = num_blocks * 16
+        tail = length & 15
+        if tail > 8:
+            k2 = _little_endian_words(data, tail_start + 8, tail - 8, np.uint64)
+            k2 *= C2_64
+            k2 = _rotl64(k2, 33)
+            k2 *= C1_64
+            h2 ^= k2
+        if tail:
+            k1 = _little_endian_words(data, tail_start, min(tail, 8), np.uint64)
+            k1 *= C1_64
+            k1 = _rotl64(k1, 31)
+            k1 *= C2_64
+            h1 ^= k1
+        h1 ^= np.uint64(length)
+        h2 ^= np.uint64(length)
+        h1 += h2
+        h2 += h1
+        h1 = _fmix64(h1)
+        h2 = _fmix64(h2)
+        h1 += h2
+        h2 += h1
+        return h1, h2
+
+
+def elements_to_matrix(elements: Iterable[Union[str, bytes]]) -> np.ndarray:
+    """
+    Pack equal length string or bytes elements into an (n_elements x element_length) uint8 matrix
+
+    :param elements: elements of identical length
+    :type elements: iterable
+    :return: uint8 matrix with one element per row
+    """
+    elements = [e.encode("utf-8") if isinstance(e, str) else e for e in elements]
+    if not elements:
+        return np.zeros((0, 0), dtype=np.uint8)
+    length = len(elements[0])
+    if any(len(e) != length for e in elements):
+        raise ValueError("All elements must have the same length")
+    return np.frombuffer(b"".join(elements), dtype=np.uint8).reshape(len(elements), length)
@@ -0,0 +1,132 @@
+"""
+Roaring-style container encoding of sparse bloom filters.
+
+The bloom filter is cut into containers of CONTAINER_BITS bits. A container with more than
+ARRAY_MAX_CARDINALITY set bits is stored as its raw big endian bitmap (CONTAINER_BYTES bytes),
+otherwise as the sorted uint16 offsets of its set bits, so no container takes more space than its
+bitmap. The encoded payload is
+
+    offsets (uint64 x num_containers + 1) | cardinalities (uint32 x num_containers) | containers
+
+with the offsets relative to the start of the containers, so any byte range of the bloom filter can
+be decoded by reading just the containers covering it.
+"""
+import math
+import numpy as np
+
+CONTAINER_BITS = 2 ** 16
+CONTAINER_BYTES = CONTAINER_BITS // 8
+ARRAY_MAX_CARDINALITY = CONTAINER_BITS // 16
+POPCOUNT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(
+    axis=1
+)
+
+
+def _num_containers(m):
+    return int(math.ceil(m / CONTAINER_BITS))
+
+
+def encode_containers(bits: np.ndarray, m: int) -> bytes:
+    """
+    Encode a bloom filter into containers
+
+    :param bits: the bloom filter as packed big endian bytes
+    :type bits: numpy.ndarray
+    :param m: the bloom filter size in bits
+    :type m: int
+    :return: the encoded payload
+    """
+    num_containers = _num_containers(m)
+    padded = np.zeros(num_containers * CONTAINER_BYTES, dtype=np.uint8)
+    padded[: len(bits)] = bits
+    padded = padded.reshape(num_containers, CONTAINER_BYTES)
+    cardinalities = POPCOUNT_TABLE[padded].sum(axis=1, dtype=np.uint32)
+    containers = []
+    for container, cardinality in zip(padded, cardinalities):
+        if cardinality > ARRAY_MAX_CARDINALITY:
+            containers.append(container.tobytes())
+        else:
+            offsets = np.flatnonzero(np.unpackbits(container)).astype("<u2")
+            containers.append(offsets.tobytes())
+    offsets = np.zeros(num_containers + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(c) for c in containers])
+    return b"".join(
+        [offsets.tobytes(), cardinalities.astype("<u4").tobytes()] + containers
+    )
+
+
+class ContainerBits(object):
+    """
+    Read only packed bytes of a container encoded bloom filter. Slicing decodes only the containers
+    covering the slice, so it can stand in for the memory mapped bytes of a raw bloom filter.
+
+    :Example:
+    >>> bits = ContainerBits(payload, m)
+    >>> first_bytes = bits[:1000]
+    """
+
+    def __init__(self, payload: np.ndarray, m: int) -> None:
+        """
+        Constructor
+
+        :param payload: the encoded payload, e.g. memory mapped from a bloom filter file
+        :type payload: numpy.ndarray
+        :param m: the bloom filter size in bits
+        :type m: int
+        """
+        self.m = m
+        num_containers = _num_containers(m)
+        self._offsets = np.frombuffer(
+            payload[: 8 * (num_containers + 1)].tobytes(), dtype="<u8"
+        ).astype(np.int64)
+        self._cardinalities = np.frombuffer(
+            payload[8 * (num_containers + 1) : 12 * num_containers + 8].tobytes(),
+            dtype="<u4",
+        )
+        self._containers = payload[12 * num_containers + 8 :]
+        ## Sequential readers take many small slices of the same container
+        self._cached = (None, None)
+        if len(self._containers) != self._offsets[-1]:
+            raise ValueError("Container payload is truncated")
+
+    @property
+    def popcount(self) -> int:
+        return int(self._cardinalities.sum())
+
+    def __len__(self) -> int:
+        return int(math.ceil(self.m / 8))
+
+    def _decode_container(self, i):
+        if self._cached[0] != i:
+            self._cached = (i, self._decode_uncached(i))
+        return self._cached[1]
+
+    def _decode_uncached(self, i):
+        data = self._containers[self._offsets[i] : self._offsets[i + 1]]
+        if self._cardinalities[i] > ARRAY_MAX_CARDINALITY:
+            return np.asarray(data)
+        bits = np.zeros(CONTAINER_BITS, dtype=np.uint8)
+        bits[np.frombuffer(data.tobytes(), dtype="<u2")] = 1
+        return np.packbits(bits)
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, slice):
+            raise TypeError("ContainerBits only supports slicing")
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("ContainerBits only supports contiguous slices")
+        if stop <= start:
+            return np.zeros(0, dtype=np.uint8)
+        first = start // CONTAINER_BYTES
+        last = (stop - 1) // CONTAINER_BYTES
+        decoded = np.concatenate(
+            [self._decode_container(i) for i in range(first, last + 1)]
+        )
+        return decoded[start - first * CONTAINER_BYTES : stop - first * CONTAINER_BYTES]
+
+    def __array__(self, dtype=None):
+        decoded = self[:]
+        return decoded if dtype is None else decoded.astype(dtype)
+
+    def tobytes(self) -> bytes:
+        return self[:].tobytes()
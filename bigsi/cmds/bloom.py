@@ -2,26 +2,190 @@
 from __future__ import print_function
 from bigsi.graph import BIGSI
 import os.path
+import csv
+import time
 import logging
 import json
+import multiprocessing
+import numpy as np
+from bigsi.bloom import BloomFilter
+from bigsi.bloom.bloom_file import ENCODINGS
+from bigsi.bloom.bloom_file import write_bloom_file
 
 logger = logging.getLogger(__name__)
 from bigsi.utils import DEFAULT_LOGGING_LEVEL
 
 logger.setLevel(DEFAULT_LOGGING_LEVEL)
 from bigsi.utils import seq_to_kmers
+from bigsi.utils.cortex import extract_kmer_codes_from_ctx
+from bigsi.utils.seqio import extract_kmer_codes_from_seqfile
+from bigsi.utils.sketches import HyperLogLog
+
+CTX_EXTENSION = ".ctx"
+SKETCH_EXTENSION = ".hll"
+SUMMARY_FIELDS = ["input", "output", "kmers_inserted", "distinct_kmers", "bits_set", "seconds"]
+
+## Per worker bloom filter, allocated once and cleared between samples
+_worker_bloomfilter = None
+_worker_config = None
 
 
 def bloom_file_name(f):
     return f
 
 
-def bloom(config, outfile, kmers):
+def sketch_file_name(f):
+    ## The HyperLogLog of a bloom filter's kmers is kept alongside it
+    return bloom_file_name(f) + SKETCH_EXTENSION
+
+
+def write_sketch(f, hll):
+    with open(sketch_file_name(f), "wb") as outfile:
+        outfile.write(hll.to_bytes())
+
+
+def read_sketch(f):
+    try:
+        with open(sketch_file_name(f), "rb") as infile:
+            return HyperLogLog.from_bytes(infile.read())
+    except FileNotFoundError:
+        return None
+
+
+def read_kmer_count(f):
+    hll = read_sketch(f)
+    return None if hll is None else hll.estimate()
+
+
+def extract_kmer_codes(infile, k, min_count=1):
+    ## Cortex graphs carry their own coverage, anything else is read as FASTA/FASTQ
+    if infile.endswith(CTX_EXTENSION):
+        return extract_kmer_codes_from_ctx(infile, k, min_coverage=min_count)
+    else:
+        return extract_kmer_codes_from_seqfile(infile, k, min_count=min_count)
+
+
+def _write_bloomfilter(outfile, bloomfilter, config, encoding="raw"):
     outfile = os.path.realpath(outfile)
-    bloomfilter = BIGSI.bloom(config, kmers)
-    off = bloom_file_name(outfile)
     directory = os.path.dirname(outfile)
     if not os.path.exists(directory):
         os.makedirs(directory)
     with open(outfile, "wb") as of:
-        bloomfilter.tofile(of)
+        write_bloom_file(
+            of,
+            bloomfilter,
+            h=config["h"],
+            k=config["k"],
+            double_hashing=config.get("double_hashing", False),
+            block_size=config.get("block_size", 0),
+            encoding=ENCODINGS[encoding],
+        )
+
+
+def _sketch_kmers(kmers, counter, hll):
+    ## counter holds the number of kmer codes seen and whether all kmers were codes
+    for block in kmers:
+        if isinstance(block, np.ndarray):
+            counter[0] += len(block)
+            hll.update(block)
+        else:
+            counter[1] = False
+        yield block
+
+
+def _bloom_and_sketch(config, kmers, bloomfilter=None):
+    ## Returns the bloom filter, the number of kmer codes inserted and their
+    ## HyperLogLog, which is None if the kmers were strings
+    if isinstance(kmers, np.ndarray):
+        kmers = [kmers]
+    counter = [0, True]
+    hll = HyperLogLog()
+    bloomfilter = BIGSI.bloom(
+        config, _sketch_kmers(kmers, counter, hll), bloomfilter=bloomfilter
+    )
+    return bloomfilter, counter[0], hll if counter[1] else None
+
+
+def bloom(config, outfile, kmers, encoding="raw"):
+    bloomfilter, _, hll = _bloom_and_sketch(config, kmers)
+    _write_bloomfilter(outfile, bloomfilter, config, encoding)
+    if hll is not None:
+        write_sketch(outfile, hll)
+
+
+def read_bloom_batch_file(from_file):
+    with open(from_file, "r") as tsvfile:
+        return [
+            (row[0], row[1]) for row in csv.reader(tsvfile, delimiter="\t") if row
+        ]
+
+
+def _init_bloom_worker(config):
+    global _worker_bloomfilter, _worker_config
+    _worker_config = config
+    _worker_bloomfilter = BloomFilter(
+        m=config["m"],
+        h=config["h"],
+        double_hashing=config.get("double_hashing", False),
+        block_size=config.get("block_size", 0),
+    )
+
+
+def _bloom_worker(args):
+    infile, outfile, min_count, encoding = args
+    start = time.time()
+    bloomfilter, num_kmers, hll = _bloom_and_sketch(
+        _worker_config,
+        extract_kmer_codes(infile, _worker_config["k"], min_count),
+        bloomfilter=_worker_bloomfilter.clear(),
+    )
+    _write_bloomfilter(outfile, bloomfilter, _worker_config, encoding)
+    if hll is not None:
+        write_sketch(outfile, hll)
+    return {
+        "input": infile,
+        "output": outfile,
+        "kmers_inserted": num_kmers,
+        "distinct_kmers": 0 if hll is None else hll.estimate(),
+        "bits_set": bloomfilter.count(),
+        "seconds": round(time.time() - start, 3),
+    }
+
+
+def _collect_results(results):
+    collected = []
+    for result in results:
+        logger.info("Built bloom filter %s" % result["output"])
+        collected.append(result)
+    return collected
+
+
+def bloom_batch(
+    config, input_output_pairs, min_count=1, nproc=1, summary=None, encoding="raw"
+):
+    """
+    Builds one bloom filter per (input, output) pair over a pool of nproc processes.
+
+    Each worker allocates a single bloom filter and clears it between samples. Returns a summary
+    row per sample (kmers inserted, estimated distinct kmers, bits set, seconds taken), also
+    written as a TSV to summary if given. Kmers are inserted per input block, so kmers_inserted
+    counts a kmer passing min_count in several blocks of a sequence file more than once, while
+    distinct_kmers is the HyperLogLog estimate of the number of different kmers.
+    """
+    args = [
+        (infile, outfile, min_count, encoding) for infile, outfile in input_output_pairs
+    ]
+    if nproc > 1:
+        with multiprocessing.Pool(
+            processes=nproc, initializer=_init_bloom_worker, initargs=(config,)
+        ) as pool:
+            results = _collect_results(pool.imap(_bloom_worker, args))
+    else:
+        _init_bloom_worker(config)
+        results = _collect_results(map(_bloom_worker, args))
+    if summary:
+        with open(summary, "w") as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=SUMMARY_FIELDS, delimiter="\t")
+            writer.writeheader()
+            writer.writerows(results)
+    return results
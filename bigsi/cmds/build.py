@@ -16,70 +16,142 @@ from bitarray import bitarray
 import math
 from bigsi.utils import chunks
 from bigsi.cmds.bloom import bloom_file_name
+from bigsi.cmds.bloom import read_kmer_count
+from bigsi.bloom import BloomFilterFile
+from bigsi.cmds.build_plan import DEFAULT_WRITE_BATCH_ROWS
+from bigsi.cmds.build_plan import plan_build
+from bigsi.matrix.transpose import LOW_MEM_BAND_SIZE
+from bigsi.matrix.transpose import TRANSPOSE_BAND_SIZE
+from bigsi.utils.memory import RSSTracker
+import copy
+import humanfriendly
 import tempfile
 
 
-def load_bloomfilter(f):
+def open_bloomfilter(f, config=None, verify=True):
+    ## Memory maps the bloom filter, checking it was built with the config's parameters. With
+    ## verify the whole file is read once to check its checksum.
     ff = bloom_file_name(f)
     logger.debug("Loading %s " % ff)
-    bloomfilter = bitarray()
-    with open(ff, "rb") as inf:
-        bloomfilter.fromfile(inf)
+    bloomfilter = BloomFilterFile(ff, m=config["m"] if config else None)
+    if config:
+        bloomfilter.validate(
+            m=config["m"],
+            h=config["h"],
+            k=config["k"],
+            double_hashing=config.get("double_hashing", False),
+            block_size=config.get("block_size", 0),
+        )
+    if verify:
+        bloomfilter.verify()
     return bloomfilter
 
 
-def get_required_bytes_per_bloomfilter(m):
-    return m * 9 / 8
+def load_bloomfilter(f, config=None):
+    with open_bloomfilter(f, config) as bloomfilter:
+        return bloomfilter.to_bitarray()
 
 
-def get_required_chunk_size(N, m, max_memory):
-    bytes_per_bloomfilter = get_required_bytes_per_bloomfilter(m)
-    required_bytes = bytes_per_bloomfilter * N
-    num_chunks = math.ceil(required_bytes / max_memory)
-    chunk_size = math.floor(N / num_chunks)
-    return chunk_size, num_chunks
+def _write_batch_rows(config):
+    ## berkeleydb writes a row at a time, rocksdb and redis buffer write_batch_size rows
+    if config.get("storage-engine") in ("rocksdb", "redis"):
+        return int(config["storage-config"].get("write_batch_size", DEFAULT_WRITE_BATCH_ROWS))
+    return 1
 
 
-def build(config, bloomfilter_filepaths, samples, max_memory=None):
-    # Max memory is in bytes
-    if max_memory is None:
-        chunk_size = len(bloomfilter_filepaths)
-        num_chunks = 1
-    else:
-        chunk_size, num_chunks = get_required_chunk_size(
-            N=len(samples), m=config["h"], max_memory=max_memory
+def log_build_plan(plan):
+    logger.info(
+        "Build plan: %i samples in %i chunk(s) of %i, transposed in bands of %s by %i process(es)"
+        % (
+            plan["num_samples"],
+            plan["num_chunks"],
+            plan["chunk_size"],
+            humanfriendly.format_size(plan["band_size"], binary=True),
+            plan["nproc"],
+        )
+    )
+    for stage, num_bytes in plan["stage_bytes"].items():
+        logger.info(
+            "Build plan: %s needs about %s"
+            % (stage, humanfriendly.format_size(num_bytes, binary=True))
         )
-    if chunk_size < 1:
-        raise ValueError("Max memory must be at least 8 * Bloomfilter size in bytes")
+    logger.info(
+        "Build plan: peak of about %s, including %s already in use"
+        % (
+            humanfriendly.format_size(plan["peak_bytes"], binary=True),
+            humanfriendly.format_size(plan["baseline_bytes"], binary=True),
+        )
+    )
+
+
+def build(config, bloomfilter_filepaths, samples, max_memory=None):
+    # Max memory is in bytes. The chunk size, transpose band size and number of
+    # processes are planned to fit in it, and the peak RSS of each stage is tracked.
+    plan = plan_build(
+        num_samples=len(samples),
+        m=int(config["m"]),
+        max_memory=max_memory,
+        nproc=config.get("nproc", 1),
+        block_size=config.get("block_size", 0),
+        write_batch_rows=_write_batch_rows(config),
+        max_band_size=config.get("transpose_band_size")
+        or (LOW_MEM_BAND_SIZE if config.get("low_mem_build") else TRANSPOSE_BAND_SIZE),
+    )
+    log_build_plan(plan)
+    config = copy.deepcopy(config)
+    config["transpose_band_size"] = plan["band_size"]
+    config["nproc"] = plan["nproc"]
+    chunk_size = plan["chunk_size"]
+    num_chunks = plan["num_chunks"]
+    tracker = RSSTracker()
     LL = list(zip(bloomfilter_filepaths, samples))
+    tmp_indexes = []
     for i, v in enumerate(chunks(LL, chunk_size)):
         bloomfilter_filepaths = [x[0] for x in v]
         # print(bloomfilter_filepaths)
         samples = [x[1] for x in v]
         logger.info("Building index: %i/%i" % (i, num_chunks))
         if i == 0:
-            index = build_main(config, bloomfilter_filepaths, samples)
+            index = build_main(config, bloomfilter_filepaths, samples, tracker)
         else:
-            tmp_index = build_tmp(config, bloomfilter_filepaths, samples, i)
-            index.merge(tmp_index)
-            tmp_index.delete()
-    return {"result": "success"}
-
-
-def build_main(config, bloomfilter_filepaths, samples):
-    bloomfilters = []
-    for f in bloomfilter_filepaths:
-        bloomfilters.append(load_bloomfilter(f))
-    return BIGSI.build(config, bloomfilters, samples)
-
-
-import copy
-
-
-def build_tmp(config, bloomfilter_filepaths, samples, i):
-    tmpconfig = copy.copy(config)
+            tmp_indexes.append(
+                build_tmp(config, bloomfilter_filepaths, samples, i, tracker)
+            )
+    ## All chunks are merged in one pass, so each row is rewritten once
+    if tmp_indexes:
+        with tracker.stage("merge"):
+            index.merge(*tmp_indexes, batch_rows=plan["merge_batch_rows"])
+    for tmp_index in tmp_indexes:
+        tmp_index.delete()
+    for stage, num_bytes in tracker.peaks.items():
+        logger.info(
+            "Peak RSS of %s: %s" % (stage, humanfriendly.format_size(num_bytes, binary=True))
+        )
+    return {"result": "success", "plan": plan, "peak_rss": dict(tracker.peaks)}
+
+
+def build_main(config, bloomfilter_filepaths, samples, tracker=None):
+    if tracker is None:
+        tracker = RSSTracker()
+    with tracker.stage("load"):
+        ## Checksums are only checked with verify_bloomfilters set, as that reads every bloom
+        ## filter before it is transposed
+        verify = config.get("verify_bloomfilters", False)
+        bloomfilters = []
+        for f in bloomfilter_filepaths:
+            bloomfilters.append(open_bloomfilter(f, config, verify))
+        kmer_counts = [read_kmer_count(f) for f in bloomfilter_filepaths]
+    ## Bands are transposed and written as they are read, so these stages are tracked together
+    with tracker.stage("transpose_and_write"):
+        return BIGSI.build(config, bloomfilters, samples, kmer_counts)
+
+
+def build_tmp(config, bloomfilter_filepaths, samples, i, tracker=None):
+    tmpconfig = copy.deepcopy(config)
     if config["storage-engine"] == "redis":
-        config["storage-config"]["db"] = i
+        tmpconfig["storage-config"]["db"] = i
     else:
-        config["storage-config"]["filename"] = config["filename"] + "%i.tmp" % i
-    return build_main(config, bloomfilter_filepaths, samples, index)
+        tmpconfig["storage-config"]["filename"] = (
+            config["storage-config"]["filename"] + "%i.tmp" % i
+        )
+    return build_main(tmpconfig, bloomfilter_filepaths, samples, tracker)
@@ -0,0 +1,211 @@
+import math
+import sys
+import tracemalloc
+import numpy as np
+from bitarray import bitarray
+
+from bigsi.graph.index import MERGE_BATCH_ROWS
+from bigsi.matrix.bitmatrix import STORE_BATCH_BYTES
+from bigsi.matrix.transpose import TRANSPOSE_BAND_SIZE
+from bigsi.matrix.transpose import LOW_MEM_BAND_SIZE
+from bigsi.matrix.transpose import bytes_per_band
+from bigsi.matrix.transpose import transpose_numpy
+from bigsi.utils.memory import current_rss
+
+## Smallest band tried, and the smallest band worth splitting between processes
+MIN_BAND_SIZE = 2 ** 16
+MIN_PARALLEL_BAND_SIZE = LOW_MEM_BAND_SIZE
+## Rows the rocksdb and redis backends buffer per write by default
+DEFAULT_WRITE_BATCH_ROWS = 10000
+## Bytes of each bloom filter transposed by the calibration run
+CALIBRATION_BYTES = 2 ** 12
+CALIBRATION_COLS = 64
+## Merges hold a batch of every index, the prefetched next batch and the merged rows
+MERGE_BATCHES_HELD = 3
+## Every bloom filter of a chunk is memory mapped, using up to this share of vm.max_map_count
+MAX_MAP_COUNT_PATH = "/proc/sys/vm/max_map_count"
+DEFAULT_MAX_MAP_COUNT = 65530
+BLOOMFILTER_MAP_SHARE = 0.5
+
+
+def default_max_open_bloomfilters():
+    ## Leaves the rest of the memory maps to the interpreter, libraries and allocator
+    try:
+        with open(MAX_MAP_COUNT_PATH) as infile:
+            max_map_count = int(infile.read())
+    except (OSError, ValueError):
+        max_map_count = DEFAULT_MAX_MAP_COUNT
+    return max(1, int(max_map_count * BLOOMFILTER_MAP_SHARE))
+
+
+def measure_transpose_factor():
+    ## Peak bytes allocated by transposing one band, per byte of the band, measured with tracemalloc
+    arrays = [
+        np.random.randint(0, 256, CALIBRATION_BYTES, dtype=np.uint8)
+        for _ in range(CALIBRATION_COLS)
+    ]
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        for _ in transpose_numpy(arrays, CALIBRATION_BYTES * 8, CALIBRATION_BYTES * CALIBRATION_COLS):
+            pass
+        peak = tracemalloc.get_traced_memory()[1] - start
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    return peak / (CALIBRATION_BYTES * CALIBRATION_COLS)
+
+
+def measure_row_overhead():
+    ## Bytes held per row handed to storage besides its packed bits: the bitarray and its bytes
+    return sys.getsizeof(bitarray(endian="big")) + sys.getsizeof(b"")
+
+
+def build_footprint(
+    num_samples,
+    m,
+    chunk_size,
+    band_size,
+    nproc,
+    transpose_factor,
+    row_overhead,
+    block_size=0,
+    write_batch_rows=DEFAULT_WRITE_BATCH_ROWS,
+    merge_batch_rows=MERGE_BATCH_ROWS,
+):
+    ## Bytes held by each stage of building num_samples samples in chunks of chunk_size
+    row_bytes = int(math.ceil(chunk_size / 8))
+    band_bytes = min(bytes_per_band(chunk_size, band_size), int(math.ceil(m / 8)))
+    band = 8 * row_bytes * band_bytes
+    stages = {
+        ## The bytes of every bloom filter covered by the bands in flight
+        "load": chunk_size * band_bytes * nproc,
+        ## Each process transposes one band at a time, the main process reads shards back a band at a time
+        "transpose": int(transpose_factor * band * nproc) + (band if nproc > 1 else 0),
+        "write": (
+            2 * STORE_BATCH_BYTES
+            if block_size
+            else write_batch_rows * (row_bytes + row_overhead)
+        ),
+        "merge": 0,
+    }
+    if chunk_size < num_samples:
+        stages["merge"] = (
+            MERGE_BATCHES_HELD
+            * merge_batch_rows
+            * (int(math.ceil(num_samples / 8)) + row_overhead)
+        )
+    return stages
+
+
+def _halvings(largest, smallest):
+    value = largest
+    while value >= smallest:
+        yield value
+        value //= 2
+
+
+def plan_build(
+    num_samples,
+    m,
+    max_memory=None,
+    nproc=1,
+    block_size=0,
+    write_batch_rows=DEFAULT_WRITE_BATCH_ROWS,
+    max_band_size=TRANSPOSE_BAND_SIZE,
+    max_open_bloomfilters=None,
+):
+    """
+    Plan a build of num_samples bloom filters of m bits to fit in max_memory bytes of memory.
+
+    The footprint of each stage is estimated from a calibration run of the transpose and the
+    memory the process already uses. Loading, transposing and writing are streamed together, so
+    their footprints add up, while merging chunks happens afterwards. The plan uses as many of the
+    nproc processes as fit, with bands of at least MIN_PARALLEL_BAND_SIZE bytes, and then the
+    biggest band that fits. Samples are only split into chunks, built separately and merged in
+    batches of merge_batch_rows rows, if a single process with the smallest band does not fit, or
+    if there are more samples than bloom filters can be memory mapped at once.
+
+    :param num_samples: the number of bloom filters
+    :type num_samples: int
+    :param m: the bloom filter size
+    :type m: int
+    :param max_memory: the memory budget in bytes, None for no limit
+    :type max_memory: int
+    :param nproc: the largest number of transpose processes
+    :type nproc: int
+    :param block_size: the blocked bloom block size, whose rows are written as blocks
+    :type block_size: int
+    :param write_batch_rows: the number of rows the storage buffers per write
+    :type write_batch_rows: int
+    :param max_band_size: the largest transpose band size
+    :type max_band_size: int
+    :param max_open_bloomfilters: the most bloom filters memory mapped at once, which defaults to
+        half of vm.max_map_count
+    :type max_open_bloomfilters: int
+    :return: dict of the chosen chunk_size, num_chunks, band_size, nproc and merge_batch_rows, and
+        the estimated bytes of each stage
+    """
+    transpose_factor = measure_transpose_factor()
+    row_overhead = measure_row_overhead()
+    baseline = current_rss()
+    nproc = max(1, int(nproc))
+    if max_open_bloomfilters is None:
+        max_open_bloomfilters = default_max_open_bloomfilters()
+    largest_chunk_size = max(1, min(num_samples, int(max_open_bloomfilters)))
+
+    def make_plan(chunk_size, band_size, workers, merge_batch_rows=MERGE_BATCH_ROWS):
+        stages = build_footprint(
+            num_samples,
+            m,
+            chunk_size,
+            band_size,
+            workers,
+            transpose_factor,
+            row_overhead,
+            block_size,
+            write_batch_rows,
+            merge_batch_rows,
+        )
+        return {
+            "num_samples": num_samples,
+            "m": m,
+            "chunk_size": chunk_size,
+            "num_chunks": int(math.ceil(num_samples / chunk_size)),
+            "band_size": band_size,
+            "nproc": workers,
+            "merge_batch_rows": merge_batch_rows,
+            "transpose_factor": transpose_factor,
+            "baseline_bytes": baseline,
+            "stage_bytes": stages,
+            "peak_bytes": baseline
+            + max(stages["load"] + stages["transpose"] + stages["write"], stages["merge"]),
+            "max_memory": max_memory,
+        }
+
+    def fits(plan):
+        return plan["peak_bytes"] <= max_memory
+
+    if max_memory is None:
+        return make_plan(largest_chunk_size, max_band_size, nproc)
+    for chunk_size in _halvings(largest_chunk_size, 1):
+        for workers in range(nproc, 0, -1):
+            min_band_size = MIN_PARALLEL_BAND_SIZE if workers > 1 else MIN_BAND_SIZE
+            for band_size in _halvings(max_band_size, min_band_size):
+                plan = make_plan(chunk_size, band_size, workers)
+                if chunk_size < num_samples:
+                    ## Merges use the largest batches that fit
+                    for merge_batch_rows in _halvings(MERGE_BATCH_ROWS, 1):
+                        plan = make_plan(chunk_size, band_size, workers, merge_batch_rows)
+                        if fits(plan):
+                            break
+                if fits(plan):
+                    return plan
+    raise ValueError(
+        "max_memory of %i bytes is too small to build an index (the process already uses %i bytes)"
+        % (max_memory, baseline)
+    )
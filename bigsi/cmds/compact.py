@@ -0,0 +1,7 @@
+#! /usr/bin/env python
+
+
+def compact(index):
+    ## Rewrites the index without the columns of deleted samples
+    num_deleted = index.compact()
+    return {"result": "success", "deleted_samples": num_deleted}
@@ -11,10 +11,20 @@ from bigsi.utils import DEFAULT_LOGGING_LEVEL
 
 logger.setLevel(DEFAULT_LOGGING_LEVEL)
 from bitarray import bitarray
-from bigsi.cmds.build import load_bloomfilter
+from bigsi.cmds.build import open_bloomfilter
+from bigsi.cmds.bloom import read_kmer_count
 
 
 def insert(index, bloomfilter, sample):
-    ## To do add warning that build is normally preferable
-    index.insert(load_bloomfilter(bloomfilter), sample)
+    return insert_many(index, [bloomfilter], [sample])
+
+
+def insert_many(index, bloomfilter_filepaths, samples):
+    ## Bloom filter files are memory mapped, and appended to the index in one pass
+    bloomfilters = [open_bloomfilter(f, index.config) for f in bloomfilter_filepaths]
+    index.insert_many(
+        bloomfilters,
+        samples,
+        kmer_counts=[read_kmer_count(f) for f in bloomfilter_filepaths],
+    )
     return {"result": "success"}
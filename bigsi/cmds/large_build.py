@@ -1,41 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
 from typing import List
 from bigsi.storage import get_storage
 from bigsi.graph.metadata import SampleMetadata
 from bigsi.bloom import BitMatrixGroupReader
+from bigsi.matrix.bitmatrix import ROWS_PER_BLOCK_KEY
+from bigsi.matrix.bitmatrix import ROWS_VERSION_KEY
+from bigsi.matrix.popcounts import create_popcounts
+from bigsi.matrix.popcounts import has_popcounts
+from bigsi.matrix.popcounts import set_popcounts
+from bigsi.matrix.bitmatrix import store_blocks
+from bigsi.cmds.bloom import read_kmer_count
+
+logger = logging.getLogger(__name__)
 
 BLOOM_FILTERS_SIZE_KEY = "ksi:bloomfilter_size"
 NUM_HASH_FUNCTIONS_KEY = "ksi:num_hashes"
+DOUBLE_HASHING_KEY = "ksi:double_hashing"
+BLOCK_SIZE_KEY = "ksi:block_size"
 NUM_ROWS_KEY = "number_of_rows"
 NUM_COLS_KEY = "number_of_cols"
+## The build checkpoint: the inputs it is for, and the first row not yet committed. The next row is
+## BUILD_COMPLETE once the whole index has been written.
+BUILD_FINGERPRINT_KEY = "build_checkpoint:fingerprint"
+BUILD_NEXT_ROW_KEY = "build_checkpoint:next_row"
+BUILD_COMPLETE = -1
 DB_INSERT_BATCH_SIZE = 1000
 
 
+def input_fingerprint(config, input_path_list, num_cols_list, sample_list):
+    ## Changes if the parameters, samples or any input file (by size and modification time) change
+    inputs = []
+    for input_path in input_path_list:
+        stat = os.stat(input_path)
+        inputs.append([os.path.abspath(input_path), stat.st_size, stat.st_mtime_ns])
+    fingerprint = {
+        "m": int(config["m"]),
+        "h": int(config["h"]),
+        "double_hashing": bool(config.get("double_hashing", False)),
+        "block_size": int(config.get("block_size", 0)),
+        "inputs": inputs,
+        "num_cols": [int(num_cols) for num_cols in num_cols_list],
+        "samples": sample_list,
+    }
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def read_build_checkpoint(storage):
+    ## (fingerprint, next row) of the last build into storage, or None if it has no checkpoint
+    try:
+        return (
+            storage.get_string(BUILD_FINGERPRINT_KEY),
+            storage.get_integer(BUILD_NEXT_ROW_KEY),
+        )
+    except KeyError:
+        return None
+
+
+def write_build_checkpoint(storage, fingerprint, next_row):
+    storage.set_string(BUILD_FINGERPRINT_KEY, fingerprint)
+    storage.set_integer(BUILD_NEXT_ROW_KEY, next_row)
+    storage.sync()
+
+
 def large_build(config: str, input_path_list: List[str], num_cols_list: List[int], sample_list: List[str]):
     storage = get_storage(config)
     num_rows = int(config["m"])
+    num_cols = sum(map(int, num_cols_list))
+    block_size = int(config.get("block_size", 0))
+    ## Blocked layouts are written a whole number of blocks at a time
+    batch_size = DB_INSERT_BATCH_SIZE
+    if block_size:
+        batch_size = block_size * max(1, DB_INSERT_BATCH_SIZE // block_size)
+
+    ## A build of the same inputs into the same storage resumes from its last committed batch.
+    ## An interrupted build of other inputs is cleared, but a built index is never overwritten.
+    fingerprint = input_fingerprint(config, input_path_list, num_cols_list, sample_list)
+    checkpoint = read_build_checkpoint(storage)
+    first_row = 0
+    if checkpoint is not None and checkpoint[0] == fingerprint:
+        if checkpoint[1] == BUILD_COMPLETE:
+            logger.info("Index is already built")
+            storage.close()
+            return
+        first_row = checkpoint[1]
+        logger.info("Resuming build from row %i/%i" % (first_row, num_rows))
+    elif checkpoint is not None and checkpoint[1] != BUILD_COMPLETE:
+        logger.warning("Inputs differ from the interrupted build, starting again")
+        storage.delete_all()
+    elif checkpoint is not None or SampleMetadata(storage).num_samples:
+        storage.close()
+        raise ValueError(
+            "The storage already holds an index, delete it before building another"
+        )
+    write_build_checkpoint(storage, fingerprint, first_row)
+    if first_row == 0 or not has_popcounts(storage):
+        ## Row popcounts are written with the rows. Builds resumed from before popcounts were
+        ## kept have zeros for the rows already written, which only affects the order rows are
+        ## read in by exact searches.
+        create_popcounts(storage, num_rows)
+
+    def write_rows(keys, bit_arrays):
+        if block_size:
+            store_blocks(storage, keys[0] // block_size, bit_arrays, block_size, num_cols)
+        else:
+            storage.set_bitarrays(keys, bit_arrays)
+        set_popcounts(storage, keys, [ba.count() for ba in bit_arrays])
+        ## Rows are committed before the checkpoint, so a crash in between only redoes the batch
+        storage.sync()
+        write_build_checkpoint(storage, fingerprint, keys[-1] + 1)
 
     with BitMatrixGroupReader(zip(input_path_list, num_cols_list), num_rows) as bmgr:
+        bmgr.skip_rows(first_row)
         processed = 0
         bit_arrays = []
         keys = []
-        for row_index in range(num_rows):
+        for row_index in range(first_row, num_rows):
             keys.append(row_index)
             bit_arrays.append(next(bmgr))
             processed = processed + 1
-            if processed == DB_INSERT_BATCH_SIZE:
-                storage.set_bitarrays(keys, bit_arrays)
-                storage.sync()
+            if processed == batch_size:
+                write_rows(keys, bit_arrays)
                 keys = []
                 bit_arrays = []
                 processed = 0
         if processed != 0:
-            storage.set_bitarrays(keys, bit_arrays)
-            storage.sync()
+            write_rows(keys, bit_arrays)
 
-    SampleMetadata(storage).add_samples(sample_list)
+    sm = SampleMetadata(storage)
+    ## Samples added before an interruption of this build are kept
+    sm.add_samples(sample_list[sm.num_samples :])
+    ## Single sample inputs are bloom filters, which may have a kmer count sketch
+    colour = 0
+    for input_path, num_cols in zip(input_path_list, num_cols_list):
+        kmer_count = read_kmer_count(input_path) if int(num_cols) == 1 else None
+        if kmer_count is not None:
+            sm.set_sample_kmer_count(sample_list[colour], kmer_count)
+        colour += int(num_cols)
     storage.set_integer(BLOOM_FILTERS_SIZE_KEY, num_rows)
     storage.set_integer(NUM_HASH_FUNCTIONS_KEY, int(config["h"]))
+    storage.set_integer(DOUBLE_HASHING_KEY, int(config.get("double_hashing", False)))
+    storage.set_integer(BLOCK_SIZE_KEY, block_size)
+    storage.set_integer(ROWS_PER_BLOCK_KEY, block_size)
+    storage.set_integer(NUM_COLS_KEY, num_cols)
     storage.set_integer(NUM_ROWS_KEY, num_rows)
-    storage.set_integer(NUM_COLS_KEY, sum(num_cols_list))
-    storage.sync()
+    storage.set_string(ROWS_VERSION_KEY, uuid.uuid4().hex)
+    write_build_checkpoint(storage, fingerprint, BUILD_COMPLETE)
     storage.close()
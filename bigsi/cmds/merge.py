@@ -1,5 +1,5 @@
 #! /usr/bin/env python
 
 
-def merge(index1, index2):
-    index1.merge(index2)
+def merge(index1, *indexes):
+    index1.merge(*indexes)
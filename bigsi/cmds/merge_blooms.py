@@ -1,13 +1,53 @@
+import multiprocessing
 from typing import List, Tuple
 from bigsi.bloom import BitMatrixGroupReader
 from bigsi.bloom import BitMatrixWriter
+from bigsi.bloom.aligned_matrix import AlignedBitMatrixFile
+from bigsi.bloom.aligned_matrix import create_aligned_matrix
+from bigsi.bloom.aligned_matrix import pack_rows
+from bigsi.bloom.bit_matrix_reader import ROWS_PER_SLICE
 
 
-def merge_blooms(input_data: List[Tuple[str, int]], num_rows: int, bloom_matrix_out: str):
+def row_ranges(num_rows, num_parts):
+    ## Splits the rows into about num_parts ranges of whole slices, so every range starts on a slice of the inputs
+    num_slices = -(-num_rows // ROWS_PER_SLICE)
+    slices_per_part = max(1, -(-num_slices // max(num_parts, 1)))
+    rows_per_part = slices_per_part * ROWS_PER_SLICE
+    return [(start, min(start + rows_per_part, num_rows)) for start in range(0, num_rows, rows_per_part)]
+
+
+def _merge_row_range(args):
+    ## Fills rows [start, stop) of the aligned output from the inputs
+    input_data, num_rows, bloom_matrix_out, start, stop = args
+    with BitMatrixGroupReader(input_data, num_rows) as bmgr, \
+            AlignedBitMatrixFile(bloom_matrix_out, mode="r+") as output:
+        bmgr.set_row_range(start, stop)
+        row_index = start
+        for num_rows_in_block, block in bmgr.iter_blocks():
+            output.write_rows(row_index, pack_rows(block, num_rows_in_block, output.num_cols, output.row_bytes))
+            row_index += num_rows_in_block
+
+
+def merge_blooms(input_data: List[Tuple[str, int]], num_rows: int, bloom_matrix_out: str, alignment: int = 0,
+                 nproc: int = 1):
+    ## With alignment > 0 the output is an aligned matrix file with rows padded to alignment bytes, which is
+    ## filled by nproc processes each merging its own range of rows
     input_path_list, num_cols_list = zip(*input_data)
     total_cols = sum(map(int, num_cols_list))
+    if alignment:
+        create_aligned_matrix(bloom_matrix_out, num_rows, total_cols, alignment)
+        input_data = list(zip(input_path_list, num_cols_list))
+        tasks = [(input_data, num_rows, bloom_matrix_out, start, stop) for start, stop in row_ranges(num_rows, nproc)]
+        if nproc > 1:
+            with multiprocessing.Pool(processes=nproc) as pool:
+                pool.map(_merge_row_range, tasks)
+        else:
+            for task in tasks:
+                _merge_row_range(task)
+        return
     with open(bloom_matrix_out, "wb") as output:
         with BitMatrixGroupReader(zip(input_path_list, num_cols_list), num_rows) as bmgr,\
                 BitMatrixWriter(output, num_rows, total_cols) as bmw:
-            for row in bmgr:
-                bmw.write(row)
+            ## Blocks are written whole while the reader prefetches the next ones
+            for num_rows_in_block, block in bmgr.iter_blocks():
+                bmw.write_block(block, num_rows_in_block)
@@ -0,0 +1,83 @@
+import math
+from typing import List, Optional
+
+## Defaults follow scripts/bigsi-param-calculation.R
+DEFAULT_MAX_FALSE_DISCOVERY_RATE = 10 ** -6
+
+
+def bloom_false_positive_rate(m: int, num_kmers: int, h: int) -> float:
+    return (1 - math.exp(-h * num_kmers / m)) ** h
+
+
+def optimal_num_hashes(m: int, num_kmers: int) -> int:
+    return max(1, int(round(m / num_kmers * math.log(2))))
+
+
+def _min_bloomfilter_size(p: float, num_kmers: int, h: int) -> int:
+    ## Smallest m with a false positive rate of at most p for h hash functions
+    return int(math.ceil(-h * num_kmers / math.log(1 - p ** (1 / h))))
+
+
+def recommend_params(
+    kmer_counts: List[int],
+    k: int,
+    max_false_discovery_rate: float = DEFAULT_MAX_FALSE_DISCOVERY_RATE,
+    min_query_length: Optional[int] = None,
+    max_memory: Optional[int] = None,
+) -> dict:
+    """
+    Recommend the bloom filter size m and number of hash functions h for an index of samples.
+
+    m and h are chosen so that a query of min_query_length bases (2k - 1 by default) is expected
+    to be a false positive in at most max_false_discovery_rate of searches, summed over all
+    samples, for the sample with the most distinct kmers. If the index would not fit in max_memory
+    bytes, m is shrunk to fit and h chosen for that m, and the false discovery rate reported is the
+    one achieved.
+
+    :param kmer_counts: the number of distinct kmers in each sample
+    :type kmer_counts: list
+    :param k: the kmer size
+    :type k: int
+    :param max_false_discovery_rate: the target false discovery rate of a query
+    :type max_false_discovery_rate: float
+    :param min_query_length: the length of the shortest query to meet the target
+    :type min_query_length: int
+    :param max_memory: the largest index size in bytes
+    :type max_memory: int
+    :return: dict of the recommended parameters and their expected rates
+    """
+    if not kmer_counts:
+        raise ValueError("At least one sample kmer count is needed")
+    if min_query_length is None:
+        min_query_length = 2 * k - 1
+    query_kmers = min_query_length - k + 1
+    if query_kmers < 1:
+        raise ValueError("min_query_length must be at least k")
+    num_samples = len(kmer_counts)
+    max_kmers = max(max(kmer_counts), 1)
+
+    ## Per kmer false positive rate giving the target rate for a whole query
+    p = (max_false_discovery_rate / num_samples) ** (1 / query_kmers)
+    ## The optimal h is -log2(p), so take whichever of the integers around it needs the smaller m
+    eta = -math.log(p) / math.log(2)
+    m, h = min(
+        (_min_bloomfilter_size(p, max_kmers, h), h)
+        for h in {max(1, int(math.floor(eta))), max(1, int(math.ceil(eta)))}
+    )
+    memory_bound = max_memory is not None and m * num_samples / 8 > max_memory
+    if memory_bound:
+        m = int(math.floor(max_memory * 8 / num_samples))
+        if m < 1:
+            raise ValueError("max_memory is too small for %i samples" % num_samples)
+        h = optimal_num_hashes(m, max_kmers)
+    bloom_fpr = bloom_false_positive_rate(m, max_kmers, h)
+    return {
+        "num_samples": num_samples,
+        "max_kmers": max_kmers,
+        "m": m,
+        "h": h,
+        "bloom_false_positive_rate": bloom_fpr,
+        "query_false_discovery_rate": num_samples * bloom_fpr ** query_kmers,
+        "index_size_bytes": int(math.ceil(m * num_samples / 8)),
+        "memory_bound": memory_bound,
+    }
@@ -1,17 +1,26 @@
 import logging
 import math
+import humanfriendly
+import itertools
 from multiprocessing import Pool
 import numpy as np
 from bigsi.constants import DEFAULT_CONFIG
 from bigsi.graph.metadata import SampleMetadata
-from bigsi.graph.metadata import DELETION_SPECIAL_SAMPLE_NAME
 from bigsi.graph.index import KmerSignatureIndex
+from bigsi.graph.index import MERGE_BATCH_ROWS
+from bigsi.matrix.bitmatrix import INSERT_BATCH_ROWS
+from bigsi.matrix.row_cache import get_row_cache
 from bigsi.decorators import convert_kmers_to_canonical
 from bigsi.bloom import BloomFilter
 from bigsi.utils import convert_query_kmers
 from bigsi.utils import seq_to_kmers
-from bigsi.utils import bitwise_and
-from bigsi.utils import non_zero_bitarray_positions
+from bigsi.utils.kernels import and_rows
+from bigsi.utils.kernels import columns_at_least
+from bigsi.utils.kernels import rows_to_words
+from bigsi.utils.kernels import set_positions
+from bigsi.utils.kmers import is_acgt
+from bigsi.utils.kmers import MAX_KMER_SIZE
+from bigsi.utils.kmers import seq_to_kmer_codes
 from bigsi.storage import get_storage
 from bigsi.scoring import Scorer
 from bigsi.constants import DEFAULT_NPROC
@@ -32,18 +41,6 @@ MIN_UNIQUE_KMERS_IN_QUERY = 0
 B_ONE = (1).to_bytes(1, byteorder="big")
 
 
-def unpack_and_sum(bitarrays):
-    c = 0
-    for bitarry in bitarrays:
-        if c == 0:
-            cumsum = np.fromstring(bitarry.unpack(one=B_ONE), dtype="i1").astype("i4")
-        else:
-            l = np.fromstring(bitarry.unpack(one=B_ONE), dtype="i1").astype("i4")
-            cumsum = np.add(cumsum, l)
-        c += 1
-    return cumsum
-
-
 def unpack_and_cat(bitarrays):
     c = 0
     for bitarray in bitarrays:
@@ -61,18 +58,6 @@ def chunks(l, n):
     return (l[i : i + n] for i in range(0, len(l), n))
 
 
-def unpack_and_sum_bitarrays(bitarrays, j):
-    return unpack_and_sum(bitarrays)
-    # if j <= 1:
-    #     return unpack_and_sum(bitarrays)
-    # else:
-    #     n = math.ceil(float(len(bitarrays)) / j)
-    #     p = Pool(j)
-    #     res = p.map(unpack_and_sum, chunks(bitarrays, n))
-    #     p.close()
-    #     return np.sum(res, axis=0)
-
-
 def unpack_and_cat_bitarrays(bitarrays, j):
     return unpack_and_cat(bitarrays)
     # if j <= 1:
@@ -132,13 +117,32 @@ class BIGSI(SampleMetadata, KmerSignatureIndex):
             config = DEFAULT_CONFIG
         self.config = config
         self.storage = get_storage(config)
+        self.row_cache = self.__row_cache(config)
         SampleMetadata.__init__(self, self.storage)
-        KmerSignatureIndex.__init__(self, self.storage)
+        KmerSignatureIndex.__init__(self, self.storage, self.row_cache)
         self.min_unique_kmers_in_query = (
             MIN_UNIQUE_KMERS_IN_QUERY
         )  ## TODO this can be inferred and set at build time
         self.scorer = Scorer(self.num_samples)
 
+    @staticmethod
+    def __row_cache(config):
+        ## Rows are cached for the life of the process with row_cache_bytes set (e.g. "4GB")
+        max_bytes = config.get("row_cache_bytes")
+        if not max_bytes:
+            return None
+        if isinstance(max_bytes, str):
+            max_bytes = humanfriendly.parse_size(max_bytes)
+        name = json.dumps(
+            [config["storage-engine"], config.get("storage-config")], sort_keys=True
+        )
+        return get_row_cache(name, max_bytes, config.get("row_cache_policy", "slru"))
+
+    def row_cache_stats(self):
+        if self.row_cache is None:
+            return None
+        return self.row_cache.stats()
+
     @property
     def kmer_size(self):
         return self.config["k"]
@@ -148,18 +152,40 @@ class BIGSI(SampleMetadata, KmerSignatureIndex):
         return self.config.get("nproc", DEFAULT_NPROC)
 
     @classmethod
-    def bloom(cls, config, kmers):
-        kmers = convert_query_kmers(kmers)  ## Convert to canonical kmers
-        bloomfilter = BloomFilter(m=config["m"], h=config["h"])
-        bloomfilter.update(kmers)
+    def bloom(cls, config, kmers, bloomfilter=None):
+        ## kmers are strings, an array of canonical kmer codes,
+        ## or an iterable of blocks of canonical kmer codes.
+        ## An existing (cleared) bloomfilter can be passed in to reuse its buffer.
+        if bloomfilter is None:
+            bloomfilter = BloomFilter(
+                m=config["m"],
+                h=config["h"],
+                double_hashing=config.get("double_hashing", False),
+                block_size=config.get("block_size", 0),
+            )
+        if isinstance(kmers, np.ndarray):
+            kmers = [kmers]
+        kmers = iter(kmers)
+        first = next(kmers, None)
+        if isinstance(first, np.ndarray):
+            for codes in itertools.chain([first], kmers):
+                bloomfilter.update_kmer_codes(codes, config["k"])
+        elif first is not None:
+            ## Convert to canonical kmers
+            bloomfilter.update(convert_query_kmers(itertools.chain([first], kmers)))
         return bloomfilter.bitarray
 
     @classmethod
-    def build(cls, config, bloomfilters, samples):
+    def build(cls, config, bloomfilters, samples, kmer_counts=None):
         storage = get_storage(config)
         validate_build_params(bloomfilters, samples)
         logger.debug("Insert sample metadata")
-        sm = SampleMetadata(storage).add_samples(samples)
+        sm = SampleMetadata(storage)
+        sm.add_samples(samples)
+        if kmer_counts:
+            for sample, kmer_count in zip(samples, kmer_counts):
+                if kmer_count is not None:
+                    sm.set_sample_kmer_count(sample, kmer_count)
         logger.debug("Create signature index")
         ksi = KmerSignatureIndex.create(
             storage,
@@ -167,6 +193,11 @@ class BIGSI(SampleMetadata, KmerSignatureIndex):
             config["m"],
             config["h"],
             config.get("low_mem_build", False),
+            config.get("double_hashing", False),
+            config.get("block_size", 0),
+            config.get("transpose_band_size"),
+            config.get("nproc", 1),
+            config.get("sample_block_size", 0),
         )
         storage.close()  ## Need to delete LOCK files before re init
         return cls(config)
@@ -174,8 +205,20 @@ class BIGSI(SampleMetadata, KmerSignatureIndex):
     def search(self, seq, threshold=1.0, score=False):
         self.__validate_search_query(seq)
         assert threshold <= 1
-        kmers = list(self.seq_to_kmers(seq))
-        kmers_to_colours = self.lookup(kmers, remove_trailing_zeros=False)
+        if is_acgt(seq) and self.kmer_size <= MAX_KMER_SIZE:
+            ## Query kmers as integer codes, avoiding a string slice per kmer
+            kmers = seq_to_kmer_codes(seq, self.kmer_size, canonical=False)
+        else:
+            kmers = list(self.seq_to_kmers(seq))
+        if threshold == 1.0 and not score:
+            ## Only the rows needed to rule every colour out are read
+            results = self.exact_search(kmers)
+            return [r.todict() for r in results]
+        kmers_to_colours = self.lookup(
+            kmers, remove_trailing_zeros=False, kmer_size=self.kmer_size
+        )
+        if isinstance(kmers, np.ndarray):
+            kmers = kmers.tolist()
         min_kmers = math.ceil(len(set(kmers)) * threshold)
         if threshold == 1.0:
             results = self.exact_filter(kmers_to_colours)
@@ -183,23 +226,40 @@ class BIGSI(SampleMetadata, KmerSignatureIndex):
             results = self.inexact_filter(kmers_to_colours, min_kmers)
         if score:
             self.score(kmers, kmers_to_colours, results)
-        return [
-            r.todict()
-            for r in results
-            if not r.sample_name == DELETION_SPECIAL_SAMPLE_NAME
-        ]
+        return [r.todict() for r in results]
+
+    def exact_search(self, kmers):
+        ## kmers are strings or an array of kmer codes, as for lookup
+        colours_with_all_kmers = self.exact_lookup(kmers, kmer_size=self.kmer_size)
+        if isinstance(kmers, np.ndarray):
+            num_kmers = len(np.unique(kmers))
+        else:
+            num_kmers = len(set(kmers))
+        return self.__exact_results(
+            colours_with_all_kmers, self.bitmatrix.num_cols, num_kmers
+        )
 
     def exact_filter(self, kmers_to_colours):
-        colours_with_all_kmers = non_zero_bitarray_positions(
-            bitwise_and(kmers_to_colours.values())
+        ## The rows are ANDed as packed words
+        rows = list(kmers_to_colours.values())
+        num_bits = max(len(row) for row in rows)
+        return self.__exact_results(
+            and_rows(rows, num_bits), num_bits, len(kmers_to_colours)
         )
+
+    def __exact_results(self, colours_with_all_kmers, num_bits, num_kmers):
+        ## Deleted colours are masked out, until compaction removes them
+        deleted_colours = self.deleted_colours
+        if deleted_colours.any():
+            colours_with_all_kmers &= rows_to_words([~deleted_colours], num_bits)[0]
+        colours_with_all_kmers = set_positions(colours_with_all_kmers, num_bits).tolist()
         samples = self.get_sample_list(colours_with_all_kmers)
         return [
             BigsiQueryResult(
                 colour=c,
                 sample_name=s,
-                num_kmers=len(kmers_to_colours),
-                num_kmers_found=len(kmers_to_colours),
+                num_kmers=num_kmers,
+                num_kmers_found=num_kmers,
             )
             for c, s in zip(colours_with_all_kmers, samples)
         ]
@@ -209,14 +269,17 @@ class BIGSI(SampleMetadata, KmerSignatureIndex):
         return [colours_to_samples[i] for i in colours]
 
     def inexact_filter(self, kmers_to_colours, min_kmers):
-        num_kmers = unpack_and_sum_bitarrays(
-            list(kmers_to_colours.values()), self.nproc
-        )
-        colours = range(self.num_samples)
-        colours_to_kmers_found = dict(zip(colours, num_kmers))
-        colours_to_kmers_found_above_threshold = self.__colours_above_threshold(
-            colours_to_kmers_found, min_kmers
-        )
+        ## Kmers found are counted per colour with bit sliced counters, dropping the colours
+        ## which can no longer reach min_kmers as the rows are counted. Counts are only
+        ## expanded for the live colours with at least min_kmers.
+        rows = list(kmers_to_colours.values())
+        num_bits = min(self.num_samples, max((len(row) for row in rows), default=0))
+        deleted_colours = self.deleted_colours
+        live_colours = None
+        if deleted_colours.any():
+            live_colours = rows_to_words([~deleted_colours], num_bits)[0]
+        colours, kmers_found = columns_at_least(rows, min_kmers, num_bits, live_colours)
+        colours_to_kmers_found = zip(colours.tolist(), kmers_found.tolist())
         results = [
             BigsiQueryResult(
                 colour=colour,
@@ -224,7 +287,7 @@ class BIGSI(SampleMetadata, KmerSignatureIndex):
                 num_kmers_found=int(num_kmers_found),
                 num_kmers=len(kmers_to_colours),
             )
-            for colour, num_kmers_found in colours_to_kmers_found_above_threshold.items()
+            for colour, num_kmers_found in colours_to_kmers_found
         ]
         results.sort(key=lambda x: x.num_kmers_found, reverse=True)
         return results
@@ -238,26 +301,48 @@ class BIGSI(SampleMetadata, KmerSignatureIndex):
             score_results["kmer-presence"] = col
             res.add_score(score_results)
 
-    def __colours_above_threshold(self, colours_to_percent_kmers, min_kmers):
-        return {k: v for k, v in colours_to_percent_kmers.items() if v >= min_kmers}
+    def insert(self, bloomfilter, sample, kmer_count=None):
+        self.insert_many([bloomfilter], [sample], [kmer_count])
 
-    def insert(self, bloomfilter, sample):
-        logger.warning("Build and merge is preferable to insert in most cases")
-        colour = self.add_sample(sample)
-        self.insert_bloom(bloomfilter, colour - 1)
+    def insert_many(self, bloomfilters, samples, kmer_counts=None):
+        ## Appends a column per sample in a single pass over the rows
+        validate_build_params(bloomfilters, samples)
+        if kmer_counts is None:
+            kmer_counts = [None] * len(samples)
+        colour = self.num_samples
+        self.add_samples(samples)
+        for sample, kmer_count in zip(samples, kmer_counts):
+            if kmer_count is not None:
+                self.set_sample_kmer_count(sample, kmer_count)
+        self.insert_blooms(bloomfilters, colour)
 
     def delete(self):
         self.storage.delete_all()
 
+    def compact(self, batch_rows=INSERT_BATCH_ROWS):
+        ## Removes the columns of deleted samples and renumbers the colours of the rest.
+        ## Returns the number of columns removed.
+        deleted_colours = self.deleted_colours
+        if not deleted_colours.any():
+            return 0
+        self.bitmatrix.delete_columns(deleted_colours, batch_rows)
+        self.compact_metadata()
+        self.scorer = Scorer(self.num_samples)
+        return deleted_colours.count()
+
     def __validate_merge(self, bigsi):
         assert self.bloomfilter_size == bigsi.bloomfilter_size
         assert self.num_hashes == bigsi.num_hashes
+        assert self.double_hashing == bigsi.double_hashing
+        assert self.block_size == bigsi.block_size
         assert self.kmer_size == bigsi.kmer_size
 
-    def merge(self, bigsi):
-        self.__validate_merge(bigsi)
-        self.merge_indexes(bigsi)
-        self.merge_metadata(bigsi)
+    def merge(self, *bigsis, batch_rows=MERGE_BATCH_ROWS):
+        ## Any number of indexes are merged in a single pass over the rows
+        for bigsi in bigsis:
+            self.__validate_merge(bigsi)
+        self.merge_indexes(*bigsis, batch_rows=batch_rows)
+        self.merge_metadata(*bigsis)
 
     def __validate_search_query(self, seq):
         kmers = set()
@@ -1,80 +1,286 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from bitarray import bitarray
 
-from bigsi.bloom import generate_hashes
+from bigsi.bloom import generate_hashes_batch
 from bigsi.bloom import BloomFilter
+from bigsi.bloom import BloomFilterFile
 from bigsi.matrix import transpose
 from bigsi.matrix import BitMatrix
+from bigsi.matrix import PartitionedBitMatrix
+from bigsi.matrix.partitioned import is_partitioned
+from bigsi.matrix.bitmatrix import row_batches
 from bigsi.utils import convert_query_kmer
-from bigsi.utils import bitwise_and
+from bigsi.utils.kernels import and_row_groups
+from bigsi.utils.kernels import and_rows
+from bigsi.utils.kernels import ones_words
+from bigsi.utils.kernels import words_to_bitarray
+from bigsi.utils.kmers import canonical_codes
+from bigsi.utils.kmers import kmer_codes_to_bytes
 
 BLOOMFILTER_SIZE_KEY = "ksi:bloomfilter_size"
 NUM_HASH_FUNCTS_KEY = "ksi:num_hashes"
+DOUBLE_HASHING_KEY = "ksi:double_hashing"
+BLOCK_SIZE_KEY = "ksi:block_size"
+## Written by large_build, -1 once the build has finished
+BUILD_NEXT_ROW_KEY = "build_checkpoint:next_row"
+## Rows read and written per storage batch when merging
+MERGE_BATCH_ROWS = 2 ** 14
+## Rows read per batch by exact lookups, the batches doubling up to the largest
+EXACT_LOOKUP_FIRST_BATCH_ROWS = 8
+EXACT_LOOKUP_MAX_BATCH_ROWS = 2 ** 10
 logger = logging.getLogger(__name__)
 
 
+def _bloomfilter_bits(bloomfilter):
+    ## Files are transposed straight from their memory mapped payload
+    if isinstance(bloomfilter, BloomFilter):
+        return bloomfilter.bitarray
+    if isinstance(bloomfilter, BloomFilterFile):
+        return bloomfilter.bits
+    return bloomfilter
+
+
 class KmerSignatureIndex:
 
     """
     Methods for managing kmer signature indexes
     """
 
-    def __init__(self, storage):
+    def __init__(self, storage, row_cache=None):
         self.storage = storage
-        self.bitmatrix = BitMatrix(storage)
+        try:
+            build_next_row = storage.get_integer(BUILD_NEXT_ROW_KEY)
+        except KeyError:
+            build_next_row = -1
+        if build_next_row >= 0:
+            raise ValueError(
+                "Index is incomplete, its build stopped at row %i. Rerun large_build to resume it."
+                % build_next_row
+            )
+        if is_partitioned(storage):
+            self.bitmatrix = PartitionedBitMatrix(storage, row_cache)
+        else:
+            self.bitmatrix = BitMatrix(storage, row_cache=row_cache)
         self.bloomfilter_size = storage.get_integer(BLOOMFILTER_SIZE_KEY)
         self.num_hashes = storage.get_integer(NUM_HASH_FUNCTS_KEY)
+        try:
+            self.double_hashing = bool(storage.get_integer(DOUBLE_HASHING_KEY))
+        except KeyError:
+            ## Indexes built before double hashing was an option
+            self.double_hashing = False
+        try:
+            self.block_size = storage.get_integer(BLOCK_SIZE_KEY)
+        except KeyError:
+            self.block_size = 0
 
     @classmethod
-    def create(cls, storage, bloomfilters, bloomfilter_size, num_hashes, lowmem=False):
-        bloomfilters = [
-            bf.bitarray if isinstance(bf, BloomFilter) else bf for bf in bloomfilters
-        ]
+    def create(
+        cls,
+        storage,
+        bloomfilters,
+        bloomfilter_size,
+        num_hashes,
+        lowmem=False,
+        double_hashing=False,
+        block_size=0,
+        band_size=None,
+        nproc=1,
+        sample_block_size=0,
+    ):
+        bloomfilters = [_bloomfilter_bits(bf) for bf in bloomfilters]
         storage.set_integer(BLOOMFILTER_SIZE_KEY, bloomfilter_size)
         storage.set_integer(NUM_HASH_FUNCTS_KEY, num_hashes)
+        storage.set_integer(DOUBLE_HASHING_KEY, int(double_hashing))
+        storage.set_integer(BLOCK_SIZE_KEY, block_size)
+        if sample_block_size:
+            ## Columns are split into sample blocks, each transposed and stored on its own
+            PartitionedBitMatrix.create(
+                storage, bloomfilter_size, sample_block_size, rows_per_block=block_size
+            )
+            ksi = cls(storage)
+            ksi.insert_blooms(
+                bloomfilters, 0, lowmem=lowmem, band_size=band_size, nproc=nproc
+            )
+            return ksi
         logger.debug("Transpose bitarrays")
-        rows = transpose(bloomfilters, lowmem=lowmem)
+        ## Rows are transposed band by band and streamed into the matrix as they are finished.
+        ## With nproc > 1 shards of the rows are transposed in parallel, and written in row order.
+        rows = transpose(
+            bloomfilters,
+            lowmem=lowmem,
+            num_rows=bloomfilter_size,
+            band_size=band_size,
+            nproc=nproc,
+        )
         logger.debug("Insert rows")
+        ## Each hash block is stored as one block of rows, so it is a single read
         bitmatrix = BitMatrix.create(
-            storage, rows, num_rows=bloomfilter_size, num_cols=len(bloomfilters)
+            storage,
+            rows,
+            num_rows=bloomfilter_size,
+            num_cols=len(bloomfilters),
+            rows_per_block=block_size,
         )
         return cls(storage)
 
-    def lookup(self, kmers, remove_trailing_zeros=True):
-        if isinstance(kmers, str):
-            kmers = [kmers]
-        kmers=set(kmers)
-        kmer_to_hashes = self.__kmers_to_hashes(kmers)
+    def lookup(self, kmers, remove_trailing_zeros=True, kmer_size=None):
+        ## kmers are strings, or an array of kmer codes (see bigsi.utils.kmers)
+        ## in which case the result is keyed by the integer codes
+        kmer_to_hashes = self.__query_hashes(kmers, kmer_size)
         hashes = {h for sublist in kmer_to_hashes.values() for h in sublist}
+        if isinstance(self.bitmatrix, PartitionedBitMatrix):
+            return self.__lookup_sample_blocks(kmer_to_hashes, hashes)
         rows = self.__batch_get_rows(hashes, remove_trailing_zeros)
         return self.__bitwise_and_kmers(kmer_to_hashes, rows)
 
+    def exact_lookup(self, kmers, kmer_size=None):
+        ## Packed words (see bigsi.utils.kernels) of the colours with every kmer. The rows are
+        ## read and ANDed sparsest first, by the row popcounts where the matrix keeps them, in
+        ## batches doubling from EXACT_LOOKUP_FIRST_BATCH_ROWS rows. Reading stops as soon as no
+        ## colour is left, so queries of absent sequences read only a few rows.
+        kmer_to_hashes = self.__query_hashes(kmers, kmer_size)
+        hashes = sorted({h for sublist in kmer_to_hashes.values() for h in sublist})
+        popcounts = self.bitmatrix.get_popcounts(hashes) if hashes else None
+        if popcounts is not None:
+            hashes = np.array(hashes)[np.argsort(popcounts, kind="mergesort")].tolist()
+        num_cols = self.bitmatrix.num_cols
+        colours = ones_words(num_cols)
+        start = 0
+        batch_rows = EXACT_LOOKUP_FIRST_BATCH_ROWS
+        while start < len(hashes) and colours.any():
+            rows = list(self.bitmatrix.get_rows(hashes[start : start + batch_rows]))
+            colours &= and_rows(rows, num_cols)
+            start += batch_rows
+            batch_rows = min(2 * batch_rows, EXACT_LOOKUP_MAX_BATCH_ROWS)
+        return colours
+
     def insert_bloom(self, bloomfilter, column_index):
-        self.bitmatrix.insert_column(bloomfilter, column_index)
+        self.insert_blooms([bloomfilter], column_index)
+
+    def insert_blooms(self, bloomfilters, column_index, **transpose_kwargs):
+        ## The bloom filters are transposed band by band into the new columns of each row.
+        ## In a partitioned index only the sample blocks the new columns fall in are rewritten.
+        bloomfilters = [_bloomfilter_bits(bf) for bf in bloomfilters]
+        for start, stop in self.__column_ranges(column_index, len(bloomfilters)):
+            rows = transpose(
+                bloomfilters[start - column_index : stop - column_index],
+                num_rows=self.bloomfilter_size,
+                **transpose_kwargs
+            )
+            self.bitmatrix.insert_columns(rows, start, stop - start)
 
-    def merge_indexes(self, ksi):
-        for i in range(self.bloomfilter_size):
-            r1 = self.bitmatrix.get_row(i)
-            r2 = ksi.bitmatrix.get_row(i)
-            r1.extend(r2)
-            self.bitmatrix.set_row(i, r1)
-        self.bitmatrix.set_num_cols(self.bitmatrix.num_cols + ksi.bitmatrix.num_cols)
+    def merge_indexes(self, *ksis, batch_rows=MERGE_BATCH_ROWS):
+        ## Appends the columns of each of ksis in one pass over the rows. Rows are merged in
+        ## batches of whole blocks, so blocked layouts are never partly rewritten. The next
+        ## batch of ksis is read in the background while the current batch is appended to and
+        ## written back.
+        if isinstance(self.bitmatrix, PartitionedBitMatrix):
+            return self.__merge_sample_blocks(ksis, batch_rows)
+        batches = self.__row_batches(batch_rows)
+
+        def read_rows(row_indexes):
+            return [list(ksi.bitmatrix.get_rows(row_indexes)) for ksi in ksis]
+
+        with ThreadPoolExecutor(max_workers=1) as executor, self.bitmatrix.batched_writes():
+            prefetched = executor.submit(read_rows, batches[0]) if batches else None
+            for i, row_indexes in enumerate(batches):
+                other_rows = prefetched.result()
+                if i + 1 < len(batches):
+                    prefetched = executor.submit(read_rows, batches[i + 1])
+                rows = list(self.bitmatrix.get_rows(row_indexes))
+                for ksi_rows in other_rows:
+                    for r1, r2 in zip(rows, ksi_rows):
+                        r1.extend(r2)
+                self.bitmatrix.set_rows(row_indexes, rows)
+        self.bitmatrix.set_num_cols(
+            self.bitmatrix.num_cols + sum(ksi.bitmatrix.num_cols for ksi in ksis)
+        )
+
+    def __query_hashes(self, kmers, kmer_size):
+        if isinstance(kmers, str):
+            kmers = [kmers]
+        if isinstance(kmers, np.ndarray):
+            return self.__kmer_codes_to_hashes(kmers, kmer_size)
+        return self.__kmers_to_hashes(kmers)
 
     def __kmers_to_hashes(self, kmers):
-        d = {}
-        for k in set(kmers):
-            d[k] = set(
-                generate_hashes(
-                    convert_query_kmer(k), self.num_hashes, self.bloomfilter_size
+        kmers = list(set(kmers))
+        ## use canonical kmer to generate lookup, but report query kmer
+        hashes = generate_hashes_batch(
+            [convert_query_kmer(k) for k in kmers],
+            self.num_hashes,
+            self.bloomfilter_size,
+            self.double_hashing,
+            self.block_size,
+        )
+        return {k: set(h) for k, h in zip(kmers, hashes.tolist())}
+
+    def __kmer_codes_to_hashes(self, codes, kmer_size):
+        if kmer_size is None:
+            raise ValueError("kmer_size is required to look up kmer codes")
+        codes = np.unique(codes)
+        hashes = generate_hashes_batch(
+            kmer_codes_to_bytes(canonical_codes(codes, kmer_size), kmer_size),
+            self.num_hashes,
+            self.bloomfilter_size,
+            self.double_hashing,
+            self.block_size,
+        )
+        return {k: set(h) for k, h in zip(codes.tolist(), hashes.tolist())}
+
+    def __row_batches(self, batch_rows):
+        return row_batches(self.bloomfilter_size, self.block_size, batch_rows)
+
+    def __column_ranges(self, column_index, num_cols):
+        if isinstance(self.bitmatrix, PartitionedBitMatrix):
+            return self.bitmatrix.column_ranges(column_index, num_cols)
+        return [(column_index, column_index + num_cols)]
+
+    def __merge_sample_blocks(self, ksis, batch_rows):
+        ## The columns of ksis are appended as new columns, so only the newest sample block and
+        ## the ones added are written
+        for ksi in ksis:
+            column_index = self.bitmatrix.num_cols
+            for start, stop in self.__column_ranges(column_index, ksi.bitmatrix.num_cols):
+                rows = (
+                    row[start - column_index : stop - column_index]
+                    for row_indexes in self.__row_batches(batch_rows)
+                    for row in ksi.bitmatrix.get_rows(row_indexes)
                 )
-            )  ## use canonical kmer to generate lookup, but report query kmer
+                self.bitmatrix.insert_columns(rows, start, stop - start)
+
+    def __lookup_sample_blocks(self, kmer_to_hashes, hashes):
+        ## Each sample block is looked up on its own in parallel, and the results joined
+        hashes = list(hashes)
+
+        def lookup_sample_block(sample_block):
+            rows = dict(zip(hashes, sample_block.get_rows(hashes)))
+            return self.__bitwise_and_kmers(kmer_to_hashes, rows)
+
+        results = self.bitmatrix.map_sample_blocks(lookup_sample_block)
+        d = {}
+        for k in kmer_to_hashes:
+            d[k] = bitarray()
+            for result in results:
+                d[k].extend(result[k])
         return d
 
     def __batch_get_rows(self, row_indexes, remove_trailing_zeros=False):
         return dict(zip(row_indexes, self.bitmatrix.get_rows(row_indexes, remove_trailing_zeros=remove_trailing_zeros)))
 
     def __bitwise_and_kmers(self, kmer_to_hashes, rows):
-        d = {}
-        for k, hashes in kmer_to_hashes.items():
-            subset_rows = [rows[h] for h in hashes]
-            d[k] = bitwise_and(subset_rows)
-        return d
+        ## The rows of each kmer are ANDed as packed words, read from the rows in place (see
+        ## bigsi.utils.kernels)
+        if not kmer_to_hashes:
+            return {}
+        hashes = list(rows)
+        row_positions = {h: i for i, h in enumerate(hashes)}
+        rows = [rows[h] for h in hashes]
+        num_bits = max(len(row) for row in rows)
+        kmers = list(kmer_to_hashes)
+        anded = and_row_groups(
+            rows, [[row_positions[h] for h in kmer_to_hashes[k]] for k in kmers], num_bits
+        )
+        return {k: words_to_bitarray(row, num_bits) for k, row in zip(kmers, anded)}
@@ -1,4 +1,7 @@
+from bitarray import bitarray
+
 DELETION_SPECIAL_SAMPLE_NAME = "D3L3T3D"
+DELETED_COLOURS_KEY = "deleted_colours"
 
 
 class SampleMetadata:
@@ -27,16 +30,92 @@ class SampleMetadata:
         return self._increment_colour_count()
 
     def add_samples(self, sample_names):
+        ## All names are checked before any sample is added
+        if len(set(sample_names)) != len(sample_names):
+            raise ValueError("You can't insert two samples with the same name")
+        for sample_name in sample_names:
+            self._validate_sample_name(sample_name)
         for sample_name in sample_names:
             self.add_sample(sample_name)
 
     def delete_sample(self, sample_name):
-        ## Deleting samples just changes it's name to a reserved deleted string
+        ## Deleting samples just changes it's name to a reserved deleted string, and marks the
+        ## colour in the deletion bitmask. The column is removed by compaction.
         colour = self.sample_to_colour(sample_name)
+        if colour is None:
+            raise ValueError("There is no sample called %s" % sample_name)
         self._set_colour_sample(colour, DELETION_SPECIAL_SAMPLE_NAME)
         self._set_sample_colour(sample_name, -1)
+        deleted_colours = self.deleted_colours
+        deleted_colours[colour] = True
+        self._set_deleted_colours(deleted_colours)
         ## We don't decrement the count, as the number of colours is the same
 
+    @property
+    def deleted_colours(self):
+        ## Bitmask of deleted colours, num_samples long. It is read from storage every time, as
+        ## other writers may delete samples or compact the index.
+        try:
+            stored = self.storage.get_bitarray(self._add_key_prefix(DELETED_COLOURS_KEY))
+        except KeyError:
+            ## Indexes whose samples were deleted before the bitmask existed only renamed
+            ## them, so the bitmask is built from the names once and stored
+            stored = self.__deleted_colours_from_names()
+            self._set_deleted_colours(stored)
+        num_samples = self.num_samples
+        deleted_colours = stored[:num_samples]
+        deleted_colours.extend([False] * (num_samples - len(deleted_colours)))
+        return deleted_colours
+
+    def __deleted_colours_from_names(self):
+        samples = self.storage.get_strings(
+            [self._add_key_prefix(c) for c in range(self.num_samples)]
+        )
+        return bitarray([sample == DELETION_SPECIAL_SAMPLE_NAME for sample in samples])
+
+    def _set_deleted_colours(self, deleted_colours):
+        self.storage.set_bitarray(
+            self._add_key_prefix(DELETED_COLOURS_KEY), deleted_colours
+        )
+
+    def compact_metadata(self):
+        ## Renumbers the colours of the samples which aren't deleted from 0, keeping their
+        ## order. Returns the old colours of the samples kept.
+        deleted_colours = self.deleted_colours
+        kept = [c for c, deleted in enumerate(deleted_colours) if not deleted]
+        samples = self.storage.get_strings([self._add_key_prefix(c) for c in kept])
+        self.storage.set_integers(
+            [self._add_key_prefix(sample) for sample in samples], range(len(kept))
+        )
+        self.storage.set_strings(
+            [self._add_key_prefix(c) for c in range(len(kept))], samples
+        )
+        self._set_integer(self.colour_count_key, len(kept))
+        self._set_deleted_colours(bitarray())
+        return kept
+
+    def set_sample_kmer_count(self, sample_name, kmer_count):
+        ## Estimated number of distinct kmers in the sample, from its HyperLogLog
+        self.storage.set_integer(self._kmer_count_key(sample_name), int(kmer_count))
+
+    def sample_kmer_count(self, sample_name):
+        try:
+            return self.storage.get_integer(self._kmer_count_key(sample_name))
+        except KeyError:
+            return None
+
+    def kmer_counts(self):
+        ## Kmer counts of all samples which have one, ignoring deleted samples
+        counts = {}
+        for colour in range(self.num_samples):
+            sample_name = self.colour_to_sample(colour)
+            if sample_name == DELETION_SPECIAL_SAMPLE_NAME:
+                continue
+            kmer_count = self.sample_kmer_count(sample_name)
+            if kmer_count is not None:
+                counts[sample_name] = kmer_count
+        return counts
+
     def sample_name_exists(self, sample_name):
         try:
             self._get_integer(sample_name)
@@ -71,13 +150,59 @@ class SampleMetadata:
             c: self.colour_to_sample(c) for c in colours if self.colour_to_sample(c)
         }
 
-    def merge_metadata(self, sm):
-        for c in range(sm.num_samples):
-            sample = sm.colour_to_sample(c)
-            try:
-                self.add_sample(sample)
-            except ValueError:
-                self.add_sample(sample + "_duplicate_in_merge")
+    def merge_metadata(self, *sms):
+        ## Appends the samples of each of sms in order, renaming duplicates. Names are checked
+        ## before anything is written, and all samples are written in a few batches.
+        colour = self.num_samples
+        deleted_colours = self.deleted_colours
+        taken = set()
+        samples = []
+        kmer_counts = []
+        for sm in sms:
+            for sample in sm.storage.get_strings(
+                [sm._add_key_prefix(c) for c in range(sm.num_samples)]
+            ):
+                ## Deleted samples stay deleted
+                deleted_colours.append(sample == DELETION_SPECIAL_SAMPLE_NAME)
+                if sample == DELETION_SPECIAL_SAMPLE_NAME:
+                    samples.append(sample)
+                    kmer_counts.append(None)
+                    continue
+                kmer_count = sm.sample_kmer_count(sample)
+                if sample in taken or not self.__is_valid_new_sample(sample):
+                    sample = sample + "_duplicate_in_merge"
+                    if sample in taken or not self.__is_valid_new_sample(sample):
+                        raise ValueError(
+                            "You can't insert two samples with the same name"
+                        )
+                taken.add(sample)
+                samples.append(sample)
+                kmer_counts.append(kmer_count)
+        colours = range(colour, colour + len(samples))
+        live = [
+            (sample, c)
+            for sample, c in zip(samples, colours)
+            if sample != DELETION_SPECIAL_SAMPLE_NAME
+        ]
+        self.storage.set_integers(
+            [self._add_key_prefix(sample) for sample, _ in live], [c for _, c in live]
+        )
+        self.storage.set_strings([self._add_key_prefix(c) for c in colours], samples)
+        counted = [(s, n) for s, n in zip(samples, kmer_counts) if n is not None]
+        self.storage.set_integers(
+            [self._kmer_count_key(s) for s, _ in counted],
+            [int(n) for _, n in counted],
+        )
+        self._set_integer(self.colour_count_key, colour + len(samples))
+        if deleted_colours.any():
+            self._set_deleted_colours(deleted_colours)
+
+    def __is_valid_new_sample(self, sample_name):
+        try:
+            self._validate_sample_name(sample_name)
+        except ValueError:
+            return False
+        return True
 
     def _set_integer(self, key, value):
         _key = self._add_key_prefix(key)
@@ -108,6 +233,10 @@ class SampleMetadata:
     def _increment_colour_count(self):
         return self._incr(self.colour_count_key)
 
+    def _kmer_count_key(self, sample_name):
+        ## Kept outside the metadata keys of sample names, so no sample name can collide with it
+        return "kmer_count:%s" % sample_name
+
     def _add_key_prefix(self, key):
         return ":".join(["metadata", str(key)])
 
@@ -1,2 +1,3 @@
 from bigsi.matrix.transpose import transpose
 from bigsi.matrix.bitmatrix import BitMatrix
+from bigsi.matrix.partitioned import PartitionedBitMatrix
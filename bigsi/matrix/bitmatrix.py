@@ -1,60 +1,299 @@
+import math
+import uuid
+from contextlib import contextmanager
+from itertools import islice
 from bitarray import bitarray
 
+from bigsi.matrix.popcounts import PopcountWriter
+from bigsi.matrix.popcounts import delete_popcounts
+from bigsi.matrix.popcounts import has_popcounts
+from bigsi.matrix.popcounts import load_popcounts
+from bigsi.matrix.popcounts import set_popcounts
+
 NUM_ROWS_KEY = "number_of_rows"
 NUM_COLS_KEY = "number_of_cols"
+ROWS_PER_BLOCK_KEY = "rows_per_block"
+## Changes after every write of rows, so cached rows of another version are never used
+ROWS_VERSION_KEY = "rows_version"
+## Rows read and written per storage batch when inserting or deleting columns
+INSERT_BATCH_ROWS = 2 ** 14
+## Bytes of blocks encoded before each storage write when storing blocks
+STORE_BATCH_BYTES = 2 ** 24
+
+
+def _row_bytes(num_cols):
+    return int(math.ceil(num_cols / 8))
+
+
+def encode_block(rows, rows_per_block, num_cols):
+    ## A block is rows_per_block rows of the same number of bytes, missing rows are zero
+    stride = _row_bytes(num_cols)
+    data = [row.tobytes().ljust(stride, b"\x00") for row in rows]
+    data.append(bytes(stride * (rows_per_block - len(data))))
+    return b"".join(data)
+
+
+def decode_block(value, rows_per_block):
+    stride = len(value) // rows_per_block
+    rows = []
+    for i in range(rows_per_block):
+        ba = bitarray()
+        ba.frombytes(value[i * stride : (i + 1) * stride])
+        rows.append(ba)
+    return rows
+
+
+def store_blocks(storage, first_block, rows, rows_per_block, num_cols, key_prefix=""):
+    ## Writes rows starting at the first row of first_block, in blocks of rows_per_block rows.
+    ## Blocks are written STORE_BATCH_BYTES at a time, so rows can be streamed in.
+    rows = iter(rows)
+    batch_blocks = max(1, STORE_BATCH_BYTES // (rows_per_block * _row_bytes(num_cols) or 1))
+    block = first_block
+    while True:
+        keys = []
+        values = []
+        for block_rows in iter(lambda: list(islice(rows, rows_per_block)), []):
+            keys.append(_block_key(storage, block, key_prefix))
+            values.append(encode_block(block_rows, rows_per_block, num_cols))
+            block += 1
+            if len(keys) == batch_blocks:
+                break
+        if not keys:
+            break
+        storage.batch_set(keys, values)
+
+
+def row_batches(num_rows, rows_per_block, batch_rows):
+    ## Ranges of about batch_rows rows, made of whole blocks so blocks are never partly rewritten
+    chunk_size = max(rows_per_block, 1)
+    chunk_size *= max(1, int(math.ceil(batch_rows / chunk_size)))
+    return [
+        range(start, min(start + chunk_size, num_rows))
+        for start in range(0, num_rows, chunk_size)
+    ]
+
+
+def kept_column_ranges(deleted_columns):
+    ## The runs of columns not set in the deleted_columns bitarray, as (start, stop) pairs
+    ranges = []
+    start = None
+    for i, deleted in enumerate(deleted_columns.tolist() + [True]):
+        if not deleted and start is None:
+            start = i
+        elif deleted and start is not None:
+            ranges.append((start, i))
+            start = None
+    return ranges
+
+
+def delete_row_columns(row, kept_ranges):
+    compacted = bitarray()
+    for start, stop in kept_ranges:
+        compacted.extend(row[start:stop])
+    return compacted
+
+
+def _block_key(storage, block, key_prefix=""):
+    return storage.convert_key_to_bytes("%s%i:block" % (key_prefix, block))
+
+
+def _row_keys(row_indexes, key_prefix):
+    if not key_prefix:
+        return row_indexes
+    return ["%s%i" % (key_prefix, i) for i in row_indexes]
 
 
 class BitMatrix(object):
 
     """
-    Manages the gets and sets of the bitmatrix to the various storage backends. 
+    Manages the gets and sets of the bitmatrix to the various storage backends.
     Does not know the concept of a kmer.
+
+    Rows are stored one per key, or with rows_per_block > 0 in blocks of consecutive rows
+    under one key, so rows of the same block are fetched with a single read. All keys start with
+    key_prefix, so several matrices can share a storage.
+
+    Rows read can be kept in a RowCache. Cached rows are keyed by the version of the rows, which
+    is read from storage on every lookup and changed once a write (e.g. a whole insert_columns)
+    has finished. Rows written are dropped from the cache of the writing process straight away,
+    other processes see them once the write has finished.
+
+    The popcount of every row is kept up to date as rows are written (see
+    bigsi.matrix.popcounts), except in matrices stored before popcounts were kept.
     """
 
-    def __init__(self, storage):
+    def __init__(self, storage, key_prefix="", row_cache=None):
         self.storage = storage
-        self.num_rows = self.storage.get_integer(NUM_ROWS_KEY)
-        self.num_cols = self.storage.get_integer(NUM_COLS_KEY)
+        self.key_prefix = key_prefix
+        self.row_cache = row_cache
+        self.rows_version = self.__read_rows_version()
+        self._batched_writes = 0
+        self._rows_written = False
+        self.num_rows = self.storage.get_integer(key_prefix + NUM_ROWS_KEY)
+        self.num_cols = self.storage.get_integer(key_prefix + NUM_COLS_KEY)
+        try:
+            self.rows_per_block = self.storage.get_integer(key_prefix + ROWS_PER_BLOCK_KEY)
+        except KeyError:
+            ## Matrices stored before blocked layouts existed
+            self.rows_per_block = 0
+        self.has_popcounts = has_popcounts(storage, key_prefix)
 
     @classmethod
-    def create(cls, storage, rows, num_rows, num_cols):
-        storage.set_bitarrays(range(num_rows), rows)
-        storage.set_integer(NUM_ROWS_KEY, num_rows)
-        storage.set_integer(NUM_COLS_KEY, num_cols)
+    def create(cls, storage, rows, num_rows, num_cols, rows_per_block=0, key_prefix="", row_cache=None):
+        popcounts = PopcountWriter(storage, num_rows, key_prefix)
+        rows = popcounts.count(rows)
+        if rows_per_block:
+            store_blocks(storage, 0, rows, rows_per_block, num_cols, key_prefix)
+        else:
+            storage.set_bitarrays(_row_keys(range(num_rows), key_prefix), rows)
+        storage.set_integer(key_prefix + NUM_ROWS_KEY, num_rows)
+        storage.set_integer(key_prefix + NUM_COLS_KEY, num_cols)
+        storage.set_integer(key_prefix + ROWS_PER_BLOCK_KEY, rows_per_block)
+        popcounts.close()
+        storage.set_string(key_prefix + ROWS_VERSION_KEY, uuid.uuid4().hex)
         storage.sync()
-        return cls(storage)
+        return cls(storage, key_prefix, row_cache)
+
+    @property
+    def num_blocks(self):
+        return int(math.ceil(self.num_rows / self.rows_per_block))
 
     def get_row(self, row_index):
-        return self.storage.get_bitarray(row_index)[: self.num_cols]
+        return next(iter(self.get_rows([row_index])))
 
     def get_rows(self, row_indexes, remove_trailing_zeros=True):
         ## Only need to slice for merging (it's a lot slower)
-        # Takes advantage of batching in storage engine if available
-        bitarrays=self.storage.get_bitarrays(row_indexes)
+        if self.row_cache is not None:
+            bitarrays = self.__get_cached_rows(row_indexes)
+            if not remove_trailing_zeros:
+                ## Callers may change the rows, so the cache's own are not handed out
+                return (bitarray(ba) for ba in bitarrays)
+        else:
+            bitarrays = self.__fetch_rows(row_indexes)
         if remove_trailing_zeros:
             return (ba[: self.num_cols] for ba in bitarrays)
         else:
             return bitarrays
 
+    def get_popcounts(self, row_indexes):
+        ## The number of set bits of each row, None if the matrix has no popcount index
+        if not self.has_popcounts:
+            return None
+        return load_popcounts(
+            self.storage, row_indexes, self.key_prefix, self.__read_rows_version()
+        )
+
+    def __fetch_rows(self, row_indexes):
+        # Takes advantage of batching in storage engine if available
+        if self.rows_per_block:
+            return self.__get_block_rows(row_indexes)
+        return self.storage.get_bitarrays(_row_keys(row_indexes, self.key_prefix))
+
+    def __read_rows_version(self):
+        try:
+            return self.storage.get_string(self.key_prefix + ROWS_VERSION_KEY)
+        except KeyError:
+            return ""
+
+    def __row_cache_keys(self, row_indexes):
+        return [(self.key_prefix, self.rows_version, i) for i in row_indexes]
+
+    def __get_cached_rows(self, row_indexes):
+        row_indexes = list(row_indexes)
+        ## Another matrix or process may have written rows since the last lookup
+        self.rows_version = self.__read_rows_version()
+        keys = self.__row_cache_keys(row_indexes)
+        rows = self.row_cache.get_many(keys)
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            fetched = list(self.__fetch_rows([row_indexes[i] for i in missing]))
+            for i, row in zip(missing, fetched):
+                rows[i] = row
+            self.row_cache.put_many([keys[i] for i in missing], fetched)
+        return rows
+
+    def __rows_changed(self):
+        ## Called once a write has finished. Caches hold the rows of the old version until they
+        ## are evicted, but never use them again.
+        self._rows_written = False
+        self.rows_version = uuid.uuid4().hex
+        self.storage.set_string(self.key_prefix + ROWS_VERSION_KEY, self.rows_version)
+
+    @contextmanager
+    def batched_writes(self):
+        ## Rows set within are written as one change of version, when the outermost block exits
+        self._batched_writes += 1
+        try:
+            yield self
+        finally:
+            self._batched_writes -= 1
+            if not self._batched_writes and self._rows_written:
+                self.__rows_changed()
+
     def set_row(self, row_index, bitarray):
-        return self.storage.set_bitarray(row_index, bitarray)
+        return self.set_rows([row_index], [bitarray])
 
     def set_rows(self, row_indexes, bitarrays):
         # Takes advantage of batching in storage engine if available
-        return self.storage.set_bitarrays(row_indexes, bitarrays)
+        ## The row indexes are used again to drop the rows from the cache
+        row_indexes = list(row_indexes)
+        if self.has_popcounts:
+            bitarrays = list(bitarrays)
+            set_popcounts(
+                self.storage, row_indexes, [ba.count() for ba in bitarrays], self.key_prefix
+            )
+        if self.rows_per_block:
+            self.__set_block_rows(row_indexes, bitarrays)
+        else:
+            self.storage.set_bitarrays(_row_keys(row_indexes, self.key_prefix), bitarrays)
+        if self.row_cache is not None:
+            self.row_cache.discard_many(self.__row_cache_keys(row_indexes))
+        self._rows_written = True
+        if not self._batched_writes:
+            self.__rows_changed()
 
     def set_num_cols(self, num_cols):
         self.num_cols = num_cols
-        self.storage.set_integer(NUM_COLS_KEY, self.num_cols)
+        self.storage.set_integer(self.key_prefix + NUM_COLS_KEY, self.num_cols)
+
+    def delete(self):
+        ## Deletes every key of the matrix from storage
+        if self.rows_per_block:
+            self.storage.batch_delete(
+                [
+                    _block_key(self.storage, block, self.key_prefix)
+                    for block in range(self.num_blocks)
+                ]
+            )
+        else:
+            self.storage.batch_delete(
+                self.storage.convert_bitarray_batch_keys(
+                    _row_keys(range(self.num_rows), self.key_prefix)
+                )
+            )
+        delete_popcounts(self.storage, self.num_rows, self.key_prefix)
+        self.storage.batch_delete(
+            self.storage.convert_integer_batch_keys(
+                [self.key_prefix + key for key in (NUM_ROWS_KEY, NUM_COLS_KEY, ROWS_PER_BLOCK_KEY)]
+            )
+        )
+        self.storage.batch_delete(
+            self.storage.convert_string_batch_keys([self.key_prefix + ROWS_VERSION_KEY])
+        )
 
     def get_column(self, column_index):
         ## This is very slow, as we index row-wise. Need to know the number of rows, so must be done elsewhere
+        if self.rows_per_block:
+            return bitarray(
+                [row[column_index] for row in self.__iter_all_rows(self.num_cols)]
+            )
         return bitarray(
             "".join(
                 [
                     str(int(i))
                     for i in self.storage.get_bits(
-                        list(range(self.num_rows)), [column_index] * self.num_rows
+                        _row_keys(list(range(self.num_rows)), self.key_prefix),
+                        [column_index] * self.num_rows,
                     )
                 ]
             )
@@ -64,12 +303,84 @@ class BitMatrix(object):
         for column_index in column_indexes:
             yield self.get_column(column_index)
 
-    def insert_column(self, bitarray, column_index):
-        ## This is very slow, as we index row-wise
-        self.storage.set_bits(
-            list(range(len(bitarray))),
-            [column_index] * len(bitarray),
-            bitarray.tolist(),
+    def insert_column(self, column, column_index):
+        self.insert_columns((bitarray([bit]) for bit in column), column_index, 1)
+
+    def insert_columns(self, rows, column_index, num_cols, batch_rows=INSERT_BATCH_ROWS):
+        ## rows holds the num_cols new bits of every row, in row order. The matrix is read and
+        ## written in one pass of batches of whole blocks, whatever the number of new columns.
+        rows = iter(rows)
+        end = column_index + num_cols
+        with self.batched_writes():
+            for row_indexes in row_batches(self.num_rows, self.rows_per_block, batch_rows):
+                updated = []
+                for row, new_bits in zip(
+                    self.get_rows(row_indexes), islice(rows, len(row_indexes))
+                ):
+                    if len(row) < end:
+                        row.extend([False] * (end - len(row)))
+                    row[column_index:end] = new_bits
+                    updated.append(row)
+                self.set_rows(row_indexes, updated)
+        if end > self.num_cols:
+            self.set_num_cols(end)
+
+    def delete_columns(self, deleted_columns, batch_rows=INSERT_BATCH_ROWS):
+        ## Removes the columns set in the deleted_columns bitarray in one pass of batches
+        kept_ranges = kept_column_ranges(deleted_columns[: self.num_cols])
+        with self.batched_writes():
+            for row_indexes in row_batches(self.num_rows, self.rows_per_block, batch_rows):
+                self.set_rows(
+                    row_indexes,
+                    [delete_row_columns(row, kept_ranges) for row in self.get_rows(row_indexes)],
+                )
+        self.set_num_cols(sum(stop - start for start, stop in kept_ranges))
+
+    def __get_blocks(self, blocks):
+        keys = [_block_key(self.storage, block, self.key_prefix) for block in blocks]
+        return dict(zip(blocks, self.storage.batch_get(keys)))
+
+    def __get_block_rows(self, row_indexes):
+        row_indexes = list(row_indexes)
+        values = self.__get_blocks(
+            sorted({row_index // self.rows_per_block for row_index in row_indexes})
         )
-        if column_index >= self.num_cols:
-            self.set_num_cols(self.num_cols + 1)
+        for row_index in row_indexes:
+            block, i = divmod(row_index, self.rows_per_block)
+            value = values[block]
+            stride = len(value) // self.rows_per_block
+            ba = bitarray()
+            ba.frombytes(value[i * stride : (i + 1) * stride])
+            yield ba
+
+    def __set_block_rows(self, row_indexes, bitarrays):
+        updates = {}
+        for row_index, ba in zip(row_indexes, bitarrays):
+            block, i = divmod(row_index, self.rows_per_block)
+            updates.setdefault(block, {})[i] = ba
+        ## Blocks which are only partly replaced are read and updated
+        partial = [
+            block
+            for block, rows in updates.items()
+            if len(rows) < min(self.rows_per_block, self.num_rows - block * self.rows_per_block)
+        ]
+        existing = self.__get_blocks(partial) if partial else {}
+        keys = []
+        values = []
+        for block, rows in updates.items():
+            if block in existing:
+                block_rows = decode_block(existing[block], self.rows_per_block)
+            else:
+                block_rows = [bitarray() for _ in range(self.rows_per_block)]
+            for i, ba in rows.items():
+                block_rows[i] = ba
+            num_cols = max(len(ba) for ba in block_rows)
+            keys.append(_block_key(self.storage, block, self.key_prefix))
+            values.append(encode_block(block_rows, self.rows_per_block, num_cols))
+        self.storage.batch_set(keys, values)
+
+    def __iter_all_rows(self, num_cols):
+        for block in range(self.num_blocks):
+            rows = decode_block(self.__get_blocks([block])[block], self.rows_per_block)
+            for row in rows[: self.num_rows - block * self.rows_per_block]:
+                yield row[:num_cols]
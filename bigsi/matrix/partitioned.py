@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from contextlib import contextmanager
+import numpy as np
+from bitarray import bitarray
+
+from bigsi.matrix.bitmatrix import BitMatrix
+from bigsi.matrix.bitmatrix import INSERT_BATCH_ROWS
+from bigsi.matrix.bitmatrix import delete_row_columns
+from bigsi.matrix.bitmatrix import kept_column_ranges
+from bigsi.matrix.bitmatrix import row_batches
+
+SAMPLE_BLOCK_SIZE_KEY = "sample_block_size"
+NUM_SAMPLE_BLOCKS_KEY = "number_of_sample_blocks"
+NUM_ROWS_KEY = "sample_blocks:number_of_rows"
+ROWS_PER_BLOCK_KEY = "sample_blocks:rows_per_block"
+## Sample blocks read at once by concurrent reads
+MAX_SAMPLE_BLOCK_THREADS = 8
+
+
+def _sample_block_prefix(block):
+    return "sample_block%i:" % block
+
+
+def is_partitioned(storage):
+    try:
+        storage.get_integer(SAMPLE_BLOCK_SIZE_KEY)
+    except KeyError:
+        return False
+    return True
+
+
+class PartitionedBitMatrix(object):
+
+    """
+    A bit matrix whose columns are split into sample blocks of sample_block_size columns. Each
+    sample block is a BitMatrix under its own keys, listed in a directory of sample blocks, so new
+    columns only ever rewrite the rows of the newest sample block.
+    """
+
+    def __init__(self, storage, row_cache=None):
+        self.storage = storage
+        ## Sample blocks share the cache, their rows are keyed by their key prefix
+        self.row_cache = row_cache
+        self.sample_block_size = storage.get_integer(SAMPLE_BLOCK_SIZE_KEY)
+        self.num_rows = storage.get_integer(NUM_ROWS_KEY)
+        self.rows_per_block = storage.get_integer(ROWS_PER_BLOCK_KEY)
+        self.sample_blocks = [
+            BitMatrix(storage, _sample_block_prefix(block), row_cache)
+            for block in range(storage.get_integer(NUM_SAMPLE_BLOCKS_KEY))
+        ]
+
+    @classmethod
+    def create(cls, storage, num_rows, sample_block_size, rows_per_block=0, row_cache=None):
+        ## An empty matrix, columns are added with insert_columns
+        storage.set_integer(SAMPLE_BLOCK_SIZE_KEY, sample_block_size)
+        storage.set_integer(NUM_ROWS_KEY, num_rows)
+        storage.set_integer(ROWS_PER_BLOCK_KEY, rows_per_block)
+        storage.set_integer(NUM_SAMPLE_BLOCKS_KEY, 0)
+        storage.sync()
+        return cls(storage, row_cache)
+
+    @property
+    def num_cols(self):
+        return sum(sample_block.num_cols for sample_block in self.sample_blocks)
+
+    def column_ranges(self, column_index, num_cols):
+        ## Splits columns [column_index, column_index + num_cols) at sample block boundaries
+        ranges = []
+        start = column_index
+        end = column_index + num_cols
+        while start < end:
+            stop = min(end, (start // self.sample_block_size + 1) * self.sample_block_size)
+            ranges.append((start, stop))
+            start = stop
+        return ranges
+
+    def get_popcounts(self, row_indexes):
+        ## The number of set bits of each row over all sample blocks, None if any sample block
+        ## has no popcount index
+        row_indexes = list(row_indexes)
+        popcounts = np.zeros(len(row_indexes), dtype=np.int64)
+        for sample_block in self.sample_blocks:
+            sample_block_popcounts = sample_block.get_popcounts(row_indexes)
+            if sample_block_popcounts is None:
+                return None
+            popcounts += sample_block_popcounts
+        return popcounts
+
+    def map_sample_blocks(self, fn, sample_blocks=None):
+        ## Applies fn to every sample block (or those given), in up to MAX_SAMPLE_BLOCK_THREADS
+        ## threads if the storage allows concurrent reads, returning the results in block order
+        if sample_blocks is None:
+            sample_blocks = self.sample_blocks
+        if len(sample_blocks) < 2 or not self.storage.thread_safe_reads:
+            return [fn(sample_block) for sample_block in sample_blocks]
+        with ThreadPoolExecutor(
+            max_workers=min(len(sample_blocks), MAX_SAMPLE_BLOCK_THREADS)
+        ) as executor:
+            return list(executor.map(fn, sample_blocks))
+
+    def get_row(self, row_index):
+        return next(iter(self.get_rows([row_index])))
+
+    def get_rows(self, row_indexes, remove_trailing_zeros=True):
+        return self.__get_rows(row_indexes, self.sample_blocks)
+
+    def __get_rows(self, row_indexes, sample_blocks):
+        ## Rows of every sample block are trimmed to its width, so they can be joined
+        row_indexes = list(row_indexes)
+        block_rows = self.map_sample_blocks(
+            lambda sample_block: list(sample_block.get_rows(row_indexes)), sample_blocks
+        )
+        rows = [bitarray() for _ in row_indexes]
+        for sample_block_rows in block_rows:
+            for row, block_row in zip(rows, sample_block_rows):
+                row.extend(block_row)
+        return rows
+
+    def set_rows(self, row_indexes, bitarrays):
+        row_indexes = list(row_indexes)
+        bitarrays = list(bitarrays)
+        start = 0
+        for sample_block in self.sample_blocks:
+            stop = start + sample_block.num_cols
+            sample_block.set_rows(row_indexes, [ba[start:stop] for ba in bitarrays])
+            start = stop
+
+    def set_row(self, row_index, bitarray):
+        return self.set_rows([row_index], [bitarray])
+
+    @contextmanager
+    def batched_writes(self):
+        with ExitStack() as stack:
+            for sample_block in self.sample_blocks:
+                stack.enter_context(sample_block.batched_writes())
+            yield self
+
+    def get_column(self, column_index):
+        block, i = divmod(column_index, self.sample_block_size)
+        return self.sample_blocks[block].get_column(i)
+
+    def get_columns(self, column_indexes):
+        for column_index in column_indexes:
+            yield self.get_column(column_index)
+
+    def insert_column(self, column, column_index):
+        self.insert_columns((bitarray([bit]) for bit in column), column_index, 1)
+
+    def insert_columns(self, rows, column_index, num_cols):
+        ## The columns must all fall in one sample block (see column_ranges). Columns after the
+        ## last sample block start a new one.
+        block, i = divmod(column_index, self.sample_block_size)
+        if i + num_cols > self.sample_block_size:
+            raise ValueError("Columns must not span more than one sample block")
+        if block < len(self.sample_blocks):
+            self.sample_blocks[block].insert_columns(rows, i, num_cols)
+        elif block == len(self.sample_blocks) and i == 0:
+            self.sample_blocks.append(
+                BitMatrix.create(
+                    self.storage,
+                    rows,
+                    self.num_rows,
+                    num_cols,
+                    self.rows_per_block,
+                    key_prefix=_sample_block_prefix(block),
+                    row_cache=self.row_cache,
+                )
+            )
+            self.storage.set_integer(NUM_SAMPLE_BLOCKS_KEY, len(self.sample_blocks))
+        else:
+            raise ValueError("Columns must be appended after the last sample block")
+
+    def delete_columns(self, deleted_columns, batch_rows=INSERT_BATCH_ROWS):
+        ## Removes the columns set in the deleted_columns bitarray in one pass of batches. The
+        ## remaining columns are packed into full sample blocks again, so only the sample blocks
+        ## from the first deleted column on are rewritten, and trailing sample blocks may be
+        ## dropped.
+        deleted_columns = deleted_columns[: self.num_cols]
+        if not deleted_columns.any():
+            return
+        first_block = deleted_columns.index(True) // self.sample_block_size
+        offset = first_block * self.sample_block_size
+        kept_ranges = kept_column_ranges(deleted_columns[offset:])
+        num_cols = offset + sum(stop - start for start, stop in kept_ranges)
+        num_blocks = -(-num_cols // self.sample_block_size)
+        rewritten = self.sample_blocks[first_block:num_blocks]
+        with ExitStack() as stack:
+            for sample_block in rewritten:
+                stack.enter_context(sample_block.batched_writes())
+            for row_indexes in row_batches(self.num_rows, self.rows_per_block, batch_rows):
+                if not rewritten:
+                    break
+                rows = [
+                    delete_row_columns(row, kept_ranges)
+                    for row in self.__get_rows(row_indexes, self.sample_blocks[first_block:])
+                ]
+                for i, sample_block in enumerate(rewritten):
+                    start = i * self.sample_block_size
+                    sample_block.set_rows(
+                        row_indexes, [row[start : start + self.sample_block_size] for row in rows]
+                    )
+        for block in range(first_block, num_blocks):
+            start = block * self.sample_block_size
+            self.sample_blocks[block].set_num_cols(min(self.sample_block_size, num_cols - start))
+        ## The directory is shortened before the keys of dropped sample blocks are deleted
+        dropped = self.sample_blocks[num_blocks:]
+        self.sample_blocks = self.sample_blocks[:num_blocks]
+        self.storage.set_integer(NUM_SAMPLE_BLOCKS_KEY, num_blocks)
+        for sample_block in dropped:
+            sample_block.delete()
@@ -0,0 +1,161 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+## The number of set bits of every row of a matrix, stored as little endian uint32s in blocks of
+## POPCOUNT_BLOCK_ROWS rows. Matrices with a popcount index have POPCOUNT_BLOCK_ROWS_KEY set.
+POPCOUNT_BLOCK_ROWS = 2 ** 12
+POPCOUNT_BLOCK_ROWS_KEY = "popcount_block_rows"
+POPCOUNT_DTYPE = np.dtype("<u4")
+## Blocks of popcounts kept in memory per process, by the key prefix and version of their rows
+MAX_LOADED_POPCOUNT_BLOCKS = 2 ** 10
+
+_loaded_popcount_blocks = OrderedDict()
+_loaded_popcount_blocks_lock = threading.Lock()
+
+
+def _popcount_key(storage, block, key_prefix=""):
+    return storage.convert_key_to_bytes("%s%i:popcounts" % (key_prefix, block))
+
+
+def _num_blocks(num_rows):
+    return -(-num_rows // POPCOUNT_BLOCK_ROWS)
+
+
+class PopcountWriter(object):
+
+    """
+    Stores the popcount index of a new matrix of num_rows rows while its rows are streamed into
+    storage. Each block of popcounts is written once its rows have been counted, so only one
+    block is held in memory.
+
+    :Example:
+    >>> popcounts = PopcountWriter(storage, num_rows)
+    >>> storage.set_bitarrays(range(num_rows), popcounts.count(rows))
+    >>> popcounts.close()
+    """
+
+    def __init__(self, storage, num_rows, key_prefix=""):
+        self.storage = storage
+        self.num_rows = num_rows
+        self.key_prefix = key_prefix
+        self._block = 0
+        self._counts = np.zeros(POPCOUNT_BLOCK_ROWS, dtype=POPCOUNT_DTYPE)
+        self._num_counts = 0
+
+    def count(self, rows):
+        ## Yields rows, counting each
+        for row in rows:
+            self._counts[self._num_counts] = row.count()
+            self._num_counts += 1
+            yield row
+            if self._num_counts == POPCOUNT_BLOCK_ROWS:
+                self.__write_block()
+
+    def close(self):
+        ## Writes the last block and zeros for any rows not counted, then marks the index complete
+        while self._block < _num_blocks(self.num_rows):
+            self.__write_block()
+        self.storage.set_integer(self.key_prefix + POPCOUNT_BLOCK_ROWS_KEY, POPCOUNT_BLOCK_ROWS)
+
+    def __write_block(self):
+        self.storage.batch_set(
+            [_popcount_key(self.storage, self._block, self.key_prefix)], [self._counts.tobytes()]
+        )
+        self._block += 1
+        self._counts[:] = 0
+        self._num_counts = 0
+
+
+def create_popcounts(storage, num_rows, key_prefix=""):
+    ## Stores a popcount index of num_rows rows of zeros, to be filled in with set_popcounts
+    PopcountWriter(storage, num_rows, key_prefix).close()
+
+
+def delete_popcounts(storage, num_rows, key_prefix=""):
+    storage.batch_delete(
+        [_popcount_key(storage, block, key_prefix) for block in range(_num_blocks(num_rows))]
+    )
+    storage.batch_delete(storage.convert_integer_batch_keys([key_prefix + POPCOUNT_BLOCK_ROWS_KEY]))
+
+
+def has_popcounts(storage, key_prefix=""):
+    try:
+        storage.get_integer(key_prefix + POPCOUNT_BLOCK_ROWS_KEY)
+    except KeyError:
+        return False
+    return True
+
+
+def set_popcounts(storage, row_indexes, counts, key_prefix=""):
+    ## Updates the popcounts of rows, reading the blocks which are only partly replaced
+    updates = {}
+    for row_index, count in zip(row_indexes, counts):
+        block, i = divmod(row_index, POPCOUNT_BLOCK_ROWS)
+        updates.setdefault(block, {})[i] = count
+    blocks = sorted(updates)
+    keys = [_popcount_key(storage, block, key_prefix) for block in blocks]
+    partial = [
+        (block, key)
+        for block, key in zip(blocks, keys)
+        if len(updates[block]) < POPCOUNT_BLOCK_ROWS
+    ]
+    existing = {}
+    if partial:
+        existing = dict(
+            zip([block for block, _ in partial], storage.batch_get([key for _, key in partial]))
+        )
+    values = []
+    for block in blocks:
+        if block in existing:
+            block_counts = np.frombuffer(existing[block], dtype=POPCOUNT_DTYPE).copy()
+        else:
+            block_counts = np.zeros(POPCOUNT_BLOCK_ROWS, dtype=POPCOUNT_DTYPE)
+        block_rows = updates[block]
+        block_counts[list(block_rows)] = list(block_rows.values())
+        values.append(block_counts.tobytes())
+    storage.batch_set(keys, values)
+    ## The version of the rows only changes once a batch of writes has finished, so the blocks
+    ## loaded before are dropped now
+    _forget_loaded_blocks(key_prefix, set(blocks))
+
+
+def _forget_loaded_blocks(key_prefix, blocks):
+    with _loaded_popcount_blocks_lock:
+        for cache_key in [
+            cache_key
+            for cache_key in _loaded_popcount_blocks
+            if cache_key[0] == key_prefix and cache_key[2] in blocks
+        ]:
+            del _loaded_popcount_blocks[cache_key]
+
+
+def load_popcounts(storage, row_indexes, key_prefix="", rows_version=""):
+    ## The popcounts of rows, as an array in the order of row_indexes. Only the blocks holding
+    ## the rows are read, and blocks of a version of the rows are loaded once per process.
+    row_indexes = np.asarray(row_indexes, dtype=np.int64)
+    row_blocks = row_indexes // POPCOUNT_BLOCK_ROWS
+    blocks = np.unique(row_blocks)
+    loaded = {}
+    if rows_version:
+        with _loaded_popcount_blocks_lock:
+            for block in blocks.tolist():
+                cache_key = (key_prefix, rows_version, block)
+                if cache_key in _loaded_popcount_blocks:
+                    _loaded_popcount_blocks.move_to_end(cache_key)
+                    loaded[block] = _loaded_popcount_blocks[cache_key]
+    missing = [block for block in blocks.tolist() if block not in loaded]
+    if missing:
+        values = storage.batch_get([_popcount_key(storage, block, key_prefix) for block in missing])
+        for block, value in zip(missing, values):
+            loaded[block] = np.frombuffer(value, dtype=POPCOUNT_DTYPE)
+        if rows_version:
+            with _loaded_popcount_blocks_lock:
+                for block in missing:
+                    _loaded_popcount_blocks[(key_prefix, rows_version, block)] = loaded[block]
+                while len(_loaded_popcount_blocks) > MAX_LOADED_POPCOUNT_BLOCKS:
+                    _loaded_popcount_blocks.popitem(last=False)
+    if not len(blocks):
+        return np.zeros(0, dtype=POPCOUNT_DTYPE)
+    table = np.stack([loaded[block] for block in blocks.tolist()])
+    return table[np.searchsorted(blocks, row_blocks), row_indexes % POPCOUNT_BLOCK_ROWS]
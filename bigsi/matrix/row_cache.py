@@ -0,0 +1,149 @@
+import sys
+import threading
+from collections import OrderedDict
+from bitarray import bitarray
+
+## Bytes per cached row besides its bits: the bitarray object, its key and the dict slot
+ROW_OVERHEAD = sys.getsizeof(bitarray()) + 100
+## Share of the budget held by rows which were hit since they were cached
+PROTECTED_SHARE = 0.8
+EVICTION_POLICIES = ("lru", "slru")
+
+_row_caches = {}
+_row_caches_lock = threading.Lock()
+
+
+def _row_size(row):
+    return (len(row) + 7) // 8 + ROW_OVERHEAD
+
+
+class RowCache(object):
+
+    """
+    An in-process cache of bit matrix rows, bounded to max_bytes. Rows are evicted least recently
+    used first. With the "slru" policy rows that are hit again move to a protected segment of up
+    to PROTECTED_SHARE of the budget, so one scan over many rows (e.g. a merge) does not evict the
+    rows of frequent queries. Hits, misses and evictions are counted.
+    """
+
+    def __init__(self, max_bytes, policy="slru"):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(
+                "Unknown row cache policy %s, expected one of %s"
+                % (policy, ", ".join(EVICTION_POLICIES))
+            )
+        self.max_bytes = int(max_bytes)
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def num_bytes(self):
+        return self._probation_bytes + self._protected_bytes
+
+    def __len__(self):
+        return len(self._probation) + len(self._protected)
+
+    def get_many(self, keys):
+        ## The cached rows of keys, None for those not cached
+        rows = []
+        with self._lock:
+            for key in keys:
+                row = self._protected.get(key)
+                if row is not None:
+                    self._protected.move_to_end(key)
+                else:
+                    row = self._probation.get(key)
+                    if row is not None:
+                        self.__promote(key, row)
+                if row is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                rows.append(row)
+        return rows
+
+    def put_many(self, keys, rows):
+        with self._lock:
+            for key, row in zip(keys, rows):
+                size = _row_size(row)
+                if size > self.max_bytes:
+                    continue
+                self.__discard(key)
+                self._probation[key] = row
+                self._probation_bytes += size
+            self.__evict()
+
+    def discard_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self.__discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._probation.clear()
+            self._protected.clear()
+            self._probation_bytes = self._protected_bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rows": len(self),
+            "bytes": self.num_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def __promote(self, key, row):
+        ## A hit in the probation segment
+        if self.policy == "lru":
+            self._probation.move_to_end(key)
+            return
+        size = _row_size(row)
+        del self._probation[key]
+        self._probation_bytes -= size
+        self._protected[key] = row
+        self._protected_bytes += size
+        ## Rows pushed out of the protected segment get another chance in the probation segment
+        while self._protected_bytes > self.max_bytes * PROTECTED_SHARE:
+            demoted_key, demoted = self._protected.popitem(last=False)
+            demoted_size = _row_size(demoted)
+            self._protected_bytes -= demoted_size
+            self._probation[demoted_key] = demoted
+            self._probation_bytes += demoted_size
+
+    def __discard(self, key):
+        for segment in (self._probation, self._protected):
+            row = segment.pop(key, None)
+            if row is not None:
+                if segment is self._probation:
+                    self._probation_bytes -= _row_size(row)
+                else:
+                    self._protected_bytes -= _row_size(row)
+
+    def __evict(self):
+        while self.num_bytes > self.max_bytes:
+            segment = self._probation if self._probation else self._protected
+            _, row = segment.popitem(last=False)
+            if segment is self._probation:
+                self._probation_bytes -= _row_size(row)
+            else:
+                self._protected_bytes -= _row_size(row)
+            self.evictions += 1
+
+
+def get_row_cache(name, max_bytes, policy="slru"):
+    ## The process wide cache of the index called name, so it outlives the BIGSI objects (e.g.
+    ## one per request) that use it
+    with _row_caches_lock:
+        row_cache = _row_caches.get(name)
+        if row_cache is None or (row_cache.max_bytes, row_cache.policy) != (int(max_bytes), policy):
+            row_cache = _row_caches[name] = RowCache(max_bytes, policy)
+        return row_cache
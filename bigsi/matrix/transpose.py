@@ -1,6 +1,10 @@
 from bitarray import bitarray
 import copy
+import math
 import logging
+import multiprocessing
+import os
+import tempfile
 
 logger = logging.getLogger(__name__)
 from bigsi.utils import DEFAULT_LOGGING_LEVEL
@@ -11,40 +15,177 @@ import numpy as np
 logger = logging.getLogger(__name__)
 
 
-def transpose_low_mem(bitarrays):
-    logger.info("Using slow, low memory transpose")
-    # Takes a list of bitarrays and returns the transpose as a list of
-    # bitarrays
-    x = len(bitarrays)
-    y = bitarrays[0].length()
-    logger.info("BFM dims %i %i" % (x, y))
+## Bytes of packed bloom filter held in one band by transpose_numpy
+TRANSPOSE_BAND_SIZE = 2 ** 26
+## Band size used for low memory builds
+LOW_MEM_BAND_SIZE = 2 ** 20
 
-    tbitarrays = []
-    for ii in range(y):
-        ba = bitarray(x)
-        ba.setall(False)
-        tbitarrays.append(ba)
-    for i in range(x):
-        for j in range(y):
-            tbitarrays[j][i] = bitarrays[i][j]
-    return tbitarrays
+## Masks and shifts of the 8x8 bit matrix transpose (Hacker's Delight, transpose8)
+_TRANSPOSE8_STEPS = [
+    (np.uint64(7), np.uint64(0x00AA00AA00AA00AA)),
+    (np.uint64(14), np.uint64(0x0000CCCC0000CCCC)),
+    (np.uint64(28), np.uint64(0x00000000F0F0F0F0)),
+]
 
 
-def transpose_numpy(bitarrays):
-    # Takes a list of bitarrays and returns the transpose as a list of
-    # bitarrays
+def _as_bytes(bloomfilter):
+    ## A zero copy uint8 view of a big endian bitarray. Packed bits (e.g. a
+    ## BloomFilterFile's bits) are kept as they are and only sliced per band.
+    if isinstance(bloomfilter, bitarray):
+        if bloomfilter.endian() != "big":
+            bloomfilter = bitarray(bloomfilter, endian="big")
+        return np.frombuffer(bloomfilter, dtype=np.uint8)
+    return bloomfilter
 
-    X = np.array(
-        [np.frombuffer(ba.unpack(), dtype=bool) for ba in bitarrays], dtype=bool
+
+def _num_rows(bloomfilter):
+    if isinstance(bloomfilter, bitarray):
+        return len(bloomfilter)
+    return len(bloomfilter) * 8
+
+
+def transpose_tiles(tiles):
+    """
+    Transposes packed 8 x 8 bit tiles. tiles is a uint8 array of shape (G, 8, B): G groups of 8
+    bloom filters by B bytes. Returns a uint8 array of shape (8 * B, G), row r of which holds bit r
+    of the band for every bloom filter, packed big endian.
+    """
+    groups, _, num_bytes = tiles.shape
+    ## Each tile's 8 bytes (one per bloom filter) as one big endian word, first bloom filter first
+    x = (
+        np.ascontiguousarray(tiles.transpose(0, 2, 1))
+        .view(">u8")
+        .reshape(groups, num_bytes)
+        .astype(np.uint64)
     )
-    for row in X.T:
-        ba = bitarray()
-        ba.pack(row.tobytes())
+    for shift, mask in _TRANSPOSE8_STEPS:
+        t = ((x >> shift) ^ x) & mask
+        x ^= t ^ (t << shift)
+    ## Byte j of each word is now bit j of the tile's byte for each of its 8 bloom filters
+    rows = x.astype(">u8").view(np.uint8).reshape(groups, num_bytes, 8)
+    return np.ascontiguousarray(rows.transpose(1, 2, 0)).reshape(8 * num_bytes, groups)
+
+
+def _transpose_bands(arrays, start, stop, band_bytes):
+    ## Yields the packed transposed rows of bytes [start, stop) of the inputs, one band at a time
+    groups = int(math.ceil(len(arrays) / 8))
+    for band_start in range(start, stop, band_bytes):
+        band_stop = min(band_start + band_bytes, stop)
+        ## Bloom filters are padded with zeros to whole tiles
+        band = np.zeros((8 * groups, band_stop - band_start), dtype=np.uint8)
+        for i, a in enumerate(arrays):
+            band[i] = a[band_start:band_stop]
+        yield transpose_tiles(band.reshape(groups, 8, band_stop - band_start))
+
+
+def _packed_rows_to_bitarrays(rows, num_cols):
+    for row in rows:
+        ba = bitarray(endian="big")
+        ba.frombytes(row.tobytes())
+        del ba[num_cols:]
         yield ba
 
 
-def transpose(bitarrays, lowmem=False):
-    if lowmem:
-        return transpose_low_mem(bitarrays)
-    else:
-        return transpose_numpy(bitarrays)
+def bytes_per_band(num_cols, band_size):
+    ## Bytes of each of num_cols bloom filters held in a band of band_size bytes
+    return max(1, band_size // (8 * int(math.ceil(num_cols / 8))))
+
+
+def transpose_numpy(bitarrays, num_rows=None, band_size=TRANSPOSE_BAND_SIZE):
+    # Takes a list of bitarrays (or packed uint8 arrays) and yields the
+    # transpose as bitarrays. Works through bands of rows on the packed bits,
+    # so memory is a few times band_size bytes whatever the number of rows.
+    if num_rows is None:
+        num_rows = _num_rows(bitarrays[0])
+    arrays = [_as_bytes(ba) for ba in bitarrays]
+    num_bytes = int(math.ceil(num_rows / 8))
+    band_bytes = bytes_per_band(len(arrays), band_size)
+    start_row = 0
+    for rows in _transpose_bands(arrays, 0, num_bytes, band_bytes):
+        yield from _packed_rows_to_bitarrays(
+            rows[: num_rows - start_row], len(arrays)
+        )
+        start_row += len(rows)
+
+
+def _init_shard_worker(arrays, band_bytes, tmpdir):
+    global _shard_arrays, _shard_band_bytes, _shard_tmpdir
+    _shard_arrays = arrays
+    _shard_band_bytes = band_bytes
+    _shard_tmpdir = tmpdir
+
+
+def _transpose_shard(shard):
+    ## Writes the packed rows of bytes [start, stop) of the inputs to a per shard file
+    start, stop = shard
+    path = os.path.join(_shard_tmpdir, "%i.rows" % start)
+    with open(path, "wb") as outfile:
+        for rows in _transpose_bands(_shard_arrays, start, stop, _shard_band_bytes):
+            outfile.write(rows.tobytes())
+    return path
+
+
+def _fork_context():
+    ## None where processes can't be forked
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context("fork")
+
+
+def transpose_sharded(bitarrays, num_rows=None, band_size=TRANSPOSE_BAND_SIZE, nproc=1):
+    # As transpose_numpy, but the row range is split into shards which are
+    # transposed by a pool of nproc processes. Each worker writes its shard's
+    # packed rows to a file, and the shard files are read back in row order,
+    # so rows are yielded while later shards are still being transposed.
+    # Workers are forked so they share the inputs. Where processes can't be
+    # forked the inputs would be copied to every worker, so they are
+    # transposed by transpose_numpy instead.
+    context = _fork_context()
+    if context is None:
+        logger.warning("Processes can't be forked, transposing in a single process")
+        yield from transpose_numpy(bitarrays, num_rows, band_size)
+        return
+    if num_rows is None:
+        num_rows = _num_rows(bitarrays[0])
+    arrays = [_as_bytes(ba) for ba in bitarrays]
+    num_cols = len(arrays)
+    row_bytes = int(math.ceil(num_cols / 8))
+    num_bytes = int(math.ceil(num_rows / 8))
+    band_bytes = bytes_per_band(num_cols, band_size)
+    ## A few shards per process so that uneven shards even out
+    shard_bytes = max(1, int(math.ceil(num_bytes / (4 * nproc))))
+    shards = [
+        (start, min(start + shard_bytes, num_bytes))
+        for start in range(0, num_bytes, shard_bytes)
+    ]
+    logger.info("Transposing %i shards with %i processes" % (len(shards), nproc))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ## Inputs (e.g. memory mapped bloom filter files) are inherited by the forked workers,
+        ## whatever the default start method
+        with context.Pool(
+            processes=nproc,
+            initializer=_init_shard_worker,
+            initargs=(arrays, band_bytes, tmpdir),
+        ) as pool:
+            start_row = 0
+            for path in pool.imap(_transpose_shard, shards):
+                with open(path, "rb") as infile:
+                    while start_row < num_rows:
+                        data = infile.read(8 * band_bytes * row_bytes)
+                        if not data:
+                            break
+                        rows = np.frombuffer(data, dtype=np.uint8).reshape(-1, row_bytes)
+                        yield from _packed_rows_to_bitarrays(
+                            rows[: num_rows - start_row], num_cols
+                        )
+                        start_row += len(rows)
+                os.remove(path)
+
+
+def transpose(bitarrays, lowmem=False, num_rows=None, band_size=None, nproc=1):
+    ## Both transpose band by band, low memory builds just use smaller bands
+    if band_size is None:
+        band_size = LOW_MEM_BAND_SIZE if lowmem else TRANSPOSE_BAND_SIZE
+    if nproc > 1:
+        return transpose_sharded(bitarrays, num_rows, band_size, nproc)
+    return transpose_numpy(bitarrays, num_rows, band_size)
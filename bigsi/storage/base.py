@@ -7,6 +7,9 @@ logger = logging.getLogger(__name__)
 
 
 class BaseStorage(object):
+    ## Whether batch_get may be called from several threads at once
+    thread_safe_reads = False
+
     def convert_key_to_bytes(self, key):
         return key.encode("utf-8")
 
@@ -20,6 +23,11 @@ class BaseStorage(object):
             key = self.convert_key_to_bytes(key)
         return self.storage[key]
 
+    def __delitem__(self, key):
+        if not isinstance(key, bytes):
+            key = self.convert_key_to_bytes(key)
+        del self.storage[key]
+
     def get(self, key, default=None):
         try:
             return self[key]
@@ -40,6 +48,11 @@ class BaseStorage(object):
             self.convert_key_to_bytes(self.convert_to_integer_key(key)) for key in keys
         )
 
+    def convert_string_batch_keys(self, keys):
+        return (
+            self.convert_key_to_bytes(self.convert_to_string_key(key)) for key in keys
+        )
+
     def convert_bitarray_batch_keys(self, keys):
         return (
             self.convert_key_to_bytes(self.convert_to_bitarray_key(key)) for key in keys
@@ -58,6 +71,14 @@ class BaseStorage(object):
     def batch_get(self, keys):
         return [self[k] for k in keys]
 
+    def batch_delete(self, keys):
+        ## Keys which don't exist are ignored
+        for k in keys:
+            try:
+                del self[k]
+            except KeyError:
+                pass
+
     def set_integer(self, key, value):
         key = self.convert_to_integer_key(key)
         self[key] = self.int_to_bytes(value)
@@ -83,6 +104,14 @@ class BaseStorage(object):
         key = self.convert_to_string_key(key)
         return self[key].decode("utf-8")
 
+    def set_strings(self, keys, values):
+        _keys = self.convert_string_batch_keys(keys)
+        self.batch_set(_keys, (v.encode("utf-8") for v in values))
+
+    def get_strings(self, keys):
+        _keys = self.convert_string_batch_keys(keys)
+        return [b.decode("utf-8") for b in self.batch_get(_keys)]
+
     def set_bitarray(self, key, value):
         assert isinstance(value, bitarray)
         _key = self.convert_to_bitarray_key(key)
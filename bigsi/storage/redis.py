@@ -6,6 +6,9 @@ from bigsi.utils import batch
 
 
 class RedisStorage(BaseStorage):
+    ## Reads use their own pipeline, and the connection pool is thread safe
+    thread_safe_reads = True
+
     def __init__(self, storage_config=None):
         if storage_config is None:
             storage_config = DEFAULT_REDIS_STORAGE_CONFIG
@@ -32,9 +35,14 @@ class RedisStorage(BaseStorage):
             self.__execute_pipeline()
 
     def batch_get(self, keys):
+        pipe = self.storage.pipeline()
         for k in keys:
-            self.pipe.get(k)
-        return self.__execute_pipeline()
+            pipe.get(k)
+        return pipe.execute()
+
+    def batch_delete(self, keys):
+        for batchiter in batch(keys, self.write_batch_size):
+            self.storage.delete(*batchiter)
 
     def set_bit(self, key, pos, bit):
         _key = self.convert_to_bitarray_key(key)
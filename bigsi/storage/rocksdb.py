@@ -18,6 +18,9 @@ class RocksDB(rocksdb.DB):
             raise KeyError("%s does not exist" % key)
         return val
 
+    def __delitem__(self, key):
+        self.delete(key)
+
 
 COMPRESSION_TYPE_MAP = {
     "no_compression": rocksdb.CompressionType.no_compression,
@@ -33,6 +36,8 @@ COMPRESSION_TYPE_MAP = {
 
 
 class RocksDBStorage(BaseStorage):
+    thread_safe_reads = True
+
     def __init__(self, storage_config=None):
         if storage_config is None:
             storage_config = DEFAULT_ROCKS_DB_STORAGE_CONFIG
@@ -73,6 +78,13 @@ class RocksDBStorage(BaseStorage):
         result = self.storage.multi_get(keys)
         return [result[k] for k in keys]
 
+    def batch_delete(self, keys):
+        for batchiter in batch(keys, self.write_batch_size):
+            writebatch = rocksdb.WriteBatch()
+            for k in batchiter:
+                writebatch.delete(k)
+            self.storage.write(writebatch)
+
     def sync(self):
         gc.collect()
 
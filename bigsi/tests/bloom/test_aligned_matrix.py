@@ -0,0 +1,74 @@
+from random import Random
+from tempfile import NamedTemporaryFile
+import numpy as np
+import pytest
+from bitarray import bitarray
+from hypothesis import given, settings, strategies as st
+
+from bigsi.bloom import BitMatrixReader
+from bigsi.bloom.aligned_matrix import AlignedBitMatrixFile
+from bigsi.bloom.aligned_matrix import HEADER_SIZE
+from bigsi.bloom.aligned_matrix import aligned_row_bytes
+from bigsi.bloom.aligned_matrix import create_aligned_matrix
+from bigsi.bloom.aligned_matrix import pack_rows
+
+
+def _random_rows(num_rows, num_cols, seed):
+    random = Random(seed)
+    return [bitarray([random.random() < 0.5 for _ in range(num_cols)]) for _ in range(num_rows)]
+
+
+def test_aligned_row_bytes():
+    assert aligned_row_bytes(1, 1) == 1
+    assert aligned_row_bytes(9, 1) == 2
+    assert aligned_row_bytes(1, 8) == 8
+    assert aligned_row_bytes(64, 8) == 8
+    assert aligned_row_bytes(65, 8) == 16
+
+
+@settings(deadline=None)
+@given(num_rows=st.integers(min_value=1, max_value=50),
+       num_cols=st.integers(min_value=1, max_value=70),
+       alignment=st.sampled_from([1, 8]),
+       seed=st.integers(min_value=0, max_value=2 ** 16))
+def test_aligned_matrix_write_read_rows(num_rows, num_cols, alignment, seed):
+    rows = _random_rows(num_rows, num_cols, seed)
+    back_to_back = bitarray()
+    for row in rows:
+        back_to_back.extend(row)
+
+    with NamedTemporaryFile() as tmp:
+        header = create_aligned_matrix(tmp.name, num_rows, num_cols, alignment)
+        with open(tmp.name, "rb") as infile:
+            infile.seek(0, 2)
+            assert infile.tell() == HEADER_SIZE + num_rows * header.row_bytes
+        ## Fill the second half of the rows first
+        middle = num_rows // 2
+        packed = pack_rows(back_to_back, num_rows, num_cols, header.row_bytes)
+        with AlignedBitMatrixFile(tmp.name, mode="r+") as matrix:
+            matrix.write_rows(middle, packed[middle:])
+            matrix.write_rows(0, packed[:middle])
+
+        with AlignedBitMatrixFile(tmp.name) as matrix:
+            assert (matrix.num_rows, matrix.num_cols) == (num_rows, num_cols)
+            assert [matrix.get_row(i) for i in range(num_rows)] == rows
+            assert np.array_equal(matrix.read_rows(1, num_rows), packed[1:])
+
+        with open(tmp.name, "rb") as infile:
+            bmr = BitMatrixReader(infile, num_rows, num_cols)
+            bmr.skip_rows(middle)
+            assert list(bmr) == rows[middle:]
+
+
+def test_aligned_matrix_reader_dimensions_mismatch():
+    with NamedTemporaryFile() as tmp:
+        create_aligned_matrix(tmp.name, 10, 3)
+        with open(tmp.name, "rb") as infile, pytest.raises(Exception):
+            BitMatrixReader(infile, 10, 4)
+
+
+def test_aligned_matrix_file_needs_header():
+    with NamedTemporaryFile() as tmp, pytest.raises(ValueError):
+        tmp.write(bytes(100))
+        tmp.flush()
+        AlignedBitMatrixFile(tmp.name)
@@ -1,9 +1,12 @@
 import math
 import pytest
+from contextlib import ExitStack
+from random import Random
 from tempfile import NamedTemporaryFile
 from typing import List
+from unittest.mock import patch
 from bitarray import bitarray
-from hypothesis import assume, given, strategies as st
+from hypothesis import assume, given, settings, strategies as st
 
 from bigsi.bloom import BitMatrixGroupReader
 
@@ -101,3 +104,39 @@ def test_bit_matrix_group_reader_raise_exception_past_iteration(num_rows: int, b
                 pass
             with pytest.raises(StopIteration):
                 next(bmgr)
+
+
+@patch("bigsi.bloom.bit_matrix_group_reader.BLOCK_BITS", 1)
+@settings(deadline=None)
+@given(num_rows=st.integers(min_value=1, max_value=300),
+       num_cols_list=st.lists(min_size=1, max_size=3, elements=st.integers(min_value=1, max_value=17)),
+       io_threads=st.integers(min_value=0, max_value=2),
+       skip=st.integers(min_value=0, max_value=300),
+       seed=st.integers(min_value=0, max_value=2 ** 16))
+def test_bit_matrix_group_reader_blocks(num_rows: int, num_cols_list: List[int], io_threads: int, skip: int,
+                                        seed: int):
+    random = Random(seed)
+    bit_arrays = [bitarray([random.random() < 0.5 for _ in range(num_rows * num_cols)])
+                  for num_cols in num_cols_list]
+    expected = []
+    for row in range(min(skip, num_rows), num_rows):
+        curr_row = bitarray()
+        for bit_array, num_cols in zip(bit_arrays, num_cols_list):
+            curr_row.extend(bit_array[row * num_cols:(row + 1) * num_cols])
+        expected.append(curr_row)
+
+    with ExitStack() as stack:
+        tmps = [stack.enter_context(NamedTemporaryFile()) for _ in num_cols_list]
+        for tmp, bit_array in zip(tmps, bit_arrays):
+            bit_array.tofile(tmp)
+            tmp.flush()
+        input_path_list = [tmp.name for tmp in tmps]
+        with BitMatrixGroupReader(zip(input_path_list, num_cols_list), num_rows, io_threads=io_threads) as bmgr:
+            bmgr.skip_rows(skip)
+            result = [next(bmgr)] if expected else []
+            for block_rows, block in bmgr.iter_blocks():
+                total_cols = sum(num_cols_list)
+                assert len(block) == block_rows * total_cols
+                result.extend(block[i * total_cols:(i + 1) * total_cols] for i in range(block_rows))
+
+    assert result == expected
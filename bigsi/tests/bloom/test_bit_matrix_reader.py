@@ -4,6 +4,7 @@ from typing import List
 from tempfile import NamedTemporaryFile
 from bitarray import bitarray
 from hypothesis import assume, given, strategies as st
+from unittest.mock import patch
 
 from bigsi.bloom import BitMatrixReader
 
@@ -61,3 +62,28 @@ def test_bit_matrix_reader_raise_exception_past_iteration(num_cols: int, byte_va
             pass
         with pytest.raises(StopIteration):
             next(bmr)
+
+
+@patch("bigsi.bloom.bit_matrix_reader.ROWS_PER_SLICE", 8)
+@given(num_cols=st.integers(min_value=1, max_value=8),
+       byte_values=st.lists(min_size=1, max_size=100, elements=st.integers(min_value=0, max_value=255)),
+       first_skip=st.integers(min_value=0, max_value=30),
+       second_skip=st.integers(min_value=0, max_value=30))
+def test_bit_matrix_reader_skip_rows(num_cols: int, byte_values: List[int], first_skip: int, second_skip: int):
+    num_rows = math.floor(len(byte_values) * 8 / num_cols)
+
+    with NamedTemporaryFile() as tmp, open(tmp.name, "rb") as infile:
+        tmp.write(bytes(byte_values))
+        tmp.flush()
+        expected = list(BitMatrixReader(infile, num_rows, num_cols))
+        infile.seek(0)
+        bmr = BitMatrixReader(infile, num_rows, num_cols)
+        bmr.skip_rows(first_skip)
+        result = [next(bmr)] if first_skip < num_rows else []
+        bmr.skip_rows(second_skip)
+        result.extend(bmr)
+
+    if first_skip < num_rows:
+        assert result == [expected[first_skip]] + expected[first_skip + 1 + second_skip:]
+    else:
+        assert result == []
@@ -67,3 +67,28 @@ def test_bit_matrix_writer_write_failure_past_iteration(num_cols: int, byte_valu
             bmw.write(bit_array)
         with pytest.raises(Exception):
             bmw.write(bitarray(1))
+
+
+@given(num_cols=st.integers(min_value=1, max_value=8),
+       byte_values=st.lists(min_size=1, max_size=100, elements=st.integers(min_value=0, max_value=255)),
+       block_sizes=st.lists(min_size=1, max_size=5, elements=st.sampled_from([1, 7, 80, 160])))
+def test_bit_matrix_writer_write_block_success(num_cols: int, byte_values: List[int], block_sizes: List[int]):
+    num_rows = math.floor(len(byte_values) * 8 / num_cols)
+
+    bit_array = bitarray()
+    bit_array.frombytes(bytes(byte_values))
+    del bit_array[num_rows * num_cols:]
+
+    with NamedTemporaryFile() as expected_for_write, open(expected_for_write.name, "rb") as expected_for_read:
+        with BitMatrixWriter(expected_for_write, num_rows, num_cols) as bmw:
+            for row_index in range(num_rows):
+                bmw.write(bit_array[row_index * num_cols:(row_index + 1) * num_cols])
+        with NamedTemporaryFile() as result_for_write:
+            with BitMatrixWriter(result_for_write, num_rows, num_cols) as bmw:
+                row_index = 0
+                while row_index < num_rows:
+                    block_rows = min(block_sizes[row_index % len(block_sizes)], num_rows - row_index)
+                    bmw.write_block(bit_array[row_index * num_cols:(row_index + block_rows) * num_cols], block_rows)
+                    row_index += block_rows
+            with open(result_for_write.name, "rb") as result_for_read:
+                assert result_for_read.read() == expected_for_read.read()
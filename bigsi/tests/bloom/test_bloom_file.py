@@ -0,0 +1,102 @@
+import pytest
+from typing import List
+from tempfile import NamedTemporaryFile
+from bitarray import bitarray
+from hypothesis import given, strategies as st
+
+from bigsi.bloom import BitMatrixReader
+from bigsi.bloom import BloomFilterFile
+from bigsi.bloom.bloom_file import ENCODING_CONTAINERS
+from bigsi.bloom.bloom_file import ENCODING_RAW
+from bigsi.bloom.bloom_file import HEADER_SIZE
+from bigsi.bloom.bloom_file import write_bloom_file
+from bigsi.matrix import transpose
+
+ST_BITS = st.lists(st.booleans(), min_size=1, max_size=200)
+ST_ENCODING = st.sampled_from([ENCODING_RAW, ENCODING_CONTAINERS])
+
+
+def _bitarray(bits: List[bool]) -> bitarray:
+    ba = bitarray(endian="big")
+    ba.extend(bits)
+    return ba
+
+
+@given(bits=ST_BITS, h=st.integers(min_value=1, max_value=10), k=st.integers(min_value=1, max_value=63),
+       double_hashing=st.booleans(), block_size=st.sampled_from([0, 64]), encoding=ST_ENCODING)
+def test_bloom_file_round_trip(bits: List[bool], h: int, k: int, double_hashing: bool, block_size: int,
+                               encoding: int):
+    ba = _bitarray(bits)
+    with NamedTemporaryFile() as tmp:
+        write_bloom_file(tmp, ba, h=h, k=k, double_hashing=double_hashing, block_size=block_size,
+                         encoding=encoding)
+        tmp.flush()
+        with BloomFilterFile(tmp.name) as bf:
+            bf.verify()
+            bf.validate(m=len(bits), h=h, k=k, double_hashing=double_hashing, block_size=block_size)
+            assert not bf.is_legacy
+            assert (bf.m, bf.h, bf.k, bf.popcount) == (len(bits), h, k, sum(bits))
+            assert bf.double_hashing == double_hashing
+            assert bf.encoding == encoding
+            assert bf.to_bitarray() == ba
+            assert bf.bits.tobytes() == ba.tobytes()
+            assert bf.bits[1:3].tobytes() == ba.tobytes()[1:3]
+
+
+@given(bits=ST_BITS)
+def test_bloom_file_legacy(bits: List[bool]):
+    ba = _bitarray(bits)
+    with NamedTemporaryFile() as tmp:
+        ba.tofile(tmp)
+        tmp.flush()
+        with BloomFilterFile(tmp.name, m=len(bits)) as bf:
+            bf.verify()
+            bf.validate(m=len(bits), h=3, k=31)
+            assert bf.is_legacy
+            assert bf.h is None and bf.k is None
+            assert bf.to_bitarray() == ba
+        with pytest.raises(ValueError):
+            BloomFilterFile(tmp.name, m=len(bits) + 8)
+
+
+def test_bloom_file_mismatch():
+    with NamedTemporaryFile() as tmp:
+        write_bloom_file(tmp, _bitarray([True, False] * 50), h=3, k=31)
+        tmp.flush()
+        with BloomFilterFile(tmp.name) as bf:
+            for params in [{"m": 99}, {"h": 2}, {"k": 21}, {"double_hashing": True}, {"block_size": 8}]:
+                with pytest.raises(ValueError):
+                    bf.validate(**params)
+
+        tmp.seek(HEADER_SIZE)
+        tmp.write(b"\xff")
+        tmp.flush()
+        with BloomFilterFile(tmp.name) as bf, pytest.raises(ValueError):
+            bf.verify()
+
+
+@given(bits=ST_BITS, encoding=ST_ENCODING)
+def test_bit_matrix_reader_bloom_file(bits: List[bool], encoding: int):
+    ba = _bitarray(bits)
+    with NamedTemporaryFile() as tmp:
+        write_bloom_file(tmp, ba, h=3, k=31, encoding=encoding)
+        tmp.flush()
+        with open(tmp.name, "rb") as infile:
+            rows = list(BitMatrixReader(infile, len(bits), 1))
+    assert [row[0] for row in rows] == bits
+
+
+@given(bits=st.lists(st.lists(st.booleans(), min_size=20, max_size=20), min_size=1, max_size=5), encoding=ST_ENCODING)
+def test_transpose_bloom_files(bits: List[List[bool]], encoding: int):
+    bitarrays = [_bitarray(b) for b in bits]
+    tmps = [NamedTemporaryFile() for _ in bitarrays]
+    try:
+        for tmp, ba in zip(tmps, bitarrays):
+            write_bloom_file(tmp, ba, h=3, k=31, encoding=encoding)
+            tmp.flush()
+        for lowmem in [True, False]:
+            bloomfilters = [BloomFilterFile(tmp.name).bits for tmp in tmps]
+            assert list(transpose(bloomfilters, lowmem, num_rows=20)) == list(transpose(bitarrays, lowmem))
+    finally:
+        for tmp in tmps:
+            tmp.close()
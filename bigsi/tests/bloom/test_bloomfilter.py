@@ -3,6 +3,7 @@ from random import choice
 from hypothesis import assume, given, strategies as st
 
 from bigsi.bloom import generate_hashes
+from bigsi.bloom import generate_hashes_batch
 from bigsi.bloom import BloomFilter
 
 
@@ -78,3 +79,65 @@ def _generate_random_kmers(len_kmer, num_kmers):
 
 def _generate_kmer_hashes(kmers, len_bloom_filter, num_hash_functions):
     return {h for kmer in kmers for h in generate_hashes(kmer, num_hash_functions, len_bloom_filter)}
+
+
+@given(len_bloom_filter=st.integers(min_value=1, max_value=2000),
+       num_hash_functions=st.integers(min_value=1, max_value=5),
+       len_kmer=st.integers(min_value=1, max_value=40),
+       num_kmers=st.integers(min_value=0, max_value=20))
+def test_generate_hashes_batch_matches_generate_hashes(len_bloom_filter, num_hash_functions, len_kmer, num_kmers):
+    kmers = _generate_random_kmers(len_kmer, num_kmers)
+    hashes = generate_hashes_batch(kmers, num_hash_functions, len_bloom_filter)
+
+    assert hashes.shape == (num_kmers, num_hash_functions)
+    for kmer, row in zip(kmers, hashes.tolist()):
+        assert set(row) == generate_hashes(kmer, num_hash_functions, len_bloom_filter)
+
+
+@given(len_bloom_filter=st.integers(min_value=1, max_value=2000),
+       num_hash_functions=st.integers(min_value=1, max_value=5),
+       len_kmer=st.integers(min_value=1, max_value=40),
+       num_kmers=st.integers(min_value=1, max_value=20))
+def test_generate_hashes_batch_double_hashing(len_bloom_filter, num_hash_functions, len_kmer, num_kmers):
+    kmers = _generate_random_kmers(len_kmer, num_kmers)
+    hashes = generate_hashes_batch(kmers, num_hash_functions, len_bloom_filter, double_hashing=True)
+
+    assert hashes.shape == (num_kmers, num_hash_functions)
+    assert ((hashes >= 0) & (hashes < len_bloom_filter)).all()
+    for kmer, row in zip(kmers, hashes.tolist()):
+        assert set(row) == generate_hashes(kmer, num_hash_functions, len_bloom_filter, double_hashing=True)
+
+
+@given(len_bloom_filter=st.integers(min_value=100, max_value=2000),
+       num_hash_functions=st.integers(min_value=1, max_value=3),
+       len_kmer=st.integers(min_value=3, max_value=31),
+       num_kmers=st.integers(min_value=1, max_value=10))
+def test_bloomfilter_double_hashing_updated_success(len_bloom_filter, num_hash_functions, len_kmer, num_kmers):
+    kmers = _generate_random_kmers(len_kmer, num_kmers)
+
+    expected = BloomFilter(m=len_bloom_filter, h=num_hash_functions, double_hashing=True)
+    for kmer in kmers:
+        expected.add(kmer)
+    bloom_filter = BloomFilter(m=len_bloom_filter, h=num_hash_functions, double_hashing=True)
+    bloom_filter.update(kmers)
+
+    assert bloom_filter.bitarray == expected.bitarray
+
+
+@given(len_bloom_filter=st.integers(min_value=64, max_value=2000),
+       num_hash_functions=st.integers(min_value=1, max_value=5),
+       block_size=st.sampled_from([1, 8, 16, 64]),
+       len_kmer=st.integers(min_value=1, max_value=40),
+       num_kmers=st.integers(min_value=1, max_value=20))
+def test_generate_hashes_batch_blocked(len_bloom_filter, num_hash_functions, block_size, len_kmer, num_kmers):
+    kmers = _generate_random_kmers(len_kmer, num_kmers)
+    hashes = generate_hashes_batch(kmers, num_hash_functions, len_bloom_filter, block_size=block_size)
+
+    assert hashes.shape == (num_kmers, num_hash_functions)
+    assert ((hashes >= 0) & (hashes < len_bloom_filter)).all()
+    for kmer, row in zip(kmers, hashes.tolist()):
+        assert len({position // block_size for position in row}) == 1
+        assert set(row) == generate_hashes(kmer, num_hash_functions, len_bloom_filter, block_size=block_size)
+
+    bloom_filter = BloomFilter(m=len_bloom_filter, h=num_hash_functions, block_size=block_size).update(kmers)
+    assert set(bloom_filter.bitarray.search(bitarray("1"))) == set(hashes.flatten().tolist())
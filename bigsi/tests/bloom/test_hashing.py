@@ -0,0 +1,35 @@
+import mmh3
+import numpy as np
+from random import choice
+from hypothesis import given, strategies as st
+
+from bigsi.bloom.hashing import elements_to_matrix
+from bigsi.bloom.hashing import murmur3_32
+from bigsi.bloom.hashing import murmur3_x64_128
+
+
+@given(len_element=st.integers(min_value=1, max_value=70),
+       num_elements=st.integers(min_value=1, max_value=20),
+       seed=st.integers(min_value=0, max_value=2 ** 32 - 1))
+def test_murmur3_32_matches_mmh3(len_element, num_elements, seed):
+    elements = [''.join(choice("ACGT") for _ in range(len_element)) for _ in range(num_elements)]
+
+    result = murmur3_32(elements_to_matrix(elements), seed)
+
+    assert result.tolist() == [mmh3.hash(e, seed, signed=False) for e in elements]
+
+
+@given(len_element=st.integers(min_value=1, max_value=70),
+       num_elements=st.integers(min_value=1, max_value=20),
+       seed=st.integers(min_value=0, max_value=2 ** 32 - 1))
+def test_murmur3_x64_128_matches_mmh3(len_element, num_elements, seed):
+    elements = [''.join(choice("ACGT") for _ in range(len_element)) for _ in range(num_elements)]
+
+    h1, h2 = murmur3_x64_128(elements_to_matrix(elements), seed)
+
+    assert list(zip(h1.tolist(), h2.tolist())) == [mmh3.hash64(e, seed, signed=False) for e in elements]
+
+
+def test_elements_to_matrix():
+    assert elements_to_matrix(["AC", b"GT"]).tolist() == [[65, 67], [71, 84]]
+    assert elements_to_matrix([]).shape == (0, 0)
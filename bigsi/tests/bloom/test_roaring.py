@@ -0,0 +1,34 @@
+import numpy as np
+from hypothesis import given, strategies as st
+
+from bigsi.bloom.roaring import ARRAY_MAX_CARDINALITY
+from bigsi.bloom.roaring import CONTAINER_BITS
+from bigsi.bloom.roaring import ContainerBits
+from bigsi.bloom.roaring import encode_containers
+
+
+@given(m=st.integers(min_value=1, max_value=3 * CONTAINER_BITS),
+       density=st.sampled_from([0.0, 0.01, 0.1, 0.5]),
+       seed=st.integers(min_value=0, max_value=2 ** 32 - 1),
+       data=st.data())
+def test_container_bits_slices(m, density, seed, data):
+    bits = np.random.RandomState(seed).random_sample(m) < density
+    packed = np.packbits(bits)
+    bits = ContainerBits(np.frombuffer(encode_containers(packed, m), dtype=np.uint8), m)
+
+    assert len(bits) == len(packed)
+    assert bits.popcount == int(np.unpackbits(packed).sum())
+    assert np.array_equal(np.asarray(bits), packed)
+    start = data.draw(st.integers(min_value=0, max_value=len(packed)))
+    stop = data.draw(st.integers(min_value=start, max_value=len(packed)))
+    assert np.array_equal(bits[start:stop], packed[start:stop])
+
+
+def test_sparse_containers_are_small():
+    m = 10 * CONTAINER_BITS
+    positions = np.arange(0, m, 100)
+    unpacked = np.zeros(m, dtype=np.uint8)
+    unpacked[positions] = 1
+    payload = encode_containers(np.packbits(unpacked), m)
+    assert len(positions) <= 10 * ARRAY_MAX_CARDINALITY
+    assert len(payload) < 2 * len(positions) + 12 * 11
@@ -0,0 +1,71 @@
+import csv
+import os
+import numpy as np
+from tempfile import TemporaryDirectory
+from hypothesis import given, settings, strategies as st
+
+from bigsi.bloom import BloomFilterFile
+from bigsi.cmds.bloom import bloom
+from bigsi.cmds.bloom import bloom_batch
+from bigsi.cmds.bloom import extract_kmer_codes
+from bigsi.cmds.bloom import read_bloom_batch_file
+from bigsi.cmds.bloom import read_kmer_count
+
+CONFIG = {"k": 9, "m": 1000, "h": 3}
+CTX = "bigsi/tests/data/test_kmers.ctx"
+
+
+def _read_bloomfilter(path):
+    with BloomFilterFile(path) as bloomfilter:
+        return bloomfilter.to_bitarray()
+
+
+def _write_fastq(path, reads):
+    with open(path, "w") as outfile:
+        for i, read in enumerate(reads):
+            outfile.write("@r%i\n%s\n+\n%s\n" % (i, read, "I" * len(read)))
+
+
+@settings(deadline=None, max_examples=10)
+@given(
+    samples=st.lists(
+        st.lists(st.text(min_size=9, max_size=60, alphabet=["A", "T", "C", "G"]), min_size=1, max_size=5),
+        min_size=1,
+        max_size=4,
+    ),
+    nproc=st.integers(min_value=1, max_value=2),
+    encoding=st.sampled_from(["raw", "containers"]),
+)
+def test_bloom_batch(samples, nproc, encoding):
+    with TemporaryDirectory() as tmpdir:
+        pairs = [(CTX, os.path.join(tmpdir, "ctx.bloom"))]
+        for i, reads in enumerate(samples):
+            infile = os.path.join(tmpdir, "sample%i.fastq" % i)
+            _write_fastq(infile, reads)
+            pairs.append((infile, os.path.join(tmpdir, "out", "sample%i.bloom" % i)))
+        summary = os.path.join(tmpdir, "summary.tsv")
+
+        results = bloom_batch(CONFIG, pairs, nproc=nproc, summary=summary, encoding=encoding)
+
+        assert [(r["input"], r["output"]) for r in results] == pairs
+        for (infile, outfile), result in zip(pairs, results):
+            expected = os.path.join(tmpdir, "expected.bloom")
+            bloom(CONFIG, expected, extract_kmer_codes(infile, CONFIG["k"]))
+            bloomfilter = _read_bloomfilter(outfile)
+            assert bloomfilter == _read_bloomfilter(expected)
+            assert result["bits_set"] == bloomfilter.count()
+            assert result["kmers_inserted"] == sum(len(b) for b in extract_kmer_codes(infile, CONFIG["k"]))
+            distinct_kmers = len(set(np.concatenate(list(extract_kmer_codes(infile, CONFIG["k"]))).tolist()))
+            assert read_kmer_count(outfile) == result["distinct_kmers"]
+            assert abs(result["distinct_kmers"] - distinct_kmers) <= max(2, 0.05 * distinct_kmers)
+        with open(summary) as infile:
+            rows = list(csv.DictReader(infile, delimiter="\t"))
+        assert [int(row["bits_set"]) for row in rows] == [r["bits_set"] for r in results]
+
+
+def test_read_bloom_batch_file():
+    with TemporaryDirectory() as tmpdir:
+        from_file = os.path.join(tmpdir, "samples.tsv")
+        with open(from_file, "w") as outfile:
+            outfile.write("a.fastq.gz\ta.bloom\nb.ctx\tb.bloom\n\n")
+        assert read_bloom_batch_file(from_file) == [("a.fastq.gz", "a.bloom"), ("b.ctx", "b.bloom")]
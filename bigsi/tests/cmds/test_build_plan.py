@@ -0,0 +1,145 @@
+import copy
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+import pytest
+from bitarray import bitarray
+
+import bigsi.tests.base as base
+from bigsi import BIGSI
+from bigsi.bloom.bloom_file import write_bloom_file
+from bigsi.bloom.bloom_file import HEADER_SIZE
+from bigsi.cmds.build import build
+from bigsi.cmds.build import build_main
+from bigsi.cmds.build_plan import build_footprint
+from bigsi.cmds.build_plan import default_max_open_bloomfilters
+from bigsi.cmds.build_plan import measure_transpose_factor
+from bigsi.cmds.build_plan import plan_build
+from bigsi.graph.index import MERGE_BATCH_ROWS
+from bigsi.matrix.transpose import TRANSPOSE_BAND_SIZE
+
+
+def test_measure_transpose_factor():
+    ## The band, its 64 bit words, their working copy and the transposed rows
+    assert 2 <= measure_transpose_factor() <= 10
+
+
+def test_build_footprint_grows_with_band_and_processes():
+    args = dict(num_samples=1000, m=10 ** 9, chunk_size=1000, transpose_factor=5, row_overhead=100)
+    small = build_footprint(band_size=2 ** 20, nproc=1, **args)
+    big = build_footprint(band_size=2 ** 24, nproc=1, **args)
+    parallel = build_footprint(band_size=2 ** 24, nproc=4, **args)
+    assert small["transpose"] < big["transpose"] < parallel["transpose"]
+    assert small["load"] < big["load"] < parallel["load"]
+    assert big["merge"] == 0
+    ## Bands never cover more than the bloom filters
+    assert build_footprint(band_size=2 ** 24, nproc=1, **dict(args, m=800))["load"] == 1000 * 100
+
+
+@patch("bigsi.cmds.build_plan.current_rss", lambda: 10 ** 8)
+def test_plan_build_without_budget():
+    plan = plan_build(num_samples=100, m=10 ** 6, nproc=3)
+    assert plan["chunk_size"] == 100
+    assert plan["num_chunks"] == 1
+    assert plan["nproc"] == 3
+    assert plan["band_size"] == TRANSPOSE_BAND_SIZE
+    assert plan["baseline_bytes"] == 10 ** 8
+
+
+@patch("bigsi.cmds.build_plan.current_rss", lambda: 10 ** 8)
+def test_plan_build_fits_budget():
+    unbounded = plan_build(num_samples=10000, m=10 ** 9, nproc=4)
+    budgets = [unbounded["peak_bytes"], 10 ** 9, 3 * 10 ** 8, 1.5 * 10 ** 8]
+    plans = [plan_build(num_samples=10000, m=10 ** 9, max_memory=budget, nproc=4) for budget in budgets]
+    assert plans[0]["nproc"] == 4 and plans[0]["band_size"] == TRANSPOSE_BAND_SIZE
+    for budget, plan in zip(budgets, plans):
+        assert plan["peak_bytes"] <= budget
+    ## Smaller budgets use fewer processes or smaller bands
+    work = [plan["nproc"] * plan["band_size"] for plan in plans]
+    assert work == sorted(work, reverse=True)
+    assert plans[-1]["band_size"] < TRANSPOSE_BAND_SIZE
+
+
+@patch("bigsi.cmds.build_plan.current_rss", lambda: 10 ** 8)
+def test_plan_build_chunks_when_smallest_band_does_not_fit():
+    num_samples = 10 ** 7
+    plan = plan_build(num_samples=num_samples, m=10 ** 9, max_memory=10 ** 8 + 4 * 10 ** 7, nproc=2,
+                      write_batch_rows=1, max_open_bloomfilters=num_samples)
+    assert plan["nproc"] == 1
+    assert plan["num_chunks"] > 1
+    assert plan["chunk_size"] < num_samples
+    assert plan["merge_batch_rows"] < MERGE_BATCH_ROWS
+    assert plan["peak_bytes"] <= 10 ** 8 + 4 * 10 ** 7
+
+
+@patch("bigsi.cmds.build_plan.current_rss", lambda: 10 ** 8)
+def test_plan_build_caps_open_bloomfilters():
+    plan = plan_build(num_samples=100, m=10 ** 6, max_open_bloomfilters=30)
+    assert (plan["chunk_size"], plan["num_chunks"]) == (30, 4)
+    plan = plan_build(num_samples=100, m=10 ** 6, max_memory=10 ** 12, max_open_bloomfilters=30)
+    assert plan["chunk_size"] <= 30
+
+
+def test_default_max_open_bloomfilters():
+    with TemporaryDirectory() as tmpdir:
+        path = "%s/max_map_count" % tmpdir
+        with open(path, "w") as outfile:
+            outfile.write("1000\n")
+        with patch("bigsi.cmds.build_plan.MAX_MAP_COUNT_PATH", path):
+            assert default_max_open_bloomfilters() == 500
+        with patch("bigsi.cmds.build_plan.MAX_MAP_COUNT_PATH", path + ".missing"):
+            assert default_max_open_bloomfilters() == 32765
+
+
+@patch("bigsi.cmds.build_plan.current_rss", lambda: 10 ** 8)
+def test_plan_build_budget_too_small():
+    with pytest.raises(ValueError):
+        plan_build(num_samples=10, m=1000, max_memory=10 ** 7)
+
+
+def test_build_reports_plan_and_stage_peaks():
+    config = copy.deepcopy(base.CONFIGS[0])
+    config["m"] = 1000
+    config["h"] = 1
+    blooms = [bitarray([(i + j) % 7 == 0 for i in range(config["m"])]) for j in range(5)]
+    samples = ["s%i" % j for j in range(5)]
+    with TemporaryDirectory() as tmpdir:
+        paths = []
+        for j, bloom in enumerate(blooms):
+            paths.append("%s/%i.bloom" % (tmpdir, j))
+            with open(paths[-1], "wb") as outfile:
+                write_bloom_file(outfile, bloom, config["h"], config["k"])
+        ## The chunk size is forced to 2, so chunks are built and merged
+        plan = plan_build(len(samples), config["m"])
+        plan.update(chunk_size=2, num_chunks=3, merge_batch_rows=64)
+        with patch("bigsi.cmds.build.plan_build", lambda **kwargs: plan):
+            result = build(config, paths, samples, max_memory=10 ** 12)
+    assert result["plan"]["num_chunks"] == 3
+    assert set(result["peak_rss"]) == {"load", "transpose_and_write", "merge"}
+    assert all(peak > 0 for peak in result["peak_rss"].values())
+
+    bigsi = BIGSI(config)
+    for j, bloom in enumerate(blooms):
+        assert bigsi.bitmatrix.get_column(j) == bloom
+    bigsi.delete()
+
+
+def test_build_main_verifies_bloomfilters_if_asked():
+    config = copy.deepcopy(base.CONFIGS[0])
+    config["m"] = 1000
+    config["h"] = 1
+    bloom = bitarray([i % 7 == 0 for i in range(config["m"])])
+    with TemporaryDirectory() as tmpdir:
+        path = "%s/corrupt.bloom" % tmpdir
+        with open(path, "wb") as outfile:
+            write_bloom_file(outfile, bloom, config["h"], config["k"])
+        ## Zeros the first byte of the payload, leaving the header as it was
+        with open(path, "r+b") as outfile:
+            outfile.seek(HEADER_SIZE)
+            outfile.write(b"\x00")
+        with pytest.raises(ValueError):
+            build_main(dict(config, verify_bloomfilters=True), [path], ["s1"])
+        bigsi = build_main(config, [path], ["s1"])
+        column = bigsi.bitmatrix.get_column(0)
+        assert not column[:8].any()
+        assert column[8:] == bloom[8:]
+        bigsi.delete()
@@ -5,10 +5,13 @@ from typing import List
 from bitarray import bitarray
 from hypothesis import given, settings, strategies as st
 from unittest.mock import patch
+import pytest
 
+from bigsi import BIGSI
 from bigsi.bloom.bit_matrix_reader import BitMatrixReader
 from bigsi.cmds.large_build import large_build
 from bigsi.cmds.merge_blooms import merge_blooms
+from bigsi.graph.metadata import SampleMetadata
 from bigsi.storage import get_storage
 
 
@@ -57,3 +60,130 @@ def test_large_build_cmd_success(num_rows: int, byte_values1: List[int], byte_va
             with open(tmp_for_merged_blooms_write.name, "rb") as tmp_for_merged_blooms_read:
                 for index, row in enumerate(BitMatrixReader(tmp_for_merged_blooms_read, num_rows, num_cols1+num_cols2)):
                     assert storage.get_bitarray(index).tobytes() == row.tobytes()
+
+
+def test_large_build_cmd_resumes_after_crash():
+    num_rows = 40
+    input_bit_array1 = bitarray([i % 3 == 0 for i in range(num_rows * 8)])
+    input_bit_array2 = bitarray([i % 5 == 0 for i in range(num_rows * 16)])
+
+    with NamedTemporaryFile() as tmp_for_input_1, NamedTemporaryFile() as tmp_for_input_2, NamedTemporaryFile() as tmp_db:
+        input_bit_array1.tofile(tmp_for_input_1)
+        tmp_for_input_1.flush()
+        input_bit_array2.tofile(tmp_for_input_2)
+        tmp_for_input_2.flush()
+
+        input_paths = [tmp_for_input_1.name, tmp_for_input_2.name]
+        cols = [8, 16]
+        samples = ["s%i" % i for i in range(24)]
+        config = _get_bigsi_index_config(num_rows, tmp_db.name)
+
+        ## Crash on the third batch, after two batches are committed
+        calls = []
+        set_bitarrays = get_storage(config).__class__.set_bitarrays
+
+        def crash_on_third_batch(self, keys, values):
+            calls.append(keys)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            return set_bitarrays(self, keys, values)
+
+        with patch("bigsi.cmds.large_build.DB_INSERT_BATCH_SIZE", 10), patch.object(
+            get_storage(config).__class__, "set_bitarrays", crash_on_third_batch
+        ):
+            with pytest.raises(KeyboardInterrupt):
+                large_build(config, input_paths, cols, samples)
+        with pytest.raises(ValueError):
+            BIGSI(config)
+
+        resumed_keys = []
+        set_bitarrays_resumed = get_storage(config).__class__.set_bitarrays
+
+        def record(self, keys, values):
+            resumed_keys.extend(keys)
+            return set_bitarrays_resumed(self, keys, values)
+
+        with patch("bigsi.cmds.large_build.DB_INSERT_BATCH_SIZE", 10), patch.object(
+            get_storage(config).__class__, "set_bitarrays", record
+        ):
+            large_build(config, input_paths, cols, samples)
+        assert resumed_keys == list(range(20, 40))
+
+        storage = get_storage(config)
+        with NamedTemporaryFile() as tmp_for_merged_blooms_write:
+            merge_blooms(zip(input_paths, cols), num_rows, tmp_for_merged_blooms_write.name)
+            with open(tmp_for_merged_blooms_write.name, "rb") as tmp_for_merged_blooms_read:
+                for index, row in enumerate(BitMatrixReader(tmp_for_merged_blooms_read, num_rows, 24)):
+                    assert storage.get_bitarray(index).tobytes() == row.tobytes()
+        assert BIGSI(config).colours_to_samples(range(24)) == dict(enumerate(samples))
+        ## Popcounts of rows written before and after the crash are kept
+        assert BIGSI(config).bitmatrix.get_popcounts(range(num_rows)).tolist() == [
+            storage.get_bitarray(index).count() for index in range(num_rows)
+        ]
+
+
+def test_large_build_cmd_restarts_with_changed_inputs():
+    num_rows = 40
+    with NamedTemporaryFile() as tmp_for_input_1, NamedTemporaryFile() as tmp_for_input_2, NamedTemporaryFile() as tmp_db:
+        bitarray([i % 3 == 0 for i in range(num_rows * 8)]).tofile(tmp_for_input_1)
+        tmp_for_input_1.flush()
+        bitarray([i % 5 == 0 for i in range(num_rows * 16)]).tofile(tmp_for_input_2)
+        tmp_for_input_2.flush()
+        config = _get_bigsi_index_config(num_rows, tmp_db.name)
+
+        ## Interrupted after all rows and the first samples were written
+        add_sample = SampleMetadata.add_sample
+
+        def crash_on_third_sample(self, sample_name):
+            if self.num_samples == 2:
+                raise KeyboardInterrupt
+            return add_sample(self, sample_name)
+
+        with patch.object(SampleMetadata, "add_sample", crash_on_third_sample):
+            with pytest.raises(KeyboardInterrupt):
+                large_build(
+                    config,
+                    [tmp_for_input_1.name, tmp_for_input_2.name],
+                    [8, 16],
+                    ["old%i" % i for i in range(24)],
+                )
+
+        ## Built again from the first input only, under other sample names
+        samples = ["s%i" % i for i in range(8)]
+        large_build(config, [tmp_for_input_1.name], [8], samples)
+        bigsi = BIGSI(config)
+        assert bigsi.num_samples == 8
+        assert bigsi.colours_to_samples(range(8)) == dict(enumerate(samples))
+        assert not bigsi.sample_name_exists("old0")
+        storage = get_storage(config)
+        with open(tmp_for_input_1.name, "rb") as tmp_for_input_1_read:
+            for index, row in enumerate(BitMatrixReader(tmp_for_input_1_read, num_rows, 8)):
+                assert storage.get_bitarray(index)[:8] == row
+
+        ## A built index is not overwritten
+        with pytest.raises(ValueError):
+            large_build(config, [tmp_for_input_2.name], [16], ["t%i" % i for i in range(16)])
+        assert BIGSI(config).colours_to_samples(range(8)) == dict(enumerate(samples))
+
+
+def test_large_build_cmd_from_aligned_matrix():
+    num_rows = 200
+    input_bit_array1 = bitarray([i % 3 == 0 for i in range(num_rows * 5)])
+    input_bit_array2 = bitarray([i % 7 == 0 for i in range(num_rows * 2)])
+
+    with NamedTemporaryFile() as tmp_for_input_1, NamedTemporaryFile() as tmp_for_input_2, \
+            NamedTemporaryFile() as tmp_for_merged, NamedTemporaryFile() as tmp_db:
+        input_bit_array1.tofile(tmp_for_input_1)
+        tmp_for_input_1.flush()
+        input_bit_array2.tofile(tmp_for_input_2)
+        tmp_for_input_2.flush()
+        merge_blooms(zip([tmp_for_input_1.name, tmp_for_input_2.name], [5, 2]), num_rows, tmp_for_merged.name,
+                     alignment=8)
+
+        config = _get_bigsi_index_config(num_rows, tmp_db.name)
+        large_build(config, [tmp_for_merged.name], [7], ["s%i" % i for i in range(7)])
+
+        storage = get_storage(config)
+        for index in range(num_rows):
+            expected = input_bit_array1[index * 5:(index + 1) * 5] + input_bit_array2[index * 2:(index + 1) * 2]
+            assert storage.get_bitarray(index)[:7] == expected
@@ -1,9 +1,13 @@
 import math
+import pytest
+from contextlib import ExitStack
+from random import Random
 from tempfile import NamedTemporaryFile
 from typing import List
 from bitarray import bitarray
 from hypothesis import given, strategies as st
 
+from bigsi.bloom.aligned_matrix import AlignedBitMatrixFile
 from bigsi.cmds.merge_blooms import merge_blooms
 
 
@@ -44,3 +48,29 @@ def test_merge_blooms_cmd_success(num_rows: int, byte_values1: List[int], byte_v
             resulted_file_content_in_bytes = tmp_for_read_resulted.read()
 
     assert resulted_file_content_in_bytes == expected_file_content_in_bytes
+
+
+@pytest.mark.parametrize("alignment", [1, 8])
+@pytest.mark.parametrize("nproc", [1, 2])
+def test_merge_blooms_cmd_aligned(alignment: int, nproc: int):
+    num_rows = 500
+    num_cols_list = [1, 3, 16]
+    random = Random(alignment + nproc)
+    input_bit_arrays = [bitarray([random.random() < 0.3 for _ in range(num_rows * num_cols)])
+                        for num_cols in num_cols_list]
+
+    with NamedTemporaryFile() as tmp_for_write_result, ExitStack() as stack:
+        tmps = [stack.enter_context(NamedTemporaryFile()) for _ in num_cols_list]
+        for tmp, input_bit_array in zip(tmps, input_bit_arrays):
+            input_bit_array.tofile(tmp)
+            tmp.flush()
+        input_paths = [tmp.name for tmp in tmps]
+        merge_blooms(zip(input_paths, num_cols_list), num_rows, tmp_for_write_result.name, alignment, nproc)
+
+        with AlignedBitMatrixFile(tmp_for_write_result.name) as matrix:
+            assert matrix.row_bytes % alignment == 0
+            for row_index in range(num_rows):
+                expected = bitarray()
+                for input_bit_array, num_cols in zip(input_bit_arrays, num_cols_list):
+                    expected.extend(input_bit_array[row_index * num_cols:(row_index + 1) * num_cols])
+                assert matrix.get_row(row_index) == expected
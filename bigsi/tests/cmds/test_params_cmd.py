@@ -0,0 +1,45 @@
+import math
+import pytest
+from hypothesis import given, strategies as st
+
+from bigsi.cmds.params import bloom_false_positive_rate
+from bigsi.cmds.params import recommend_params
+
+
+def test_recommend_params_matches_param_calculation_script():
+    ## calc_m2 and calc_eta2 in scripts/bigsi-param-calculation.R
+    K_max, q_max, N, L_min, k = 10 ** 7, 10 ** -6, 10 ** 3, 50, 31
+    params = recommend_params([K_max] * N, k, q_max, L_min)
+
+    kmer_L_min = L_min - k + 1
+    ## The script's m assumes a fractional h, so the integer h needs a little more
+    calc_m2 = -(K_max * math.log(q_max / N)) / (kmer_L_min * math.log(2) ** 2)
+    assert calc_m2 <= params["m"] <= 1.05 * calc_m2
+    assert params["h"] in (1, 2)
+    assert params["query_false_discovery_rate"] <= q_max
+    assert params["index_size_bytes"] == math.ceil(params["m"] * N / 8)
+    assert not params["memory_bound"]
+
+
+@given(kmer_counts=st.lists(st.integers(min_value=1, max_value=10 ** 7), min_size=1, max_size=100),
+       k=st.integers(min_value=11, max_value=31),
+       max_false_discovery_rate=st.floats(min_value=10 ** -9, max_value=0.1))
+def test_recommend_params_meets_target(kmer_counts, k, max_false_discovery_rate):
+    params = recommend_params(kmer_counts, k, max_false_discovery_rate)
+
+    assert params["max_kmers"] == max(kmer_counts)
+    assert params["query_false_discovery_rate"] <= max_false_discovery_rate * (1 + 1e-9)
+    assert params["bloom_false_positive_rate"] == bloom_false_positive_rate(
+        params["m"], max(kmer_counts), params["h"])
+
+
+def test_recommend_params_memory_bound():
+    unbounded = recommend_params([10 ** 6] * 10, 31)
+    max_memory = unbounded["index_size_bytes"] // 4
+    params = recommend_params([10 ** 6] * 10, 31, max_memory=max_memory)
+
+    assert params["memory_bound"]
+    assert params["index_size_bytes"] <= max_memory
+    assert params["query_false_discovery_rate"] > unbounded["query_false_discovery_rate"]
+    with pytest.raises(ValueError):
+        recommend_params([], 31)
@@ -5,6 +5,9 @@ from bitarray import bitarray
 from bigsi.tests.base import CONFIGS
 from bigsi import BIGSI
 from bigsi.storage import get_storage
+from bigsi.graph.metadata import DELETED_COLOURS_KEY
+from bigsi.graph.metadata import DELETION_SPECIAL_SAMPLE_NAME
+from bigsi.graph.metadata import SampleMetadata
 from bigsi.utils import seq_to_kmers
 import pytest
 
@@ -49,6 +52,16 @@ def test_insert():
         bigsi.delete()
 
 
+def test_kmer_counts():
+    for config in CONFIGS:
+        get_storage(config).delete_all()
+        bloomfilters = [BIGSI.bloom(config, ["ATC", "ATA"]), BIGSI.bloom(config, ["ATT"])]
+        bigsi = BIGSI.build(config, bloomfilters, ["1", "2"], kmer_counts=[2, None])
+        bigsi.insert(BIGSI.bloom(config, ["ATC"]), "3", kmer_count=1)
+        assert bigsi.kmer_counts() == {"1": 2, "3": 1}
+        bigsi.delete()
+
+
 def test_unique_sample_names():
 
     for config in CONFIGS:
@@ -149,3 +162,185 @@ def test_merge():
     bigsi1.delete()
     bigsi2.delete()
     bigsic.delete()
+
+
+def test_merge_blocked():
+    configs = [dict(config, block_size=8) for config in CONFIGS]
+    for config in configs:
+        get_storage(config).delete_all()
+    config = configs[0]
+    kmers_1 = seq_to_kmers("ATACACAAT", config["k"])
+    kmers_2 = seq_to_kmers("ATACACAAC", config["k"])
+    bloom1 = BIGSI.bloom(config, kmers_1)
+    bloom2 = BIGSI.bloom(config, kmers_2)
+
+    bigsi1 = BIGSI.build(configs[0], [bloom1], ["a"])
+    bigsi2 = BIGSI.build(configs[1], [bloom2], ["b"])
+    bigsic = BIGSI.build(configs[2], [bloom1, bloom2], ["a", "b"])
+
+    bigsi1.merge(bigsi2)
+
+    assert bigsi1.block_size == 8
+    assert bigsi1.search("ATACACAAT", 0.5) == bigsic.search("ATACACAAT", 0.5)
+    bigsi1.insert(bloom1, "c")
+    assert [r["sample_name"] for r in bigsi1.search("ATACACAAT", 1.0)] == ["a", "c"]
+    bigsi1.delete()
+    bigsi2.delete()
+    bigsic.delete()
+
+
+def test_parallel_build():
+    for config in CONFIGS:
+        get_storage(config).delete_all()
+    config = CONFIGS[0]
+    blooms = [
+        BIGSI.bloom(config, seq_to_kmers(seq, config["k"]))
+        for seq in ["ATACACAAT", "ATACACAAC", "GGACACAAT"]
+    ]
+    bigsi1 = BIGSI.build(config, blooms, ["a", "b", "c"])
+    bigsi2 = BIGSI.build(dict(CONFIGS[1], nproc=2), blooms, ["a", "b", "c"])
+    for row in range(config["m"]):
+        assert bigsi1.bitmatrix.get_row(row) == bigsi2.bitmatrix.get_row(row)
+    assert bigsi2.search("ATACACAAT", 1.0) == bigsi1.search("ATACACAAT", 1.0)
+    bigsi1.delete()
+    bigsi2.delete()
+
+
+def test_merge_many():
+    for config in CONFIGS:
+        get_storage(config).delete_all()
+    config = CONFIGS[0]
+    seqs = ["ATACACAAT", "ATACACAAC", "GGACACAAT"]
+    blooms = [BIGSI.bloom(config, seq_to_kmers(seq, config["k"])) for seq in seqs]
+
+    bigsis = [
+        BIGSI.build(c, [bloom], [name])
+        for c, bloom, name in zip(CONFIGS, blooms, ["a", "b", "c"])
+    ]
+    bigsis[0].merge(bigsis[1], bigsis[2])
+
+    assert bigsis[0].num_samples == 3
+    for seq, name in zip(seqs, ["a", "b", "c"]):
+        assert [r["sample_name"] for r in bigsis[0].search(seq, 1.0)] == [name]
+    for bigsi in bigsis:
+        bigsi.delete()
+
+
+def test_insert_many():
+    for config in CONFIGS:
+        get_storage(config).delete_all()
+        bigsi = BIGSI.build(config, [BIGSI.bloom(config, ["ATC", "ATA"])], ["1"])
+        bloomfilters = [
+            BIGSI.bloom(config, ["ATC", "ATT"]),
+            BIGSI.bloom(config, ["ATT"]),
+            BIGSI.bloom(config, ["ATA", "ATT"]),
+        ]
+        bigsi.insert_many(bloomfilters, ["2", "3", "4"], kmer_counts=[2, 1, None])
+        assert bigsi.num_samples == 4
+        assert bigsi.lookup(["ATC", "ATA", "ATT"]) == {
+            "ATC": bitarray("1100"),
+            "ATA": bitarray("1001"),
+            "ATT": bitarray("0111"),
+        }
+        assert bigsi.colour_to_sample(3) == "4"
+        assert bigsi.kmer_counts() == {"2": 2, "3": 1}
+        with pytest.raises(ValueError):
+            bigsi.insert_many(bloomfilters[:2], ["5", "1"])
+        assert bigsi.num_samples == 4
+        bigsi.delete()
+
+
+def test_sample_blocks():
+    configs = [dict(config, sample_block_size=2) for config in CONFIGS]
+    for config in configs:
+        get_storage(config).delete_all()
+    config = configs[0]
+    seqs = ["ATACACAAT", "ATACACAAC", "GGACACAAT", "TTTCACAAG", "CCCAGGTTA"]
+    blooms = [BIGSI.bloom(config, seq_to_kmers(seq, config["k"])) for seq in seqs]
+    names = ["a", "b", "c", "d", "e"]
+
+    bigsi = BIGSI.build(config, blooms[:3], names[:3])
+    bigsi.insert_many(blooms[3:], names[3:])
+    assert len(bigsi.bitmatrix.sample_blocks) == 3
+    for seq, name in zip(seqs, names):
+        assert [r["sample_name"] for r in bigsi.search(seq, 1.0)] == [name]
+
+    ## Merged indexes of the plain layout are appended to the newest sample blocks
+    unblocked = BIGSI.build(CONFIGS[1], blooms[:2], ["f", "g"])
+    bigsi.merge(unblocked)
+    assert bigsi.num_samples == 7
+    assert [r["sample_name"] for r in bigsi.search(seqs[1], 1.0)] == ["b", "g"]
+    bigsi.delete()
+    unblocked.delete()
+
+
+@pytest.mark.parametrize("layout", [{}, {"block_size": 8}, {"sample_block_size": 2}])
+def test_delete_and_compact(layout):
+    configs = [dict(config, **layout) for config in CONFIGS]
+    for config in configs:
+        get_storage(config).delete_all()
+    config = configs[0]
+    seqs = ["ATACACAAT", "ATACACAAT", "GGACACAAT", "ATACACAAT"]
+    blooms = [BIGSI.bloom(config, seq_to_kmers(seq, config["k"])) for seq in seqs]
+    bigsi = BIGSI.build(config, blooms, ["a", "b", "c", "d"])
+    ## A long lived index, e.g. of a search server, sees samples deleted by another
+    server = BIGSI(config)
+    assert [r["sample_name"] for r in server.search("ATACACAAT", 1.0)] == ["a", "b", "d"]
+    bigsi.delete_sample("b")
+
+    assert [r["sample_name"] for r in server.search("ATACACAAT", 1.0)] == ["a", "d"]
+    assert [r["sample_name"] for r in bigsi.search("ATACACAAT", 1.0)] == ["a", "d"]
+    assert sorted(r["sample_name"] for r in bigsi.search("ATACACAAT", 0.5)) == [
+        "a",
+        "c",
+        "d",
+    ]
+    assert bigsi.compact() == 1
+    assert bigsi.num_samples == 3
+    assert bigsi.bitmatrix.num_cols == 3
+    assert [r["sample_name"] for r in bigsi.search("ATACACAAT", 1.0)] == ["a", "d"]
+    assert bigsi.sample_to_colour("d") == 2
+    assert bigsi.compact() == 0
+    bigsi.delete()
+
+
+def test_samples_deleted_before_the_deletion_bitmask():
+    ## Samples used to be deleted by renaming their colour only
+    config = CONFIGS[0]
+    get_storage(config).delete_all()
+    seqs = ["ATACACAAT", "ATACACAAT", "GGACACAAT"]
+    blooms = [BIGSI.bloom(config, seq_to_kmers(seq, config["k"])) for seq in seqs]
+    bigsi = BIGSI.build(config, blooms, ["a", "b", "c"])
+    sm = SampleMetadata(bigsi.storage)
+    sm._set_colour_sample(1, DELETION_SPECIAL_SAMPLE_NAME)
+    sm._set_sample_colour("b", -1)
+    key = sm._add_key_prefix(DELETED_COLOURS_KEY)
+    assert bigsi.storage.get(key) is None
+
+    bigsi = BIGSI(config)
+    assert [r["sample_name"] for r in bigsi.search("ATACACAAT", 1.0)] == ["a"]
+    assert [r["sample_name"] for r in bigsi.search("ATACACAAT", 0.5)] == ["a", "c"]
+    ## The bitmask is stored once it has been built from the names
+    assert bigsi.storage.get_bitarray(key)[:3].tolist() == [False, True, False]
+    assert bigsi.compact() == 1
+    assert bigsi.colours_to_samples(range(2)) == {0: "a", 1: "c"}
+    bigsi.delete()
+
+
+def test_row_cache():
+    for config in CONFIGS:
+        config = dict(config, row_cache_bytes="1MB")
+        get_storage(config).delete_all()
+        bloom = BIGSI.bloom(config, ["ATC", "ATA"])
+        bigsi = BIGSI.build(config, [bloom], ["1"])
+        assert bigsi.lookup("ATC") == {"ATC": bitarray("1")}
+        misses = bigsi.row_cache_stats()["misses"]
+        ## A new BIGSI, as made per request, shares the rows cached by the first
+        bigsi = BIGSI(config)
+        assert bigsi.lookup("ATC") == {"ATC": bitarray("1")}
+        stats = bigsi.row_cache_stats()
+        assert stats["misses"] == misses
+        assert stats["hits"] > 0
+        bigsi.insert(BIGSI.bloom(config, ["ATC"]), "2")
+        assert bigsi.lookup("ATC") == {"ATC": bitarray("11")}
+        bigsi.delete()
@@ -1,9 +1,14 @@
+import itertools
 from bigsi.matrix import BitMatrix
 from bigsi.bloom import BloomFilter
 from bigsi.graph.index import KmerSignatureIndex
 from bitarray import bitarray
 import pytest
+from unittest.mock import patch
 from bigsi.utils import convert_query_kmers
+from bigsi.utils.kmers import canonical_codes
+from bigsi.utils.kmers import kmers_to_codes
+from bigsi.utils.kernels import words_to_bitarray
 from bigsi.tests.base import get_test_storages
 
 
@@ -136,3 +141,157 @@ def test_merge():
             "ATT": bitarray("10" * 2),
             "TTT": bitarray("01" * 2),
         }
+
+
+def test_merge_batched():
+    bloomfilter_size = 250
+    number_hash_functions = 1
+    kmers1 = ["ATC", "ATG", "ATA", "ATT"]
+    kmers2 = ["ATC", "ATG", "ATA", "TTT"]
+    bloomfilter1 = BloomFilter(bloomfilter_size, number_hash_functions).update(
+        convert_query_kmers(kmers1)
+    )
+    bloomfilter2 = BloomFilter(bloomfilter_size, number_hash_functions).update(
+        convert_query_kmers(kmers2)
+    )
+    for storage in get_storages():
+        storage.delete_all()
+        ksi1 = KmerSignatureIndex.create(
+            storage, [bloomfilter1], bloomfilter_size, number_hash_functions
+        )
+        ksi2 = KmerSignatureIndex.create(
+            storage, [bloomfilter2], bloomfilter_size, number_hash_functions
+        )
+        ## Both indexes share the storage, so it's read twice per batch. Each batch also
+        ## updates the row popcounts, which are read and written once.
+        with patch.object(storage, "batch_set", wraps=storage.batch_set) as batch_set:
+            with patch.object(storage, "batch_get", wraps=storage.batch_get) as batch_get:
+                ksi1.merge_indexes(ksi2, batch_rows=100)
+        assert batch_set.call_count == 3 * 2
+        assert batch_get.call_count == 6 + 3
+        assert ksi1.bitmatrix.num_cols == 2
+
+
+def test_lookup_double_hashing():
+    bloomfilter_size = 250
+    number_hash_functions = 3
+    kmers1 = ["ATC", "ATG", "ATA", "ATT"]
+    kmers2 = ["ATC", "ATG", "ATA", "TTT"]
+    bloomfilter1 = BloomFilter(
+        bloomfilter_size, number_hash_functions, double_hashing=True
+    ).update(convert_query_kmers(kmers1))
+    bloomfilter2 = BloomFilter(
+        bloomfilter_size, number_hash_functions, double_hashing=True
+    ).update(convert_query_kmers(kmers2))
+    bloomfilters = [bloomfilter1, bloomfilter2]
+    for storage in get_storages():
+        storage.delete_all()
+        ksi = KmerSignatureIndex.create(
+            storage,
+            bloomfilters,
+            bloomfilter_size,
+            number_hash_functions,
+            double_hashing=True,
+        )
+
+        assert ksi.double_hashing
+        assert ksi.lookup(["ATC", "ATC", "ATT", "TTT"]) == {
+            "ATC": bitarray("11"),
+            "ATT": bitarray("10"),
+            "TTT": bitarray("01"),
+        }
+
+
+def test_lookup_blocked():
+    bloomfilter_size = 256
+    number_hash_functions = 3
+    block_size = 16
+    kmers1 = ["ATC", "ATG", "ATA", "ATT"]
+    kmers2 = ["ATC", "ATG", "ATA", "TTT"]
+    bloomfilter1 = BloomFilter(
+        bloomfilter_size, number_hash_functions, block_size=block_size
+    ).update(convert_query_kmers(kmers1))
+    bloomfilter2 = BloomFilter(
+        bloomfilter_size, number_hash_functions, block_size=block_size
+    ).update(convert_query_kmers(kmers2))
+    bloomfilters = [bloomfilter1, bloomfilter2]
+    for storage in get_storages():
+        storage.delete_all()
+        ksi = KmerSignatureIndex.create(
+            storage,
+            bloomfilters,
+            bloomfilter_size,
+            number_hash_functions,
+            block_size=block_size,
+        )
+
+        assert ksi.block_size == block_size
+        assert ksi.bitmatrix.rows_per_block == block_size
+        assert ksi.lookup(["ATC", "ATC", "ATT", "TTT"]) == {
+            "ATC": bitarray("11"),
+            "ATT": bitarray("10"),
+            "TTT": bitarray("01"),
+        }
+        ## One block read per kmer
+        with patch.object(storage, "batch_get", wraps=storage.batch_get) as batch_get:
+            ksi.lookup(["ATT"])
+        assert batch_get.call_count == 1
+        assert len(batch_get.call_args[0][0]) == 1
+
+
+def test_lookup_kmer_codes():
+    bloomfilter_size = 250
+    number_hash_functions = 3
+    kmers1 = ["ATC", "ATG", "ATA", "ATT"]
+    kmers2 = ["ATC", "ATG", "ATA", "TTT"]
+    bloomfilter1 = BloomFilter(bloomfilter_size, number_hash_functions).update(
+        convert_query_kmers(kmers1)
+    )
+    bloomfilter2 = BloomFilter(bloomfilter_size, number_hash_functions).update_kmer_codes(
+        canonical_codes(kmers_to_codes(kmers2), 3), 3
+    )
+    bloomfilters = [bloomfilter1, bloomfilter2]
+    for storage in get_storages():
+        storage.delete_all()
+        ksi = KmerSignatureIndex.create(
+            storage, bloomfilters, bloomfilter_size, number_hash_functions
+        )
+
+        codes = kmers_to_codes(["ATC", "ATC", "ATT", "TTT"])
+        with pytest.raises(ValueError):
+            ksi.lookup(codes)
+        assert ksi.lookup(codes, kmer_size=3) == {
+            codes[0]: bitarray("11"),
+            codes[2]: bitarray("10"),
+            codes[3]: bitarray("01"),
+        }
+
+
+def test_exact_lookup_reads_sparsest_rows_first():
+    bloomfilter_size = 1000
+    number_hash_functions = 3
+    kmers = ["".join(kmer) for kmer in itertools.product("ACGT", repeat=3)][:20]
+    bloomfilter1 = BloomFilter(bloomfilter_size, number_hash_functions).update(
+        convert_query_kmers(kmers)
+    )
+    bloomfilter2 = BloomFilter(bloomfilter_size, number_hash_functions).update(
+        convert_query_kmers(kmers[:10])
+    )
+    for storage in get_storages():
+        storage.delete_all()
+        ksi = KmerSignatureIndex.create(
+            storage, [bloomfilter1, bloomfilter2], bloomfilter_size, number_hash_functions
+        )
+        popcounts = ksi.bitmatrix.get_popcounts(range(bloomfilter_size))
+        with patch.object(ksi.bitmatrix, "get_rows", wraps=ksi.bitmatrix.get_rows) as get_rows:
+            colours = ksi.exact_lookup(kmers)
+        assert words_to_bitarray(colours, 2) == bitarray("10")
+        rows_read = [row for call in get_rows.call_args_list for row in call[0][0]]
+        assert [popcounts[row] for row in rows_read] == sorted(popcounts[rows_read])
+        assert [len(call[0][0]) for call in get_rows.call_args_list][:2] == [8, 16]
+
+        ## A kmer in neither sample has an empty row, which is read first
+        with patch.object(ksi.bitmatrix, "get_rows", wraps=ksi.bitmatrix.get_rows) as get_rows:
+            colours = ksi.exact_lookup(kmers + ["GGG"])
+        assert words_to_bitarray(colours, 2) == bitarray("00")
+        assert get_rows.call_count == 1
@@ -52,6 +52,14 @@ def test_delete_sample():
     assert sm.samples_to_colours([sample_name1, sample_name2]) == {sample_name2: 1}
     assert sm.colours_to_samples([0, 1]) == {0: "D3L3T3D", 1: sample_name2}
 
+    ## Samples which don't exist, or are already deleted, are left alone
+    for sample_name in [sample_name1, "missing"]:
+        with pytest.raises(ValueError):
+            sm.delete_sample(sample_name)
+        assert sm.sample_name_exists(sample_name) == (sample_name == sample_name1)
+    assert sm.colours_to_samples([0, 1]) == {0: "D3L3T3D", 1: sample_name2}
+    assert sm.deleted_colours.tolist() == [True, False]
+
 
 def test_unique_sample_names():
     for storage in get_storages():
@@ -61,3 +69,95 @@ def test_unique_sample_names():
         colour = sm.add_sample(sample_name)
         with pytest.raises(ValueError):
             sm.add_sample(sample_name)
+
+
+def test_sample_kmer_counts():
+    for storage in get_storages():
+        storage.delete_all()
+        sm = SampleMetadata(storage=storage)
+        sm.add_samples(["s1", "s2", "s3"])
+        sm.set_sample_kmer_count("s1", 1000)
+        sm.set_sample_kmer_count("s3", 3000)
+
+        assert sm.sample_kmer_count("s1") == 1000
+        assert sm.sample_kmer_count("s2") is None
+        assert sm.kmer_counts() == {"s1": 1000, "s3": 3000}
+
+        sm.delete_sample("s1")
+        assert sm.kmer_counts() == {"s3": 3000}
+
+
+def test_merge_metadata():
+    storages = get_storages()
+    for storage in storages:
+        storage.delete_all()
+    sm, sm1, sm2 = [SampleMetadata(storage=storage) for storage in storages[:3]]
+    sm.add_samples(["a", "b"])
+    sm1.add_samples(["c", "a"])
+    sm1.set_sample_kmer_count("c", 10)
+    sm2.add_samples(["d", "c"])
+    sm2.set_sample_kmer_count("c", 20)
+
+    sm.merge_metadata(sm1, sm2)
+    assert sm.num_samples == 6
+    assert sm.colours_to_samples(range(6)) == {
+        0: "a",
+        1: "b",
+        2: "c",
+        3: "a_duplicate_in_merge",
+        4: "d",
+        5: "c_duplicate_in_merge",
+    }
+    assert sm.sample_to_colour("d") == 4
+    assert sm.kmer_counts() == {"c": 10, "c_duplicate_in_merge": 20}
+    for storage in storages:
+        storage.delete_all()
+
+
+def test_compact_metadata():
+    for storage in get_storages():
+        storage.delete_all()
+        sm = SampleMetadata(storage=storage)
+        sm.add_samples(["a", "b", "c", "d"])
+        sm.set_sample_kmer_count("c", 3)
+        sm.delete_sample("b")
+        assert sm.deleted_colours.tolist() == [False, True, False, False]
+        ## The deletion bitmask is stored, and padded for samples added later
+        sm = SampleMetadata(storage=storage)
+        sm.add_sample("e")
+        assert sm.deleted_colours.tolist() == [False, True, False, False, False]
+
+        assert sm.compact_metadata() == [0, 2, 3, 4]
+        assert sm.num_samples == 4
+        assert sm.colours_to_samples(range(4)) == {0: "a", 1: "c", 2: "d", 3: "e"}
+        assert sm.sample_to_colour("e") == 3
+        assert sm.sample_to_colour("b") is None
+        assert not sm.deleted_colours.any()
+        assert sm.kmer_counts() == {"c": 3}
+
+
+def test_deleted_colours_written_by_another_instance():
+    for storage in get_storages():
+        storage.delete_all()
+        reader = SampleMetadata(storage=storage)
+        writer = SampleMetadata(storage=storage)
+        writer.add_samples(["a", "b", "c"])
+        assert not reader.deleted_colours.any()
+        writer.delete_sample("b")
+        assert reader.deleted_colours.tolist() == [False, True, False]
+        writer.compact_metadata()
+        assert reader.deleted_colours.tolist() == [False, False]
+
+
+def test_kmer_counts_do_not_collide_with_sample_names():
+    for storage in get_storages():
+        storage.delete_all()
+        sm = SampleMetadata(storage=storage)
+        sm.add_sample("foo")
+        sm.set_sample_kmer_count("foo", 10)
+        sm.add_sample("kmer_count:foo")
+        assert sm.sample_to_colour("kmer_count:foo") == 1
+        assert sm.sample_kmer_count("foo") == 10
+        assert sm.sample_kmer_count("kmer_count:foo") is None
+        sm.set_sample_kmer_count("kmer_count:foo", 20)
+        assert sm.kmer_counts() == {"foo": 10, "kmer_count:foo": 20}
@@ -13,7 +13,8 @@ def get_storages():
     return get_test_storages()
 
 
-def test_get_set():
+@pytest.mark.parametrize("rows_per_block", [0, 4, 7])
+def test_get_set(rows_per_block):
     rows = [
         bitarray("001"),
         bitarray("001"),
@@ -23,7 +24,7 @@ def test_get_set():
     ] * 5
     for storage in get_storages():
         storage.delete_all()
-        bm = BitMatrix.create(storage, rows, len(rows), len(rows[0]))
+        bm = BitMatrix.create(storage, rows, len(rows), len(rows[0]), rows_per_block)
         bm.set_rows(range(25), rows)
         assert list(bm.get_rows(range(3))) == rows[:3]
         assert bm.get_column(0) == bitarray("00101" * 5)
@@ -34,7 +35,8 @@ def test_get_set():
         ]
 
 
-def test_get_insert_column():
+@pytest.mark.parametrize("rows_per_block", [0, 4, 7])
+def test_get_insert_column(rows_per_block):
     rows = [
         bitarray("001"),
         bitarray("001"),
@@ -44,7 +46,7 @@ def test_get_insert_column():
     ] * 5
     for storage in get_storages():
         storage.delete_all()
-        bm = BitMatrix.create(storage, rows, len(rows), len(rows[0]))
+        bm = BitMatrix.create(storage, rows, len(rows), len(rows[0]), rows_per_block)
         assert bm.get_column(0) == bitarray("00101" * 5)
         bm.insert_column(bitarray("1" * 25), 0)
         assert bm.get_column(0) == bitarray("1" * 25)
@@ -53,3 +55,48 @@ def test_get_insert_column():
         bm.insert_column(bitarray("1" * 25), 3)
         assert bm.get_column(3) == bitarray("1" * 25)
         assert bm.get_row(1) == bitarray("1011")
+
+
+@pytest.mark.parametrize("rows_per_block", [0, 4, 7])
+def test_insert_columns(rows_per_block):
+    rows = [bitarray("001"), bitarray("010"), bitarray("111")] * 5
+    new_rows = [bitarray("10"), bitarray("01")] * 7 + [bitarray("11")]
+    for storage in get_storages():
+        storage.delete_all()
+        bm = BitMatrix.create(storage, rows, len(rows), len(rows[0]), rows_per_block)
+        bm.insert_columns(new_rows, 3, 2, batch_rows=4)
+        assert bm.num_cols == 5
+        assert list(bm.get_rows(range(len(rows)))) == [
+            row + new_row for row, new_row in zip(rows, new_rows)
+        ]
+
+
+@pytest.mark.parametrize("rows_per_block", [0, 4, 7])
+def test_delete_columns(rows_per_block):
+    rows = [bitarray("00101"), bitarray("01011"), bitarray("11100")] * 5
+    for storage in get_storages():
+        storage.delete_all()
+        bm = BitMatrix.create(storage, rows, len(rows), len(rows[0]), rows_per_block)
+        bm.delete_columns(bitarray("10010"), batch_rows=4)
+        assert bm.num_cols == 3
+        assert list(bm.get_rows(range(len(rows)))) == [
+            row[1:3] + row[4:] for row in rows
+        ]
+
+
+@pytest.mark.parametrize("rows_per_block", [0, 4, 7])
+def test_set_some_rows(rows_per_block):
+    rows = [bitarray("001"), bitarray("010"), bitarray("111")] * 5
+    for storage in get_storages():
+        storage.delete_all()
+        bm = BitMatrix.create(storage, rows, len(rows), len(rows[0]), rows_per_block)
+        bm.set_rows([1, 9, 14], [bitarray("100")] * 3)
+        bm.set_row(2, bitarray("000"))
+
+        expected = list(rows)
+        expected[1] = expected[9] = expected[14] = bitarray("100")
+        expected[2] = bitarray("000")
+        assert list(bm.get_rows(range(len(rows)))) == expected
+        assert list(bm.get_rows([14, 0, 9])) == [expected[14], expected[0], expected[9]]
+        assert bm.get_row(2) == bitarray("000")
+        assert BitMatrix(storage).rows_per_block == rows_per_block
@@ -0,0 +1,113 @@
+"""
+Partitioned bit matrices split their columns into sample blocks
+"""
+from bigsi.matrix import BitMatrix
+from bigsi.matrix import PartitionedBitMatrix
+from bigsi.matrix.partitioned import ThreadPoolExecutor
+from bigsi.matrix.partitioned import is_partitioned
+from bitarray import bitarray
+from unittest.mock import patch
+import pytest
+
+
+from bigsi.tests.base import get_test_storages
+
+
+def get_storages():
+    return get_test_storages()
+
+
+@pytest.mark.parametrize("rows_per_block", [0, 4])
+def test_insert_get(rows_per_block):
+    rows = [bitarray("001"), bitarray("010"), bitarray("111")] * 5
+    for storage in get_storages():
+        storage.delete_all()
+        bm = PartitionedBitMatrix.create(storage, len(rows), 2, rows_per_block)
+        assert is_partitioned(storage)
+        assert bm.column_ranges(0, 3) == [(0, 2), (2, 3)]
+        for start, stop in bm.column_ranges(0, 3):
+            bm.insert_columns((row[start:stop] for row in rows), start, stop - start)
+        assert bm.num_cols == 3
+        assert len(bm.sample_blocks) == 2
+        assert list(bm.get_rows(range(len(rows)))) == rows
+        assert bm.get_column(2) == bitarray("101" * 5)
+
+        ## New columns only rewrite the newest sample block
+        with patch.object(storage, "batch_set", wraps=storage.batch_set) as batch_set:
+            bm.insert_column(bitarray("1" * 15), 3)
+        for call in batch_set.call_args_list:
+            assert all(key.startswith(b"sample_block1:") for key in call[0][0])
+
+        bm = PartitionedBitMatrix(storage)
+        assert bm.num_cols == 4
+        assert bm.get_row(1) == bitarray("0101")
+        with pytest.raises(ValueError):
+            bm.insert_columns(rows, 3, 2)
+
+
+def test_parallel_sample_blocks():
+    rows = [bitarray("0011"), bitarray("0101")]
+    for storage in get_storages():
+        storage.delete_all()
+        bm = PartitionedBitMatrix.create(storage, len(rows), 1)
+        for i in range(4):
+            bm.insert_columns((row[i : i + 1] for row in rows), i, 1)
+        with patch.object(type(storage), "thread_safe_reads", True), patch(
+            "bigsi.matrix.partitioned.MAX_SAMPLE_BLOCK_THREADS", 2
+        ), patch(
+            "bigsi.matrix.partitioned.ThreadPoolExecutor", wraps=ThreadPoolExecutor
+        ) as executor:
+            assert list(bm.get_rows([0, 1])) == rows
+        assert executor.call_args[1] == {"max_workers": 2}
+
+
+def test_delete_columns():
+    rows = [bitarray("0010110"), bitarray("0101101")] * 3
+    for storage in get_storages():
+        storage.delete_all()
+        bm = PartitionedBitMatrix.create(storage, len(rows), 3)
+        for start, stop in bm.column_ranges(0, 7):
+            bm.insert_columns((row[start:stop] for row in rows), start, stop - start)
+        bm.delete_columns(bitarray("1100100"), batch_rows=4)
+        bm = PartitionedBitMatrix(storage)
+        assert [sample_block.num_cols for sample_block in bm.sample_blocks] == [3, 1]
+        assert list(bm.get_rows(range(len(rows)))) == [
+            row[2:4] + row[5:] for row in rows
+        ]
+
+
+@pytest.mark.parametrize("rows_per_block", [0, 2])
+def test_delete_columns_rewrites_only_later_sample_blocks(rows_per_block):
+    rows = [bitarray("001011"), bitarray("010110"), bitarray("111000")]
+    for storage in get_storages():
+        storage.delete_all()
+        bm = PartitionedBitMatrix.create(storage, len(rows), 2, rows_per_block)
+        for start, stop in bm.column_ranges(0, 6):
+            bm.insert_columns((row[start:stop] for row in rows), start, stop - start)
+        with patch.object(storage, "batch_set", wraps=storage.batch_set) as batch_set:
+            bm.delete_columns(bitarray("000101"))
+        for call in batch_set.call_args_list:
+            assert not any(key.startswith(b"sample_block0:") for key in call[0][0])
+        bm = PartitionedBitMatrix(storage)
+        assert [sample_block.num_cols for sample_block in bm.sample_blocks] == [2, 2]
+        assert list(bm.get_rows(range(len(rows)))) == [
+            row[:3] + row[4:5] for row in rows
+        ]
+        ## The keys of the dropped sample block are deleted
+        with pytest.raises(KeyError):
+            BitMatrix(storage, "sample_block2:")
+        with pytest.raises(KeyError):
+            storage.get_string("sample_block2:rows_version")
+        with pytest.raises(KeyError):
+            storage.get_integer("sample_block2:popcount_block_rows")
+        assert storage.get(b"sample_block2:0:popcounts") is None
+        if rows_per_block:
+            assert storage.get(b"sample_block2:0:block") is None
+        else:
+            with pytest.raises(KeyError):
+                storage.get_bitarray("sample_block2:0")
+
+        ## Deleting no columns changes nothing
+        with patch.object(storage, "batch_set", wraps=storage.batch_set) as batch_set:
+            bm.delete_columns(bitarray("0000"))
+        assert batch_set.call_count == 0
@@ -0,0 +1,128 @@
+from unittest.mock import patch
+from bitarray import bitarray
+import pytest
+
+from bigsi.matrix import BitMatrix
+from bigsi.matrix import PartitionedBitMatrix
+from bigsi.matrix.popcounts import POPCOUNT_BLOCK_ROWS
+from bigsi.matrix.popcounts import PopcountWriter
+from bigsi.matrix.popcounts import create_popcounts
+from bigsi.matrix.popcounts import has_popcounts
+from bigsi.matrix.popcounts import load_popcounts
+from bigsi.matrix.popcounts import set_popcounts
+from bigsi.tests.base import get_test_storages
+
+
+def test_set_popcounts_across_blocks():
+    num_rows = POPCOUNT_BLOCK_ROWS + 10
+    for storage in get_test_storages():
+        storage.delete_all()
+        assert not has_popcounts(storage)
+        create_popcounts(storage, num_rows)
+        assert has_popcounts(storage)
+        set_popcounts(storage, [0, 1, 2], [1, 2, 3])
+        set_popcounts(storage, [2, POPCOUNT_BLOCK_ROWS + 9], [7, 8])
+        popcounts = load_popcounts(storage, range(num_rows))
+        assert len(popcounts) == num_rows
+        assert popcounts[:4].tolist() == [1, 2, 7, 0]
+        assert popcounts[-1] == 8
+        assert popcounts.sum() == 18
+
+
+def test_load_popcounts_once_per_version():
+    for storage in get_test_storages():
+        storage.delete_all()
+        create_popcounts(storage, 3)
+        set_popcounts(storage, [0, 1, 2], [1, 2, 3])
+        assert load_popcounts(storage, [2, 0], rows_version="test-v1").tolist() == [3, 1]
+        with patch.object(storage, "batch_get", side_effect=AssertionError("storage read")):
+            assert load_popcounts(storage, [0, 2, 1], rows_version="test-v1").tolist() == [1, 3, 2]
+        set_popcounts(storage, [0], [5])
+        assert load_popcounts(storage, [0, 1, 2], rows_version="test-v2").tolist() == [5, 2, 3]
+
+
+def test_load_popcounts_reads_only_blocks_of_rows():
+    num_rows = 3 * POPCOUNT_BLOCK_ROWS
+    for i, storage in enumerate(get_test_storages()):
+        rows_version = "test-blocks-%i" % i
+        storage.delete_all()
+        create_popcounts(storage, num_rows)
+        set_popcounts(storage, [1, 2 * POPCOUNT_BLOCK_ROWS + 1], [4, 6])
+        with patch.object(storage, "batch_get", wraps=storage.batch_get) as batch_get:
+            popcounts = load_popcounts(
+                storage, [2 * POPCOUNT_BLOCK_ROWS + 1, 1, 0], rows_version=rows_version
+            )
+            assert popcounts.tolist() == [6, 4, 0]
+            assert [len(call[0][0]) for call in batch_get.call_args_list] == [2]
+            ## Only the block not loaded yet is read
+            load_popcounts(storage, [1, POPCOUNT_BLOCK_ROWS], rows_version=rows_version)
+            assert [len(call[0][0]) for call in batch_get.call_args_list] == [2, 1]
+        assert load_popcounts(storage, []).tolist() == []
+
+
+@pytest.mark.parametrize("rows_per_block", [0, 2])
+def test_bitmatrix_popcounts(rows_per_block):
+    rows = [bitarray("001"), bitarray("011"), bitarray("111"), bitarray("000"), bitarray("010")]
+    for storage in get_test_storages():
+        storage.delete_all()
+        bm = BitMatrix.create(storage, iter(rows), len(rows), 3, rows_per_block)
+        assert bm.get_popcounts(range(5)).tolist() == [1, 2, 3, 0, 1]
+        bm.set_rows([0, 3], [bitarray("111"), bitarray("100")])
+        assert bm.get_popcounts(range(5)).tolist() == [3, 2, 3, 1, 1]
+        bm.insert_column(bitarray("10101"), 3)
+        assert bm.get_popcounts(range(5)).tolist() == [4, 2, 4, 1, 2]
+        bm.delete_columns(bitarray("1000"))
+        assert bm.get_popcounts(range(5)).tolist() == [3, 2, 3, 0, 2]
+        assert BitMatrix(storage).get_popcounts(range(5)).tolist() == [3, 2, 3, 0, 2]
+
+
+def test_bitmatrix_without_popcounts():
+    ## Matrices stored before popcounts were kept
+    for storage in get_test_storages():
+        storage.delete_all()
+        with patch("bigsi.matrix.bitmatrix.PopcountWriter.close"):
+            bm = BitMatrix.create(storage, [bitarray("01"), bitarray("11")], 2, 2)
+        assert bm.get_popcounts(range(5)) is None
+        bm.set_row(0, bitarray("11"))
+        assert not has_popcounts(storage)
+        assert bm.get_popcounts(range(5)) is None
+
+
+def test_partitioned_bitmatrix_popcounts():
+    for storage in get_test_storages():
+        storage.delete_all()
+        pbm = PartitionedBitMatrix.create(storage, 3, 2)
+        pbm.insert_columns([bitarray("11"), bitarray("01"), bitarray("00")], 0, 2)
+        pbm.insert_columns([bitarray("1"), bitarray("1"), bitarray("0")], 2, 1)
+        assert pbm.get_popcounts(range(3)).tolist() == [3, 2, 0]
+        pbm.set_row(2, bitarray("101"))
+        assert PartitionedBitMatrix(storage).get_popcounts([0, 1, 2]).tolist() == [3, 2, 2]
+
+
+def test_popcount_writer_writes_blocks_as_rows_are_counted():
+    num_rows = 2 * POPCOUNT_BLOCK_ROWS + 1
+    for storage in get_test_storages():
+        storage.delete_all()
+        popcounts = PopcountWriter(storage, num_rows)
+        with patch.object(storage, "batch_set", wraps=storage.batch_set) as batch_set:
+            rows = popcounts.count(bitarray("1" * (i % 3)) for i in range(POPCOUNT_BLOCK_ROWS + 1))
+            assert len(list(rows)) == POPCOUNT_BLOCK_ROWS + 1
+            assert batch_set.call_count == 1
+            popcounts.close()
+            assert batch_set.call_count == 3
+        loaded = load_popcounts(storage, range(num_rows))
+        assert loaded[: POPCOUNT_BLOCK_ROWS + 1].tolist() == [
+            i % 3 for i in range(POPCOUNT_BLOCK_ROWS + 1)
+        ]
+        assert not loaded[POPCOUNT_BLOCK_ROWS + 1 :].any()
+
+
+def test_popcounts_written_in_batched_writes_are_not_stale():
+    rows = [bitarray("001"), bitarray("011"), bitarray("111")]
+    for storage in get_test_storages():
+        storage.delete_all()
+        bm = BitMatrix.create(storage, iter(rows), len(rows), 3)
+        assert bm.get_popcounts([0, 1, 2]).tolist() == [1, 2, 3]
+        with bm.batched_writes():
+            bm.set_rows([0], [bitarray("111")])
+            assert bm.get_popcounts([0, 1, 2]).tolist() == [3, 2, 3]
@@ -0,0 +1,160 @@
+from unittest.mock import patch
+from bitarray import bitarray
+import pytest
+
+from bigsi.matrix import BitMatrix
+from bigsi.matrix import PartitionedBitMatrix
+from bigsi.matrix.row_cache import ROW_OVERHEAD
+from bigsi.matrix.row_cache import RowCache
+from bigsi.matrix.row_cache import get_row_cache
+from bigsi.tests.base import get_test_storages
+
+ROW_SIZE = 1 + ROW_OVERHEAD
+
+
+def _row(i):
+    return bitarray(format(i % 256, "08b"))
+
+
+def test_row_cache_counts_hits_and_misses():
+    cache = RowCache(10 * ROW_SIZE)
+    assert cache.get_many(["a", "b"]) == [None, None]
+    cache.put_many(["a"], [_row(1)])
+    assert cache.get_many(["a", "b"]) == [_row(1), None]
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 3,
+        "evictions": 0,
+        "rows": 1,
+        "bytes": ROW_SIZE,
+        "max_bytes": 10 * ROW_SIZE,
+    }
+
+
+def test_row_cache_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        RowCache(100, policy="fifo")
+
+
+@pytest.mark.parametrize("policy", ["lru", "slru"])
+def test_row_cache_evicts_least_recently_used(policy):
+    cache = RowCache(3 * ROW_SIZE, policy)
+    cache.put_many([0, 1, 2], [_row(0), _row(1), _row(2)])
+    cache.get_many([0])
+    cache.put_many([3], [_row(3)])
+    assert cache.get_many([0, 1, 2, 3]) == [_row(0), None, _row(2), _row(3)]
+    assert cache.evictions == 1
+    assert cache.num_bytes <= cache.max_bytes
+
+
+def test_slru_keeps_hot_rows_through_a_scan():
+    cache = RowCache(10 * ROW_SIZE, "slru")
+    hot = list(range(5))
+    cache.put_many(hot, [_row(i) for i in hot])
+    cache.get_many(hot)
+    ## A scan of many rows seen once only churns the probation segment
+    for i in range(100, 200):
+        cache.put_many([i], [_row(i)])
+    assert None not in cache.get_many(hot)
+
+    lru = RowCache(10 * ROW_SIZE, "lru")
+    lru.put_many(hot, [_row(i) for i in hot])
+    lru.get_many(hot)
+    for i in range(100, 200):
+        lru.put_many([i], [_row(i)])
+    assert lru.get_many(hot) == [None] * 5
+
+
+def test_get_row_cache_is_shared_per_name():
+    assert get_row_cache("test-index", 1000) is get_row_cache("test-index", 1000)
+    assert get_row_cache("test-index", 1000) is not get_row_cache("other-index", 1000)
+
+
+@pytest.mark.parametrize("rows_per_block", [0, 4])
+def test_bitmatrix_row_cache(rows_per_block):
+    rows = [bitarray("001"), bitarray("011"), bitarray("111")] * 4
+    for storage in get_test_storages():
+        storage.delete_all()
+        cache = RowCache(10 ** 6)
+        bm = BitMatrix.create(storage, rows, len(rows), 3, rows_per_block, row_cache=cache)
+        assert list(bm.get_rows(range(6))) == rows[:6]
+        assert cache.misses == 6
+        with patch.object(storage, "batch_get", side_effect=AssertionError("storage read")):
+            assert list(bm.get_rows(range(6))) == rows[:6]
+        assert cache.hits == 6
+
+        ## Rows handed out can be changed without changing the cache
+        row = next(bm.get_rows([0], remove_trailing_zeros=False))
+        row.setall(True)
+        assert list(bm.get_rows([0])) == rows[:1]
+
+        bm.set_row(1, bitarray("100"))
+        assert len(cache) == 5
+        assert list(bm.get_rows([1])) == [bitarray("100")]
+
+        bm.insert_column(bitarray("1" * len(rows)), 3)
+        assert list(bm.get_rows([1, 2])) == [bitarray("1001"), bitarray("1111")]
+
+
+def test_bitmatrix_row_cache_shared_between_instances():
+    rows = [bitarray("01"), bitarray("10")]
+    for storage in get_test_storages():
+        storage.delete_all()
+        cache = RowCache(10 ** 6)
+        reader = BitMatrix.create(storage, rows, 2, 2, row_cache=cache)
+        assert list(reader.get_rows([0, 1])) == rows
+        ## A write through a matrix without the cache, e.g. in another process, is seen by the
+        ## long lived reader
+        BitMatrix(storage).set_row(0, bitarray("11"))
+        assert list(reader.get_rows([0, 1])) == [bitarray("11"), bitarray("10")]
+        assert list(BitMatrix(storage, row_cache=cache).get_rows([0, 1])) == [
+            bitarray("11"),
+            bitarray("10"),
+        ]
+
+
+def test_bitmatrix_batched_writes_change_version_once():
+    rows = [bitarray("01"), bitarray("10"), bitarray("11")]
+    for storage in get_test_storages():
+        storage.delete_all()
+        cache = RowCache(10 ** 6)
+        bm = BitMatrix.create(storage, rows, 3, 2, row_cache=cache)
+        version = bm.rows_version
+        assert list(bm.get_rows([0, 1, 2])) == rows
+        with patch.object(storage, "set_string", wraps=storage.set_string) as set_string:
+            bm.insert_columns([bitarray("1")] * 3, 2, 1, batch_rows=1)
+        assert set_string.call_count == 1
+        assert bm.rows_version != version
+        assert list(bm.get_rows([0, 1, 2])) == [
+            bitarray("011"),
+            bitarray("101"),
+            bitarray("111"),
+        ]
+
+
+def test_partitioned_bitmatrix_row_cache():
+    for storage in get_test_storages():
+        storage.delete_all()
+        cache = RowCache(10 ** 6)
+        pbm = PartitionedBitMatrix.create(storage, 4, 2, row_cache=cache)
+        pbm.insert_columns([bitarray("10"), bitarray("01"), bitarray("11"), bitarray("00")], 0, 2)
+        pbm.insert_columns([bitarray("1"), bitarray("0"), bitarray("1"), bitarray("0")], 2, 1)
+        assert list(pbm.get_rows([0, 1])) == [bitarray("101"), bitarray("010")]
+        assert list(pbm.get_rows([0, 1])) == [bitarray("101"), bitarray("010")]
+        assert cache.hits == 4
+        pbm.set_row(0, bitarray("000"))
+        assert list(pbm.get_rows([0])) == [bitarray("000")]
+
+
+def test_bitmatrix_rows_set_by_generator_leave_the_cache():
+    rows = [bitarray("01"), bitarray("10")]
+    for storage in get_test_storages():
+        storage.delete_all()
+        cache = RowCache(10 ** 6)
+        with patch("bigsi.matrix.bitmatrix.PopcountWriter.close"):
+            bm = BitMatrix.create(storage, rows, 2, 2, row_cache=cache)
+        assert not bm.has_popcounts
+        assert list(bm.get_rows([0, 1])) == rows
+        with bm.batched_writes():
+            bm.set_rows((i for i in [0]), [bitarray("11")])
+            assert list(bm.get_rows([0, 1])) == [bitarray("11"), bitarray("10")]
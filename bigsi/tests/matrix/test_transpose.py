@@ -1,6 +1,9 @@
 from hypothesis import given
 from hypothesis import example
+from hypothesis import settings
 import hypothesis.strategies as st
+from unittest.mock import patch
+import multiprocessing
 import numpy as np
 from bigsi.matrix import transpose
 from bitarray import bitarray
@@ -31,3 +34,44 @@ def test_transpose(booleans):
         for j in range(len(booleans)):
             for i in range(SIZE):
                 assert npmatrix[i, j] == tbitarrays[i][j]
+
+
+@given(
+    booleans=st.lists(
+        st.lists(st.booleans(), min_size=SIZE, max_size=SIZE), min_size=1, max_size=20
+    ),
+    band_size=st.integers(min_value=1, max_value=64),
+)
+def test_transpose_bands(booleans, band_size):
+    npmatrix = np.array(booleans).transpose()
+    bitarrays = create_bitarrays(booleans)
+    tbitarrays = list(transpose(bitarrays, band_size=band_size))
+    assert len(tbitarrays) == SIZE
+    for i in range(SIZE):
+        assert tbitarrays[i].tolist() == npmatrix[i].tolist()
+
+
+@given(
+    booleans=st.lists(
+        st.lists(st.booleans(), min_size=SIZE, max_size=SIZE), min_size=1, max_size=20
+    ),
+    band_size=st.integers(min_value=1, max_value=64),
+)
+@settings(max_examples=10, deadline=None)
+def test_transpose_sharded(booleans, band_size):
+    bitarrays = create_bitarrays(booleans)
+    expected = list(transpose(bitarrays, band_size=band_size))
+    assert list(transpose(bitarrays, band_size=band_size, nproc=2)) == expected
+
+
+def test_transpose_sharded_forks_workers():
+    bitarrays = create_bitarrays([[i % (j + 2) == 0 for i in range(SIZE)] for j in range(9)])
+    expected = list(transpose(bitarrays))
+    with patch("multiprocessing.get_context", wraps=multiprocessing.get_context) as get_context:
+        assert list(transpose(bitarrays, nproc=2)) == expected
+    get_context.assert_called_once_with("fork")
+    ## Without fork the inputs are transposed in this process
+    with patch("multiprocessing.get_all_start_methods", return_value=["spawn"]), patch(
+        "multiprocessing.get_context", side_effect=AssertionError("pool started")
+    ):
+        assert list(transpose(bitarrays, nproc=2)) == expected
@@ -65,3 +65,15 @@ def test_delete():
         with pytest.raises(BaseException):
             storage.get_string("test") == None
         storage.delete_all()
+
+
+def test_batch_delete():
+    for storage in get_storages():
+        storage.delete_all()
+        storage.set_integers(["a", "b", "c"], [1, 2, 3])
+        storage.batch_delete(storage.convert_integer_batch_keys(["a", "c", "missing"]))
+        assert storage.get_integer("b") == 2
+        for key in ["a", "c"]:
+            with pytest.raises(KeyError):
+                storage.get_integer(key)
+        storage.delete_all()
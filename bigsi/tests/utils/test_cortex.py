@@ -0,0 +1,42 @@
+from unittest.mock import patch
+import numpy as np
+import pytest
+
+from bigsi.utils import canonical
+from bigsi.utils.cortex import GraphReader
+from bigsi.utils.cortex import extract_kmers_from_ctx
+from bigsi.utils.cortex import extract_kmer_codes_from_ctx
+from bigsi.utils.kmers import kmer_codes_to_strings
+
+CTX = "bigsi/tests/data/test_kmers.ctx"
+
+
+def test_records_match_graph_reader():
+    records = GraphReader(CTX).records()
+    expected = list(GraphReader(CTX))
+
+    assert len(records) == len(expected)
+    assert records["coverages"][:, 0].tolist() == [r.coverages[0] for r in expected]
+    codes = GraphReader(CTX).kmer_code_blocks()
+    kmers = kmer_codes_to_strings(np.concatenate(list(codes)), 31)
+    assert [canonical(k) for k in kmers] == [r.kmer.canonical_value for r in expected]
+
+
+@pytest.mark.parametrize("k", [31, 21, 3])
+def test_extract_kmer_codes_from_ctx(k):
+    blocks = list(extract_kmer_codes_from_ctx(CTX, k, block_size=7))
+    result = kmer_codes_to_strings(np.concatenate(blocks), k)
+
+    expected = [canonical(kmer) for kmer in extract_kmers_from_ctx(CTX, k)]
+    assert sorted(result) == sorted(expected)
+
+
+def test_extract_kmer_codes_from_ctx_closes_graph():
+    with patch.object(GraphReader, "close", autospec=True) as close:
+        with pytest.raises(ValueError):
+            list(extract_kmer_codes_from_ctx(CTX, 33))
+        assert close.call_count == 1
+        blocks = extract_kmer_codes_from_ctx(CTX, 31, block_size=7)
+        next(blocks)
+        blocks.close()
+        assert close.call_count == 2
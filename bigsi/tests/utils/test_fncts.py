@@ -1,6 +1,7 @@
 from bitarray import bitarray
 from hypothesis import given, strategies as st
 
+from bigsi.utils.fncts import batch
 from bigsi.utils.fncts import non_zero_bitarray_positions
 
 
@@ -14,3 +15,10 @@ def test_non_zero_bitarrary_positions_success(byte_values):
     result = non_zero_bitarray_positions(bit_array)
 
     assert result == expected
+
+
+@given(values=st.lists(st.integers()), size=st.integers(min_value=1, max_value=10))
+def test_batch(values, size):
+    batches = [list(b) for b in batch(values, size)]
+    assert [v for b in batches for v in b] == values
+    assert all(1 <= len(b) <= size for b in batches)
@@ -0,0 +1,175 @@
+from functools import reduce
+from unittest.mock import patch
+import numpy as np
+from bitarray import bitarray
+from hypothesis import given, strategies as st
+
+from bigsi.utils.kernels import BitSlicedCounter
+from bigsi.utils.kernels import and_row_groups
+from bigsi.utils.kernels import and_rows
+from bigsi.utils.kernels import columns_at_least
+from bigsi.utils.kernels import gather_words
+from bigsi.utils.kernels import ones_words
+from bigsi.utils.kernels import popcount
+from bigsi.utils.kernels import rows_to_words
+from bigsi.utils.kernels import set_positions
+from bigsi.utils.kernels import words_to_bitarray
+
+rows_strategy = st.integers(min_value=1, max_value=300).flatmap(
+    lambda num_bits: st.lists(
+        st.lists(st.booleans(), min_size=num_bits, max_size=num_bits),
+        min_size=1,
+        max_size=10,
+    )
+)
+
+
+@given(rows=rows_strategy)
+def test_rows_to_words_round_trip(rows):
+    rows = [bitarray(row) for row in rows]
+    words = rows_to_words(rows)
+    assert words.dtype == np.uint64
+    assert words.shape == (len(rows), -(-len(rows[0]) // 64))
+    assert [words_to_bitarray(w, len(rows[0])) for w in words] == rows
+
+
+@given(rows=rows_strategy)
+def test_and_rows(rows):
+    rows = [bitarray(row) for row in rows]
+    num_bits = len(rows[0])
+    anded = and_rows(rows)
+    expected = reduce(lambda x, y: x & y, rows)
+    assert words_to_bitarray(anded, num_bits) == expected
+    assert set_positions(anded, num_bits).tolist() == [
+        i for i, bit in enumerate(expected) if bit
+    ]
+    assert popcount(anded) == expected.count()
+
+
+@given(rows=rows_strategy, data=st.data())
+def test_and_row_groups(rows, data):
+    rows = [bitarray(row) for row in rows]
+    groups = data.draw(
+        st.lists(
+            st.lists(st.integers(min_value=0, max_value=len(rows) - 1), min_size=1, max_size=4),
+            max_size=10,
+        )
+    )
+    anded = and_row_groups(rows, groups)
+    assert len(anded) == len(groups)
+    for group, row in zip(groups, anded):
+        expected = reduce(lambda x, y: x & y, [rows[i] for i in group])
+        assert words_to_bitarray(row, len(rows[0])) == expected
+
+
+def test_rows_to_words_pads_short_rows():
+    words = rows_to_words([bitarray("1"), bitarray("01"), bitarray("", endian="little")], 70)
+    assert words.shape == (3, 2)
+    assert [set_positions(w).tolist() for w in words] == [[0], [1], []]
+    assert popcount(words).tolist() == [1, 1, 0]
+
+
+def test_rows_to_words_little_endian():
+    row = bitarray("1101", endian="little")
+    assert words_to_bitarray(rows_to_words([row])[0], 4) == bitarray("1101")
+
+
+def test_and_row_groups_of_rows_of_different_lengths():
+    rows = [bitarray("1111111111"), bitarray("111"), bitarray("1" * 20)]
+    del rows[2][12:]
+    anded = and_row_groups(rows, [[0, 2], [0, 1], [2], []], 16)
+    assert [words_to_bitarray(row, 16) for row in anded] == [
+        bitarray("1111111111000000"),
+        bitarray("1110000000000000"),
+        bitarray("1111111111110000"),
+        bitarray("0000000000000000"),
+    ]
+
+
+def test_ones_words():
+    assert words_to_bitarray(ones_words(70), 72) == bitarray("1" * 70 + "00")
+    assert popcount(ones_words(70)) == 70
+
+
+@given(rows=rows_strategy, min_count=st.integers(min_value=0, max_value=12))
+def test_bit_sliced_counter(rows, min_count):
+    rows = [bitarray(row) for row in rows]
+    num_bits = len(rows[0])
+    expected = [sum(row[i] for row in rows) for i in range(num_bits)]
+    ## Rows are added one at a time, or summed a block at a time
+    for max_unpacked_block_bytes in [0, 2 ** 20]:
+        with patch.object(
+            BitSlicedCounter, "MAX_UNPACKED_BLOCK_BYTES", max_unpacked_block_bytes
+        ):
+            counter = BitSlicedCounter(num_bits)
+            counter.add_rows(rows[:1])
+            counter.add_rows(rows[1:])
+        assert counter.num_rows == len(rows)
+        assert counter.counts(range(num_bits)).tolist() == expected
+        colours = counter.positions(counter.at_least(min_count))
+        assert colours.tolist() == [i for i, n in enumerate(expected) if n >= min_count]
+
+
+def test_bit_sliced_counter_counts_past_block():
+    counter = BitSlicedCounter(3)
+    counter.add_rows([bitarray("110")] * 100 + [bitarray("010")] * 30)
+    assert counter.counts([0, 1, 2]).tolist() == [100, 130, 0]
+    assert set_positions(counter.at_least(101)).tolist() == [1]
+    assert set_positions(counter.at_least(0), 3).tolist() == [0, 1, 2]
+    assert set_positions(counter.at_least(1000)).tolist() == []
+
+
+@given(rows=rows_strategy, data=st.data())
+def test_gather_words(rows, data):
+    rows = [bitarray(row) for row in rows]
+    num_bits = data.draw(st.integers(min_value=0, max_value=400))
+    all_words = rows_to_words(rows, num_bits)
+    word_indexes = data.draw(
+        st.lists(st.integers(min_value=0, max_value=all_words.shape[1] - 1), unique=True).map(sorted)
+        if all_words.shape[1]
+        else st.just([])
+    )
+    assert (gather_words(rows, word_indexes, num_bits) == all_words[:, word_indexes]).all()
+
+
+@given(
+    rows=rows_strategy,
+    threshold=st.floats(min_value=0, max_value=1),
+    data=st.data(),
+)
+def test_columns_at_least(rows, threshold, data):
+    rows = [bitarray(row) for row in rows]
+    num_bits = len(rows[0])
+    candidates = bitarray(data.draw(st.lists(st.booleans(), min_size=num_bits, max_size=num_bits)))
+    min_count = int(threshold * len(rows))
+    counts = [sum(row[i] for row in rows) for i in range(num_bits)]
+    ## Blocks of a couple of rows, so columns drop out as rows are counted
+    with patch.object(BitSlicedCounter, "ROWS_PER_BLOCK", 2):
+        colours, kmers_found = columns_at_least(rows, min_count, num_bits)
+        assert colours.tolist() == [i for i, n in enumerate(counts) if n >= min_count]
+        assert kmers_found.tolist() == [counts[i] for i in colours]
+        colours, kmers_found = columns_at_least(
+            rows, min_count, num_bits, rows_to_words([candidates], num_bits)[0]
+        )
+        assert colours.tolist() == [
+            i for i, n in enumerate(counts) if n >= min_count and candidates[i]
+        ]
+        assert kmers_found.tolist() == [counts[i] for i in colours]
+
+
+def test_columns_at_least_drops_words_without_live_columns():
+    rows = [bitarray("1" + "0" * 127)] * 2 + [bitarray("0" * 128)] * 6
+    counter_words = []
+    restrict = BitSlicedCounter.restrict
+
+    def record_restrict(counter, keep):
+        restrict(counter, keep)
+        counter_words.append(counter.word_indexes.tolist())
+
+    with patch.object(BitSlicedCounter, "ROWS_PER_BLOCK", 2), patch.object(
+        BitSlicedCounter, "restrict", record_restrict
+    ):
+        colours, kmers_found = columns_at_least(rows, 5, 128)
+    assert colours.tolist() == []
+    ## After 4 rows only column 0 can reach 5, and after 6 no column can
+    assert counter_words == [[0], []]
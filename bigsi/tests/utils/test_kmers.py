@@ -0,0 +1,49 @@
+import numpy as np
+from hypothesis import given, strategies as st
+
+from bigsi.utils import canonical
+from bigsi.utils import seq_to_kmers
+from bigsi.utils.kmers import canonical_codes
+from bigsi.utils.kmers import kmer_codes_to_strings
+from bigsi.utils.kmers import kmers_to_codes
+from bigsi.utils.kmers import reverse_complement_codes
+from bigsi.utils.kmers import seq_to_kmer_codes
+
+ST_SEQ = st.text(min_size=0, max_size=200, alphabet=["A", "T", "C", "G"])
+
+
+@given(seq=ST_SEQ, kmer_size=st.integers(min_value=1, max_value=32))
+def test_seq_to_kmer_codes_forward(seq, kmer_size):
+    codes = seq_to_kmer_codes(seq, kmer_size, canonical=False)
+
+    assert kmer_codes_to_strings(codes, kmer_size) == list(seq_to_kmers(seq, kmer_size))
+
+
+@given(seq=ST_SEQ, kmer_size=st.integers(min_value=1, max_value=32))
+def test_seq_to_kmer_codes_canonical(seq, kmer_size):
+    codes = seq_to_kmer_codes(seq, kmer_size)
+
+    expected = [canonical(kmer) for kmer in seq_to_kmers(seq, kmer_size)]
+    assert kmer_codes_to_strings(codes, kmer_size) == expected
+
+
+@given(seq=st.text(min_size=0, max_size=200, alphabet=["A", "T", "C", "G", "N"]),
+       kmer_size=st.integers(min_value=1, max_value=32))
+def test_seq_to_kmer_codes_skips_invalid_bases(seq, kmer_size):
+    codes = seq_to_kmer_codes(seq, kmer_size, canonical=False)
+
+    expected = [kmer for kmer in seq_to_kmers(seq, kmer_size) if "N" not in kmer]
+    assert kmer_codes_to_strings(codes, kmer_size) == expected
+
+
+@given(kmers=st.lists(st.text(min_size=31, max_size=31, alphabet=["A", "T", "C", "G"]), min_size=1))
+def test_canonical_codes(kmers):
+    codes = kmers_to_codes(kmers)
+
+    assert kmer_codes_to_strings(codes, 31) == kmers
+    assert kmer_codes_to_strings(canonical_codes(codes, 31), 31) == [canonical(k) for k in kmers]
+    assert (reverse_complement_codes(reverse_complement_codes(codes, 31), 31) == codes).all()
+
+
+def test_lowercase_is_encoded():
+    assert seq_to_kmer_codes("acgt", 2, canonical=False).tolist() == kmers_to_codes(["AC", "CG", "GT"]).tolist()
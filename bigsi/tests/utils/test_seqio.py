@@ -0,0 +1,52 @@
+import gzip
+from tempfile import NamedTemporaryFile
+import numpy as np
+from hypothesis import given, settings, strategies as st
+
+from bigsi.utils import canonical
+from bigsi.utils import seq_to_kmers
+from bigsi.utils.kmers import kmer_codes_to_strings
+from bigsi.utils.seqio import extract_kmer_codes_from_seqfile
+from bigsi.utils.seqio import iter_sequences
+
+ST_READS = st.lists(st.text(min_size=1, max_size=60, alphabet=["A", "T", "C", "G", "N"]), min_size=1, max_size=20)
+
+
+def _fasta(reads):
+    return "".join(">r%i\n%s\n%s\n" % (i, read[:30], read[30:]) for i, read in enumerate(reads)).encode()
+
+
+def _fastq(reads):
+    return "".join("@r%i\n%s\n+\n%s\n" % (i, read, "I" * len(read)) for i, read in enumerate(reads)).encode()
+
+
+@given(reads=ST_READS, gzipped=st.booleans(), fastq=st.booleans())
+def test_iter_sequences(reads, gzipped, fastq):
+    data = _fastq(reads) if fastq else _fasta(reads)
+    with NamedTemporaryFile() as tmp:
+        tmp.write(gzip.compress(data) if gzipped else data)
+        tmp.flush()
+        result = list(iter_sequences(tmp.name))
+
+    assert result == [read.encode() for read in reads]
+
+
+@settings(deadline=None)
+@given(reads=ST_READS, kmer_size=st.integers(min_value=1, max_value=31),
+       min_count=st.integers(min_value=1, max_value=3), chunk_bases=st.integers(min_value=1, max_value=100))
+def test_extract_kmer_codes_from_seqfile(reads, kmer_size, min_count, chunk_bases):
+    counts = {}
+    for read in reads:
+        for kmer in seq_to_kmers(read, kmer_size):
+            if "N" not in kmer:
+                counts[canonical(kmer)] = counts.get(canonical(kmer), 0) + 1
+
+    with NamedTemporaryFile() as tmp:
+        tmp.write(_fastq(reads))
+        tmp.flush()
+        blocks = list(extract_kmer_codes_from_seqfile(tmp.name, kmer_size, min_count, chunk_bases))
+
+    result = set()
+    for block in blocks:
+        result.update(kmer_codes_to_strings(block, kmer_size))
+    assert result == {kmer for kmer, count in counts.items() if count >= min_count}
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from hypothesis import given, strategies as st
+
+from bigsi.utils.sketches import CountMinSketch
+from bigsi.utils.sketches import HyperLogLog
+
+
+@given(codes=st.lists(st.integers(min_value=0, max_value=2 ** 64 - 1), min_size=1, max_size=200))
+def test_count_min_sketch_never_underestimates(codes):
+    codes = np.array(codes, dtype=np.uint64)
+    cms = CountMinSketch(width=64, depth=3)
+
+    half = len(codes) // 2
+    cms.update(codes[:half])
+    distinct, estimates = cms.update(codes[half:])
+
+    assert (distinct == np.unique(codes[half:])).all()
+    for code, estimate in zip(distinct, estimates):
+        assert estimate >= (codes == code).sum()
+    for code in np.unique(codes):
+        assert cms.query(np.array([code]))[0] >= (codes == code).sum()
+
+
+def test_count_min_sketch_exact_without_collisions():
+    cms = CountMinSketch(width=2 ** 16, depth=4)
+    codes = np.array([1, 2, 2, 3, 3, 3], dtype=np.uint64)
+
+    distinct, estimates = cms.update(codes)
+
+    assert distinct.tolist() == [1, 2, 3]
+    assert estimates.tolist() == [1, 2, 3]
+
+
+@given(num_codes=st.integers(min_value=0, max_value=50000), seed=st.integers(min_value=0, max_value=2 ** 32 - 1))
+def test_hyperloglog_estimate(num_codes, seed):
+    codes = np.random.RandomState(seed).randint(0, 2 ** 62, size=num_codes, dtype=np.int64).astype(np.uint64)
+    hll = HyperLogLog(precision=12)
+    hll.update(codes)
+    hll.update(codes[: num_codes // 2])
+
+    ## 5 standard errors
+    assert abs(hll.estimate() - len(np.unique(codes))) <= max(2, 0.1 * num_codes)
+
+
+def test_hyperloglog_merge_and_bytes():
+    codes = np.arange(20000, dtype=np.uint64)
+    hll1 = HyperLogLog().update(codes[:15000])
+    hll2 = HyperLogLog().update(codes[5000:])
+
+    union = HyperLogLog.from_bytes(hll1.to_bytes()).merge(hll2)
+
+    assert union.estimate() == HyperLogLog().update(codes).estimate()
+    assert HyperLogLog.from_bytes(hll1.to_bytes()).estimate() == hll1.estimate()
+    with pytest.raises(ValueError):
+        hll1.merge(HyperLogLog(precision=10))
@@ -14,10 +14,13 @@ import gzip
 import struct
 import subprocess
 import math
+import numpy as np
 from bigsi.utils import seq_to_kmers
+from bigsi.utils.kmers import canonical_codes
 
 BITS = {"A": "00", "G": "01", "C": "10", "T": "11"}
 BASES = {"00": "A", "01": "G", "10": "C", "11": "T"}
+DEFAULT_BLOCK_SIZE = 10 ** 6
 
 
 def extract_kmers_from_ctx(ctx, k):
@@ -27,6 +30,37 @@ def extract_kmers_from_ctx(ctx, k):
             yield kmer
 
 
+def extract_kmer_codes_from_ctx(ctx, k, block_size=DEFAULT_BLOCK_SIZE, min_coverage=1):
+    """
+    Yields blocks of canonical kmer codes (see bigsi.utils.kmers) for the same kmers as
+    extract_kmers_from_ctx, decoding whole blocks of memory mapped records at a time.
+    Graph kmers with a total coverage below min_coverage are skipped. Raises a ValueError if k is
+    larger than the graph's kmer size.
+    """
+    gr = GraphReader(ctx)
+    try:
+        ctx_kmer_size = gr.kmer_size
+        if k > ctx_kmer_size:
+            raise ValueError(
+                "Can't extract %i-mers from %s, which has a kmer size of %i"
+                % (k, ctx, ctx_kmer_size)
+            )
+        mask = np.uint64((1 << (2 * k)) - 1) if k < 32 else np.uint64(-1)
+        for words in gr.kmer_code_blocks(block_size, min_coverage):
+            if k == ctx_kmer_size:
+                yield canonical_codes(words, k)
+            else:
+                ## Every k length substring of the graph's kmers
+                yield np.concatenate(
+                    [
+                        canonical_codes((words >> np.uint64(2 * shift)) & mask, k)
+                        for shift in range(ctx_kmer_size - k, -1, -1)
+                    ]
+                )
+    finally:
+        gr.close()
+
+
 def kmer_to_bits(kmer):
     return "".join([BITS[k] for k in kmer])
 
@@ -223,8 +257,52 @@ class GraphReader(object):
         self._file.seek(0, os.SEEK_END)
         payload_size = self._file.tell() - payload_start
         self.num_records = payload_size // self.record_size
+        self.payload_start = payload_start
         self._file.seek(payload_start, os.SEEK_SET)
 
+    @property
+    def record_dtype(self):
+        return np.dtype(
+            [
+                ("kmer", "<u8", (self.kmer_storage_size // 8,)),
+                ("coverages", "<u4", (self.num_colours,)),
+                ("edges", "u1", (self.num_colours,)),
+            ]
+        )
+
+    def records(self):
+        """
+        Returns all the records as a read only memory mapped NumPy structured array
+        """
+        return np.memmap(
+            self._file_name,
+            dtype=self.record_dtype,
+            mode="r",
+            offset=self.payload_start,
+            shape=(self.num_records,),
+        )
+
+    def kmer_code_blocks(self, block_size=DEFAULT_BLOCK_SIZE, min_coverage=1):
+        """
+        Yields the kmers of the graph as uint64 arrays of kmer codes (see bigsi.utils.kmers),
+        block_size records at a time. The binary kmers of the graph already are kmer codes.
+        Kmers with a total coverage across colours below min_coverage are skipped.
+        """
+        if self.kmer_storage_size != 8:
+            raise ValueError("Kmer codes are only supported for graphs with k <= 31")
+        if self.num_records == 0:
+            return
+        records = self.records()
+        for start in range(0, self.num_records, block_size):
+            block = records[start : start + block_size]
+            codes = np.array(block["kmer"][:, 0], dtype=np.uint64)
+            if min_coverage > 1:
+                codes = codes[block["coverages"].sum(axis=1) >= min_coverage]
+            yield codes
+
+    def close(self):
+        self._file.close()
+
     def __iter__(self):
         return self
 
@@ -2,6 +2,8 @@ import logging
 import numpy as np
 from functools import reduce
 from itertools import islice, chain
+from bigsi.utils.kernels import rows_to_words
+from bigsi.utils.kernels import set_positions
 
 logger = logging.getLogger(__name__)
 logger.setLevel("DEBUG")
@@ -15,7 +17,12 @@ def batch(iterable, size):
     sourceiter = iter(iterable)
     while True:
         batchiter = islice(sourceiter, size)
-        yield chain([next(batchiter)], batchiter)
+        ## A StopIteration raised inside a generator is an error since python 3.7
+        try:
+            first = next(batchiter)
+        except StopIteration:
+            return
+        yield chain([first], batchiter)
 
 
 def bitwise_and(bitarrays):
@@ -23,7 +30,7 @@ def bitwise_and(bitarrays):
 
 
 def non_zero_bitarray_positions(bitarray):
-    return np.where(np.unpackbits(bitarray))[0].tolist()
+    return set_positions(rows_to_words([bitarray])[0], len(bitarray)).tolist()
 
 
 def chunks(l, n):
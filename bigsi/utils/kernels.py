@@ -0,0 +1,311 @@
+import numpy as np
+from bitarray import bitarray
+
+## Rows are handled as packed words of 64 bits. The bytes of a big endian bitarray are viewed as
+## words as they are, so bit i of a row is bit i % 8 (most significant first) of byte i // 8.
+## Bitarrays are read through their buffers in place rather than copied.
+WORD_BITS = 64
+WORD_BYTES = WORD_BITS // 8
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def num_words(num_bits):
+    return -(-num_bits // WORD_BITS)
+
+
+def _row_bytes(row):
+    ## The bytes of a row's buffer, in big endian bit order
+    if row.endian() != "big":
+        row = bitarray(row, endian="big")
+    return np.frombuffer(row, dtype=np.uint8, count=-(-len(row) // 8))
+
+
+def _clear_tail(row, num_bits):
+    ## Clears the bits of a row of bytes past num_bits, including any left in the unused bits of
+    ## a bitarray's last byte
+    num_bytes = -(-num_bits // 8)
+    row[num_bytes:] = 0
+    if num_bits % 8:
+        row[num_bytes - 1] &= (0xFF << (8 - num_bits % 8)) & 0xFF
+
+
+def _num_bits(rows, num_bits):
+    if num_bits is None:
+        return max((len(row) for row in rows), default=0)
+    return num_bits
+
+
+def rows_to_words(rows, num_bits=None):
+    ## (rows x words) uint64 array of bitarrays, zero padded to num_bits (by default the longest row)
+    return and_row_groups(rows, [[i] for i in range(len(rows))], num_bits)
+
+
+def ones_words(num_bits):
+    ## A row of words with the first num_bits bits set
+    out = np.full(num_words(num_bits) * WORD_BYTES, 0xFF, dtype=np.uint8)
+    _clear_tail(out, num_bits)
+    return out.view(np.uint64)
+
+
+def words_to_bitarray(words, num_bits):
+    ba = bitarray(endian="big")
+    ba.frombytes(np.ascontiguousarray(words, dtype=np.uint64).tobytes())
+    del ba[num_bits:]
+    return ba
+
+
+def and_row_groups(rows, groups, num_bits=None):
+    """
+    AND groups of bitarrays. Row g of the result is the AND of the rows indexed by groups[g], as
+    packed words. Each group is ANDed straight from the rows' buffers into the result, so nothing
+    is allocated per group. Bits past the end of the shortest row of a group are 0.
+
+    :param rows: the rows
+    :type rows: list of bitarray
+    :param groups: the indexes into rows of each group
+    :type groups: list of list of int
+    :param num_bits: the number of bits of the result, by default the longest row
+    :type num_bits: int
+    :return: (groups x words) uint64 array
+    """
+    num_bits = _num_bits(rows, num_bits)
+    out = np.zeros((len(groups), num_words(num_bits) * WORD_BYTES), dtype=np.uint8)
+    row_data = {}
+    for g, group in enumerate(groups):
+        group = list(group)
+        if not group:
+            continue
+        for i in group:
+            if i not in row_data:
+                row_data[i] = _row_bytes(rows[i])
+        group_bits = min(num_bits, min(len(rows[i]) for i in group))
+        num_bytes = -(-group_bits // 8)
+        result = out[g, :num_bytes]
+        if len(group) == 1:
+            result[:] = row_data[group[0]][:num_bytes]
+        else:
+            np.bitwise_and(
+                row_data[group[0]][:num_bytes], row_data[group[1]][:num_bytes], out=result
+            )
+            for i in group[2:]:
+                np.bitwise_and(result, row_data[i][:num_bytes], out=result)
+        _clear_tail(out[g], group_bits)
+    return out.view(np.uint64)
+
+
+def and_rows(rows, num_bits=None):
+    ## The AND of bitarrays as a row of packed words
+    return and_row_groups(rows, [range(len(rows))], num_bits)[0]
+
+
+def set_positions(words, num_bits=None):
+    ## Sorted positions of the set bits of a row of words. Only the non zero words are unpacked.
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    non_zero = np.flatnonzero(words)
+    bits = np.unpackbits(words[non_zero].view(np.uint8).reshape(-1, WORD_BYTES), axis=1)
+    word_indexes, bit_indexes = np.nonzero(bits)
+    positions = non_zero[word_indexes] * WORD_BITS + bit_indexes
+    if num_bits is not None:
+        positions = positions[positions < num_bits]
+    return positions
+
+
+def popcount(words):
+    ## Number of set bits of each row of a (rows x words) array, or of a single row
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    counts = _POPCOUNT_TABLE[words.view(np.uint8)]
+    return counts.reshape(words.shape[:-1] + (words.shape[-1] * WORD_BYTES,)).sum(
+        axis=-1, dtype=np.int64
+    )
+
+
+def gather_words(rows, word_indexes, num_bits):
+    ## (rows x words) uint64 array of the words at word_indexes of bitarrays zero padded to num_bits
+    word_indexes = np.asarray(word_indexes, dtype=np.intp)
+    byte_indexes = (word_indexes[:, None] * WORD_BYTES + np.arange(WORD_BYTES)).ravel()
+    out = np.zeros((len(rows), len(byte_indexes)), dtype=np.uint8)
+    masks = {}
+    for i, row in enumerate(rows):
+        row_bits = min(len(row), num_bits)
+        if not row_bits:
+            continue
+        if row_bits not in masks:
+            ## The bits of the gathered bytes which lie within the row
+            row_mask = ones_words(row_bits).view(np.uint8)
+            masks[row_bits] = np.take(row_mask, byte_indexes, mode="clip") * (
+                byte_indexes < len(row_mask)
+            ).astype(np.uint8)
+        np.take(_row_bytes(row), byte_indexes, mode="clip", out=out[i])
+        out[i] &= masks[row_bits]
+    return out.view(np.uint64)
+
+
+class BitSlicedCounter(object):
+
+    """
+    Counts the set bits of each column over many rows with vertical counters: plane j holds bit j
+    of every column's count as packed words, so adding a row is a ripple carry of a few word wide
+    XORs and ANDs, and no per column counts are kept. Columns are compared against a threshold
+    with the planes too, and counts are only expanded for the columns asked for.
+
+    Counting can be restricted to some of the words, after which rows are only gathered and
+    added at those words (word_indexes) and the results of at_least are of those words only.
+
+    :Example:
+    >>> counter = BitSlicedCounter(num_bits)
+    >>> counter.add_rows(rows)
+    >>> colours = counter.positions(counter.at_least(min_count))
+    >>> counter.counts(colours)
+    """
+
+    ## Rows packed into words at a time
+    ROWS_PER_BLOCK = 64
+    ## Largest block of rows summed as unpacked bytes
+    MAX_UNPACKED_BLOCK_BYTES = 2 ** 20
+
+    def __init__(self, num_bits):
+        self.num_bits = num_bits
+        self.num_rows = 0
+        self.planes = []
+        self.word_indexes = np.arange(num_words(num_bits))
+        self._restricted = False
+        self._carry = np.empty(len(self.word_indexes), dtype=np.uint64)
+        self._next_carry = np.empty_like(self._carry)
+
+    def add(self, words):
+        ## Adds a row of packed words (of word_indexes) to the counts
+        carry, next_carry = self._carry, self._next_carry
+        carry[:] = words
+        self.num_rows += 1
+        for plane in self.planes:
+            np.bitwise_and(plane, carry, out=next_carry)
+            np.bitwise_xor(plane, carry, out=plane)
+            carry, next_carry = next_carry, carry
+            if not carry.any():
+                break
+        else:
+            self.planes.append(carry.copy())
+        self._carry, self._next_carry = carry, next_carry
+
+    def add_rows(self, rows):
+        ## Adds bitarrays to the counts, packed a block of rows at a time. Narrow blocks are
+        ## summed at once and their counts added to the planes, rather than a row at a time.
+        rows = list(rows)
+        for start in range(0, len(rows), self.ROWS_PER_BLOCK):
+            block = rows[start : start + self.ROWS_PER_BLOCK]
+            if self._restricted:
+                block_words = gather_words(block, self.word_indexes, self.num_bits)
+            else:
+                block_words = rows_to_words(block, self.num_bits)
+            if block_words.size * WORD_BITS <= self.MAX_UNPACKED_BLOCK_BYTES:
+                self.add_counts(
+                    np.unpackbits(block_words.view(np.uint8), axis=1).sum(axis=0),
+                    len(block_words),
+                )
+            else:
+                for words in block_words:
+                    self.add(words)
+
+    def add_counts(self, counts, num_rows):
+        ## Adds a count to each column (of word_indexes), as the counts of num_rows rows
+        counts = np.asarray(counts)
+        addend = [
+            np.packbits(((counts >> j) & 1).astype(np.uint8)).view(np.uint64)
+            for j in range(int(counts.max()).bit_length() if counts.size else 0)
+        ]
+        self.num_rows += num_rows
+        carry = np.zeros(len(self.word_indexes), dtype=np.uint64)
+        j = 0
+        while j < len(addend) or carry.any():
+            if j == len(self.planes):
+                self.planes.append(np.zeros_like(carry))
+            plane = self.planes[j]
+            bits = addend[j] if j < len(addend) else np.zeros_like(carry)
+            half_sum = plane ^ bits
+            next_carry = (plane & bits) | (carry & half_sum)
+            np.bitwise_xor(half_sum, carry, out=plane)
+            carry = next_carry
+            j += 1
+
+    def restrict(self, keep):
+        ## Only counts the words at positions keep of word_indexes from now on
+        keep = np.asarray(keep, dtype=np.intp)
+        self.word_indexes = self.word_indexes[keep]
+        self.planes = [plane[keep] for plane in self.planes]
+        self._restricted = True
+        self._carry = np.empty(len(self.word_indexes), dtype=np.uint64)
+        self._next_carry = np.empty_like(self._carry)
+
+    def at_least(self, min_count):
+        ## Packed words (of word_indexes) with the bits set of the columns counted at least
+        ## min_count times
+        width = max(len(self.planes), int(min_count).bit_length())
+        zeros = np.zeros(len(self.word_indexes), dtype=np.uint64)
+        greater = zeros.copy()
+        equal = ones_words(self.num_bits)[self.word_indexes]
+        for j in reversed(range(width)):
+            plane = self.planes[j] if j < len(self.planes) else zeros
+            if (int(min_count) >> j) & 1:
+                equal &= plane
+            else:
+                greater |= equal & plane
+                equal &= ~plane
+        return greater | equal
+
+    def positions(self, words):
+        ## Sorted positions of the columns set in words of word_indexes
+        positions = set_positions(words)
+        return self.word_indexes[positions // WORD_BITS] * WORD_BITS + positions % WORD_BITS
+
+    def counts(self, positions):
+        ## The counts of the columns at positions, which must be in counted words
+        positions = np.asarray(positions, dtype=np.int64)
+        counts = np.zeros(len(positions), dtype=np.int64)
+        words = np.searchsorted(self.word_indexes, positions // WORD_BITS)
+        byte_indexes = words * WORD_BYTES + (positions % WORD_BITS) // 8
+        shifts = (7 - positions % 8).astype(np.uint8)
+        for j, plane in enumerate(self.planes):
+            bits = (plane.view(np.uint8)[byte_indexes] >> shifts) & 1
+            counts += bits.astype(np.int64) << j
+        return counts
+
+
+def columns_at_least(rows, min_count, num_bits, candidates=None):
+    """
+    Find the columns set in at least min_count of rows, and their counts. Rows are counted a
+    block at a time with a BitSlicedCounter. Once min_count is within reach of the rows left,
+    columns which can no longer reach it drop out, and the rest of the rows are only counted at
+    the words with columns left. Counting stops as soon as no column is left.
+
+    :param rows: the rows
+    :type rows: list of bitarray
+    :param min_count: the number of rows a column must be set in
+    :type min_count: int
+    :param num_bits: the number of columns
+    :type num_bits: int
+    :param candidates: packed words of the columns to consider, by default all of them
+    :type candidates: numpy.ndarray
+    :return: tuple of the sorted columns and their counts
+    """
+    counter = BitSlicedCounter(num_bits)
+    if candidates is not None:
+        counter.restrict(np.flatnonzero(candidates))
+    remaining = len(rows)
+    for start in range(0, len(rows), BitSlicedCounter.ROWS_PER_BLOCK):
+        block = rows[start : start + BitSlicedCounter.ROWS_PER_BLOCK]
+        counter.add_rows(block)
+        remaining -= len(block)
+        if remaining and min_count > remaining:
+            live = counter.at_least(min_count - remaining)
+            if candidates is not None:
+                live &= candidates[counter.word_indexes]
+            live_words = np.flatnonzero(live)
+            if len(live_words) < len(counter.word_indexes):
+                counter.restrict(live_words)
+            if not len(live_words):
+                break
+    colours = counter.at_least(min_count)
+    if candidates is not None:
+        colours &= candidates[counter.word_indexes]
+    positions = counter.positions(colours)
+    return positions, counter.counts(positions)
@@ -0,0 +1,136 @@
+"""
+2-bit packed kmer codes.
+
+Bases are encoded A=0, C=1, G=2, T=3 and a kmer is packed into a uint64 with its first base in the
+most significant position, so comparing codes of the same length is the same as comparing the kmer
+strings lexically. The canonical code of a kmer is therefore the min of its code and the code of its
+reverse complement, exactly like `bigsi.utils.canonical`. Kmers of up to 32 bases are supported.
+"""
+import numpy as np
+
+MAX_KMER_SIZE = 32
+INVALID_BASE = 4
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+ACGT_ONLY = str.maketrans("", "", "ACGT")
+
+BASE_TO_CODE = np.full(256, INVALID_BASE, dtype=np.uint8)
+for _code, _base in enumerate("ACGT"):
+    BASE_TO_CODE[ord(_base)] = _code
+    BASE_TO_CODE[ord(_base.lower())] = _code
+
+
+def _validate_kmer_size(k):
+    if not 0 < k <= MAX_KMER_SIZE:
+        raise ValueError("Kmer codes support kmer sizes from 1 to %i" % MAX_KMER_SIZE)
+
+
+def is_acgt(seq):
+    return not seq.translate(ACGT_ONLY)
+
+
+def encode_seq(seq):
+    """
+    Returns the per base codes of a sequence, with INVALID_BASE for anything which is not ACGT
+    """
+    if isinstance(seq, str):
+        seq = seq.encode("ascii", "replace")
+    return BASE_TO_CODE[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def _window_codes(codes, k):
+    ## Packs every window of k base codes by doubling the window width,
+    ## so it takes log2(k) vectorised passes rather than k.
+    result, result_width = None, 0
+    power, power_width = codes.astype(np.uint64), 1
+    while True:
+        if k & 1:
+            if result is None:
+                result, result_width = power, power_width
+            else:
+                n = len(power) - result_width
+                if n <= 0:
+                    return np.zeros(0, dtype=np.uint64)
+                result = (result[:n] << np.uint64(2 * power_width)) | power[result_width:]
+                result_width += power_width
+        k >>= 1
+        if not k:
+            return result
+        if len(power) <= power_width:
+            return np.zeros(0, dtype=np.uint64)
+        power = (power[:-power_width] << np.uint64(2 * power_width)) | power[power_width:]
+        power_width *= 2
+
+
+def seq_to_kmer_codes(seq, k, canonical=True):
+    """
+    Returns a uint64 array with the code of every kmer in a sequence, in order.
+
+    Kmers containing anything other than ACGT (in either case) are skipped. With canonical=True (the
+    default) the lexically least of each kmer and its reverse complement is returned.
+    """
+    _validate_kmer_size(k)
+    codes = encode_seq(seq)
+    if len(codes) < k:
+        return np.zeros(0, dtype=np.uint64)
+    invalid = codes == INVALID_BASE
+    codes = np.where(invalid, 0, codes).astype(np.uint8)
+    kmer_codes = _window_codes(codes, k)
+    if canonical:
+        rc_codes = _window_codes((3 - codes)[::-1], k)[::-1]
+        kmer_codes = np.minimum(kmer_codes, rc_codes)
+    if invalid.any():
+        num_invalid = np.concatenate(([0], np.cumsum(invalid)))
+        kmer_codes = kmer_codes[num_invalid[k:] == num_invalid[:-k]]
+    return kmer_codes
+
+
+def kmers_to_codes(kmers):
+    """
+    Returns the codes of a list of ACGT kmer strings of the same length
+    """
+    kmers = list(kmers)
+    if not kmers:
+        return np.zeros(0, dtype=np.uint64)
+    k = len(kmers[0])
+    _validate_kmer_size(k)
+    codes = encode_seq("".join(kmers)).reshape(len(kmers), k)
+    if (codes == INVALID_BASE).any():
+        raise ValueError("Kmers must only contain ACGT")
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+    return np.bitwise_or.reduce(codes.astype(np.uint64) << shifts, axis=1)
+
+
+def reverse_complement_codes(codes, k):
+    """
+    Returns the codes of the reverse complements of kmer codes
+    """
+    _validate_kmer_size(k)
+    x = ~np.asarray(codes, dtype=np.uint64)
+    ## Reverse the order of the 2-bit bases within each 64-bit word
+    x = ((x >> np.uint64(2)) & np.uint64(0x3333333333333333)) | (
+        (x & np.uint64(0x3333333333333333)) << np.uint64(2)
+    )
+    x = ((x >> np.uint64(4)) & np.uint64(0x0F0F0F0F0F0F0F0F)) | (
+        (x & np.uint64(0x0F0F0F0F0F0F0F0F)) << np.uint64(4)
+    )
+    x = x.byteswap()
+    return x >> np.uint64(64 - 2 * k)
+
+
+def canonical_codes(codes, k):
+    codes = np.asarray(codes, dtype=np.uint64)
+    return np.minimum(codes, reverse_complement_codes(codes, k))
+
+
+def kmer_codes_to_bytes(codes, k):
+    """
+    Returns an (n_kmers x k) uint8 matrix holding the ASCII kmer of each code
+    """
+    _validate_kmer_size(k)
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+    codes = np.asarray(codes, dtype=np.uint64)
+    return BASES[((codes[:, None] >> shifts) & np.uint64(3)).astype(np.uint8)]
+
+
+def kmer_codes_to_strings(codes, k):
+    return [row.tobytes().decode("ascii") for row in kmer_codes_to_bytes(codes, k)]
@@ -0,0 +1,89 @@
+import os
+import resource
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+## Seconds between RSS samples while a stage is tracked
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def _pid_rss(pid):
+    ## Anonymous resident memory, which unlike memory mapped file pages cannot be reclaimed. Where
+    ## the kernel reports it the proportional share is used, so pages a forked worker shares with
+    ## its parent are counted once.
+    try:
+        with open("/proc/%s/smaps_rollup" % pid) as infile:
+            for line in infile:
+                if line.startswith("Pss_Anon:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    with open("/proc/%s/statm" % pid) as infile:
+        fields = infile.read().split()
+    return (int(fields[1]) - int(fields[2])) * resource.getpagesize()
+
+
+def _child_pids():
+    pids = []
+    try:
+        for tid in os.listdir("/proc/self/task"):
+            with open("/proc/self/task/%s/children" % tid) as infile:
+                pids.extend(infile.read().split())
+    except (IOError, OSError):
+        pass
+    return pids
+
+
+def current_rss(include_children=True):
+    ## Resident memory in bytes of this process and, optionally, its worker processes (see
+    ## _pid_rss). Without /proc this is the peak RSS of the process so far.
+    try:
+        rss = _pid_rss("self")
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    if include_children:
+        for pid in _child_pids():
+            try:
+                rss += _pid_rss(pid)
+            except (IOError, OSError):
+                ## The child has exited
+                pass
+    return rss
+
+
+class RSSTracker(object):
+
+    """
+    Tracks the peak resident set size of each stage of a job, sampling it on a background thread.
+
+    :Example:
+    >>> tracker = RSSTracker()
+    >>> with tracker.stage("transpose"):
+    >>>     transpose(...)
+    >>> tracker.peaks
+    OrderedDict([('transpose', 1073741824)])
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peaks = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        stop = threading.Event()
+        peak = [current_rss()]
+
+        def sample():
+            while not stop.wait(self.interval):
+                peak[0] = max(peak[0], current_rss())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+            peak[0] = max(peak[0], current_rss())
+            self.peaks[name] = max(self.peaks.get(name, 0), peak[0])
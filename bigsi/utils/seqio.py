@@ -0,0 +1,105 @@
+"""
+Streaming FASTA/FASTQ readers, plain or gzipped, and kmer extraction from them.
+"""
+import gzip
+import numpy as np
+
+from bigsi.utils.kmers import seq_to_kmer_codes
+from bigsi.utils.sketches import CountMinSketch
+
+GZIP_MAGIC = b"\x1f\x8b"
+DEFAULT_CHUNK_BASES = 10 ** 7
+## Joining a chunk of reads with an invalid base means no kmer spans two reads
+READ_SEPARATOR = b"N"
+
+
+def open_sequence_file(path):
+    with open(path, "rb") as infile:
+        magic = infile.read(2)
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _iter_fasta(lines):
+    seq = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith(b">"):
+            if seq:
+                yield b"".join(seq)
+            seq = []
+        elif line:
+            seq.append(line)
+    if seq:
+        yield b"".join(seq)
+
+
+def _iter_fastq(lines):
+    for i, line in enumerate(lines):
+        if i % 4 == 1:
+            yield line.strip()
+
+
+def _chain_line(first, infile):
+    yield first
+    yield from infile
+
+
+def iter_sequences(path):
+    """
+    Yields every sequence of a FASTA or FASTQ file, as bytes
+    """
+    with open_sequence_file(path) as infile:
+        first = infile.readline()
+        while first and not first.strip():
+            first = infile.readline()
+        if not first:
+            return
+        lines = _chain_line(first, infile)
+        if first.startswith(b">"):
+            yield from _iter_fasta(lines)
+        elif first.startswith(b"@"):
+            yield from _iter_fastq(lines)
+        else:
+            raise ValueError("%s is not a FASTA or FASTQ file" % path)
+
+
+def iter_sequence_chunks(path, chunk_bases=DEFAULT_CHUNK_BASES):
+    """
+    Yields the sequences of a FASTA or FASTQ file in lists of about chunk_bases bases
+    """
+    chunk = []
+    num_bases = 0
+    for seq in iter_sequences(path):
+        chunk.append(seq)
+        num_bases += len(seq)
+        if num_bases >= chunk_bases:
+            yield chunk
+            chunk = []
+            num_bases = 0
+    if chunk:
+        yield chunk
+
+
+def extract_kmer_codes_from_seqfile(
+    path, k, min_count=1, chunk_bases=DEFAULT_CHUNK_BASES, count_min_sketch=None
+):
+    """
+    Yields blocks of distinct canonical kmer codes (see bigsi.utils.kmers) from a FASTA or FASTQ file.
+
+    With min_count > 1 kmer counts are kept in a fixed memory count-min sketch and only kmers seen at
+    least min_count times are yielded. A kmer may be yielded again in a later block. The sketch
+    overestimates, so a few kmers below min_count can get through, but no kmer above it is dropped.
+    """
+    if min_count > 1 and count_min_sketch is None:
+        count_min_sketch = CountMinSketch()
+    for chunk in iter_sequence_chunks(path, chunk_bases):
+        codes = seq_to_kmer_codes(READ_SEPARATOR.join(chunk), k)
+        if min_count > 1:
+            codes, counts = count_min_sketch.update(codes)
+            codes = codes[counts >= min_count]
+        else:
+            codes = np.unique(codes)
+        if codes.size:
+            yield codes
@@ -0,0 +1,193 @@
+"""
+Fixed memory sketches over kmer codes (see bigsi.utils.kmers).
+"""
+import math
+import numpy as np
+from typing import Tuple
+
+DEFAULT_COUNT_MIN_WIDTH = 2 ** 23
+DEFAULT_COUNT_MIN_DEPTH = 4
+DEFAULT_HLL_PRECISION = 14
+MIN_HLL_PRECISION = 4
+MAX_HLL_PRECISION = 18
+## Odd multipliers for multiply-shift hashing, one per sketch row
+HASH_MULTIPLIERS = [
+    0x9E3779B97F4A7C15,
+    0xBF58476D1CE4E5B9,
+    0x94D049BB133111EB,
+    0xD6E8FEB86659FD93,
+    0xA0761D6478BD642F,
+    0xE7037ED1A0B428DB,
+    0x8EBC6AF09C88C6E3,
+    0x589965CC75374CC3,
+]
+
+
+def _mix(codes):
+    ## splitmix64 finaliser, so codes sharing low bits spread over the sketch
+    with np.errstate(over="ignore"):
+        z = np.asarray(codes, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def _bit_length(x):
+    ## Vectorised int.bit_length for uint64 arrays
+    x = np.array(x, dtype=np.uint64)
+    n = np.zeros(x.shape, dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        over = x >= np.uint64(1 << shift)
+        n[over] += shift
+        x[over] >>= np.uint64(shift)
+    return n + (x > 0)
+
+
+class CountMinSketch(object):
+    """
+    Count-min sketch of kmer code counts in depth x width saturating uint16 counters. Counts are never
+    underestimated, and memory use is fixed however many distinct kmers are added.
+
+    :Example:
+    >>> cms = CountMinSketch()
+    >>> distinct_codes, counts = cms.update(codes)
+    """
+
+    MAX_COUNT = np.iinfo(np.uint16).max
+
+    def __init__(
+        self, width: int = DEFAULT_COUNT_MIN_WIDTH, depth: int = DEFAULT_COUNT_MIN_DEPTH
+    ) -> None:
+        """
+        Constructor
+
+        :param width: the number of counters per row, rounded up to a power of 2
+        :type width: int
+        :param depth: the number of rows, each with an independent hash
+        :type depth: int
+        """
+        if not 0 < depth <= len(HASH_MULTIPLIERS):
+            raise ValueError("depth must be between 1 and %i" % len(HASH_MULTIPLIERS))
+        self.bits = max(1, int(math.ceil(math.log2(width))))
+        self.width = 2 ** self.bits
+        self.depth = depth
+        self.table = np.zeros((self.depth, self.width), dtype=np.uint16)
+
+    def _indexes(self, mixed, row):
+        with np.errstate(over="ignore"):
+            hashed = mixed * np.uint64(HASH_MULTIPLIERS[row])
+        return (hashed >> np.uint64(64 - self.bits)).astype(np.int64)
+
+    def update(self, codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Count a batch of kmer codes
+
+        :param codes: kmer codes, which may repeat
+        :type codes: numpy.ndarray
+        :return: the distinct codes of the batch and their estimated counts so far, as a tuple of arrays
+        """
+        codes, counts = np.unique(codes, return_counts=True)
+        mixed = _mix(codes)
+        estimates = np.full(codes.shape, self.MAX_COUNT, dtype=np.uint16)
+        for row in range(self.depth):
+            indexes = self._indexes(mixed, row)
+            unique_indexes, inverse = np.unique(indexes, return_inverse=True)
+            added = np.bincount(inverse, weights=counts, minlength=len(unique_indexes))
+            table = self.table[row]
+            table[unique_indexes] = np.minimum(
+                table[unique_indexes].astype(np.int64) + added.astype(np.int64), self.MAX_COUNT
+            )
+            estimates = np.minimum(estimates, table[indexes])
+        return codes, estimates
+
+    def query(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Estimated counts of kmer codes
+
+        :param codes: kmer codes
+        :type codes: numpy.ndarray
+        :return: estimated counts
+        """
+        mixed = _mix(codes)
+        estimates = np.full(mixed.shape, self.MAX_COUNT, dtype=np.uint16)
+        for row in range(self.depth):
+            estimates = np.minimum(estimates, self.table[row][self._indexes(mixed, row)])
+        return estimates
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog estimate of the number of distinct kmer codes seen, in 2 ** precision one byte
+    registers. The standard error is about 1.04 / sqrt(2 ** precision), 0.8% by default.
+
+    :Example:
+    >>> hll = HyperLogLog()
+    >>> hll.update(codes)
+    >>> hll.estimate()
+    """
+
+    def __init__(self, precision: int = DEFAULT_HLL_PRECISION) -> None:
+        """
+        Constructor
+
+        :param precision: log2 of the number of registers
+        :type precision: int
+        """
+        if not MIN_HLL_PRECISION <= precision <= MAX_HLL_PRECISION:
+            raise ValueError(
+                "precision must be between %i and %i"
+                % (MIN_HLL_PRECISION, MAX_HLL_PRECISION)
+            )
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype=np.uint8)
+
+    def update(self, codes: np.ndarray) -> "HyperLogLog":
+        """
+        Add a batch of kmer codes, which may repeat
+
+        :param codes: kmer codes
+        :type codes: numpy.ndarray
+        """
+        hashed = _mix(codes)
+        indexes = (hashed >> np.uint64(64 - self.precision)).astype(np.int64)
+        ## The set low bit caps the rank at 64 - precision + 1
+        rest = (hashed << np.uint64(self.precision)) | np.uint64(
+            1 << (self.precision - 1)
+        )
+        ranks = (65 - _bit_length(rest)).astype(np.uint8)
+        np.maximum.at(self.registers, indexes, ranks)
+        return self
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """
+        Fold in another sketch of the same precision, giving the sketch of the union
+        """
+        if other.precision != self.precision:
+            raise ValueError("Can only merge HyperLogLogs of the same precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self) -> int:
+        """
+        Estimated number of distinct kmer codes added
+        """
+        num_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / num_registers)
+        raw = alpha * num_registers ** 2 / np.sum(2.0 ** -self.registers.astype(np.float64))
+        num_zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * num_registers and num_zeros:
+            ## Linear counting is more accurate for small cardinalities
+            return int(round(num_registers * math.log(num_registers / num_zeros)))
+        return int(round(raw))
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        hll = cls(data[0])
+        registers = np.frombuffer(data[1:], dtype=np.uint8)
+        if len(registers) != len(hll.registers):
+            raise ValueError("HyperLogLog data does not match its precision")
+        hll.registers[:] = registers
+        return hll